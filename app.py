@@ -1,31 +1,36 @@
 import os
 import json
-import pandas as pd
-import numpy as np
-import gradio as gr
-from gradio_folium import Folium
-from smolagents import CodeAgent, LiteLLMModel, HfApiModel
-from src.gradio_utils import ( create_map_from_markers,
-                              update_map_on_selection, 
-                              stream_to_gradio, 
-                              interact_with_agent, 
-                              toggle_visibility, 
-                              FINAL_MESSAGE_HEADER,
-                              MAP_URL)
-
-from src.prompts import SKI_TOURING_ASSISTANT_PROMPT
-from src.tools import (RefugeTool,
-                       MountainRangesTool,
-                      ForecastTool,
-                      GetRoutesTool,
-                      DescribeRouteTool, 
-                      RecentOutingsTool)
-from src.feedback import get_feedback_interface
-from folium import Map, TileLayer, Marker, Icon
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
+import weakref
+import time
+import threading
+from functools import lru_cache
+from src.metrics import metrics, start_metrics_server, startup
+
+with startup.phase("imports"):
+    import pandas as pd
+    import gradio as gr
+    from gradio_folium import Folium
+    from folium import Map, TileLayer
+    from dotenv import load_dotenv
+    from src.gradio_utils import ( create_map_from_markers,
+                                  update_map_on_selection, 
+                                  stream_to_gradio, 
+                                  interact_with_agent, 
+                                  toggle_visibility, 
+                                  routes_frame,
+                                  FINAL_MESSAGE_HEADER,
+                                  MAP_URL)
+    from src.prompts import SKI_TOURING_ASSISTANT_PROMPT
+    from src.feedback import get_feedback_interface, get_feedback_writer
+    from src.replay import configure_http_from_env, ScriptedModel, reset_script
+    from src.agent_pool import AgentPool, EngineSpec
+    from src.scheduler import get_scheduler, BoundedModel, QueueFull, SCHEDULER_MAX_RUNS, SCHEDULER_MAX_QUEUED
+
+with startup.phase("environment"):
+    # Load environment variables
+    load_dotenv()
+    # Record or replay the HTTP calls if configured, see src/replay.py
+    configure_http_from_env()
 
 
 required_variables = [
@@ -44,31 +49,77 @@ if missing_variables:
 
 print("All required variables are set.")
 
-# Load the summit clusters
-# Useful for assigning locations to mountain ranges
-with open("data/summit_clusters.json", "r") as f:
-    summit_clusters = json.load(f)
-    
-with open("data/skitour2mf_lookup.json", "r") as f:
-    skitour2mf_lookup = json.load(f)
+# Expose the Prometheus metrics of the tools, HTTP and LLM calls
+if os.environ.get("METRICS_PORT"):
+    start_metrics_server(int(os.environ["METRICS_PORT"]))
+
+@lru_cache(maxsize=None)
+def get_summit_clusters():
+    """Summit clusters, useful for assigning locations to mountain ranges."""
+    with open("data/summit_clusters.json", "r") as f:
+        return json.load(f)
+
+@lru_cache(maxsize=None)
+def get_skitour2mf_lookup():
+    """Mapping of the Skitour massif IDs to the Météo-France massif IDs."""
+    with open("data/skitour2mf_lookup.json", "r") as f:
+        return json.load(f)
+
+@lru_cache(maxsize=None)
+def get_shared_tools():
+    """Tools independent of the engine, stateless and shared by all the agents."""
+    # The tools import smolagents and the API clients, loaded on first use
+    from src.tools import MountainRangesTool, GetRoutesTool, SearchRoutesTool, RecentOutingsTool
+    return {
+        "mountain_ranges": MountainRangesTool(get_summit_clusters()),
+        "get_routes": GetRoutesTool(),
+        "search_routes": SearchRoutesTool(),
+        "recent_outings": RecentOutingsTool(),
+    }
+
+_engine_tools = weakref.WeakKeyDictionary()
+_engine_tools_lock = threading.Lock()
+
+def get_engine_tools(llm_engine):
+    """Tools summarizing with an engine, shared by all the agents of that engine."""
+    from src.tools import ForecastTool, DescribeRouteTool, DescribeRoutesTool
+    with _engine_tools_lock:
+        tools = _engine_tools.get(llm_engine)
+        if tools is None:
+            skitour2mf_lookup = get_skitour2mf_lookup()
+            tools = _engine_tools[llm_engine] = {
+                "forecast": ForecastTool(
+                    llm_engine=llm_engine, 
+                    clusters=get_summit_clusters(), 
+                    skitour2meteofrance=skitour2mf_lookup
+                    ),
+                "description_route": DescribeRouteTool(
+                    skitour2meteofrance=skitour2mf_lookup, 
+                    llm_engine=llm_engine
+                    ),
+                "description_routes": DescribeRoutesTool(
+                    skitour2meteofrance=skitour2mf_lookup, 
+                    llm_engine=llm_engine
+                    ),
+            }
+        return tools
 
 def get_tools(llm_engine):
-    mountain_ranges_tool = MountainRangesTool(summit_clusters)
-    forecast_tool = ForecastTool(
-        llm_engine=llm_engine, 
-        clusters=summit_clusters, 
-        skitour2meteofrance=skitour2mf_lookup
-        )
-    get_routes_tool = GetRoutesTool()
-    description_route_tool = DescribeRouteTool(
-        skitour2meteofrance=skitour2mf_lookup, 
-        llm_engine=llm_engine
-        )
-    recent_outings_tool = RecentOutingsTool()
-    return [mountain_ranges_tool, forecast_tool, get_routes_tool, description_route_tool, recent_outings_tool]
+    shared_tools = get_shared_tools()
+    engine_tools = get_engine_tools(llm_engine)
+    return [
+        shared_tools["mountain_ranges"],
+        engine_tools["forecast"],
+        shared_tools["get_routes"],
+        shared_tools["search_routes"],
+        engine_tools["description_route"],
+        engine_tools["description_routes"],
+        shared_tools["recent_outings"],
+    ]
 
 # Initialize the default agent
 def init_default_agent(llm_engine):
+    from smolagents import CodeAgent
     return CodeAgent(
             tools = get_tools(llm_engine),
             model = llm_engine,
@@ -81,6 +132,10 @@ def init_default_agent_prompt():
     return {"specific_agent_role_prompt": SKI_TOURING_ASSISTANT_PROMPT.format(language="French")}
 
 def create_llm_engine(type_engine: str, api_key: str = None):
+    from smolagents import LiteLLMModel, HfApiModel
+    if type_engine == "scripted":
+        # Offline runs: the agent steps are read from the script in ALPINE_AGENT_FAKE_LLM
+        return ScriptedModel.from_file(os.environ["ALPINE_AGENT_FAKE_LLM"])
     if type_engine == "openai/gpt-4o" and api_key:
         llm_engine = LiteLLMModel(model_id="openai/gpt-4o", api_key=api_key)
         return llm_engine
@@ -98,19 +153,117 @@ def create_llm_engine(type_engine: str, api_key: str = None):
     else:
         raise ValueError("Invalid engine type. Please choose either 'openai/gpt-4o' or 'Qwen/Qwen2.5-Coder-32B-Instruct'.")
     
+# Time between two updates of the queue position of a waiting run
+QUEUE_POLL_INTERVAL = 1.0
+# Maximum time an admitted run waits for an agent of its engine
+AGENT_LEASE_TIMEOUT = float(os.getenv("ALPINE_AGENT_LEASE_TIMEOUT", 300))
+
+def create_bounded_engine(spec: EngineSpec):
+    """
+    Create the engine of a spec, shared by the sessions selecting the same engine and API key.
+
+    Args:
+        spec (EngineSpec): Engine type and API key.
+
+    Returns:
+        Model: LLM engine.
+    """
+    # Calls to the engine are bounded across all the sessions and tools using it
+    return BoundedModel(create_llm_engine(spec.engine_type, spec.api_key), name=spec.engine_type)
+
+def get_engine(spec: EngineSpec):
+    """Return the engine of a spec, kept by the agent pool as long as it has agents using it."""
+    return get_agent_pool().engine(spec)
+
+@lru_cache(maxsize=None)
+def get_answer_cache():
+    """Cache of the answers to repeated questions, None if disabled."""
+    from src.answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+    return AnswerCache(get_skitour2mf_lookup()) if ANSWER_CACHE_ENABLED else None
+
+@lru_cache(maxsize=None)
+def get_agent_pool() -> AgentPool:
+    """Pool of the agents of all the sessions."""
+    return AgentPool(create_bounded_engine, init_default_agent)
+
 def initialize_new_agent(engine_type, api_key):
+    spec = EngineSpec(engine_type, api_key or None)
     try:
-        llm_engine = create_llm_engine(engine_type, api_key)
-        tools = get_tools(llm_engine)
-        skier_agent =  CodeAgent(
-            tools = tools,
-            model = llm_engine,
-            additional_authorized_imports=["pandas"],
-            max_steps=10,
-    )
-        return skier_agent, [], gr.Chatbot([], label="Agent Thoughts", type="messages")
+        get_engine(spec)
     except ValueError as e:
-        return str(e)
+        raise gr.Error(str(e))
+    return spec, [], gr.Chatbot([], label="Agent Thoughts", type="messages")
+
+def replay_answer(prompt, messages, df_routes, final_message, itineraries):
+    """Show a cached answer in the chat, with its itineraries on the map."""
+    messages.append(gr.ChatMessage(role="user", content=prompt))
+    messages.append(gr.ChatMessage(
+        role="assistant",
+        content=f"**Final answer:**\n{final_message}\n",
+        metadata={"title": "⚡ Answered from a recent identical question"},
+    ))
+    if itineraries:
+        df_routes = routes_frame(itineraries)
+    yield (messages, df_routes, gr.Markdown(value=FINAL_MESSAGE_HEADER + f": {final_message}", container=True))
+
+def run_agent(spec: EngineSpec, prompt, messages, df_routes, additional_args, request: gr.Request = None):
+    """
+    Run the agent of the session engine once the scheduler admits the run, showing the position
+    of the run in the queue while it waits. The agent is leased from the agent pool for the run,
+    waiting at most `AGENT_LEASE_TIMEOUT` seconds for one.
+
+    Questions already answered from avalanche bulletins and forecasts that are still current
+    are answered from the answer cache, without queuing.
+    """
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        cached = answer_cache.get(prompt, additional_args, spec.engine_type)
+        if cached is not None:
+            yield from replay_answer(prompt, messages, df_routes, *cached)
+            return
+
+    dependencies = set()
+    def store_answer(final_message, itineraries):
+        if answer_cache is None:
+            return
+        try:
+            answer_cache.set(prompt, additional_args, spec.engine_type, final_message, itineraries, dependencies)
+        except Exception as e:
+            print(f"Answer not cached: {e!r}")
+
+    try:
+        ticket = get_scheduler().submit(request.session_hash if request else "anonymous")
+    except QueueFull as e:
+        raise gr.Error(str(e))
+    try:
+        while not ticket.wait(QUEUE_POLL_INTERVAL):
+            waiting = f"{FINAL_MESSAGE_HEADER}\n\n⏳ Waiting for a free agent, position in queue: {ticket.position()}"
+            yield (messages, df_routes, gr.Markdown(value=waiting, container=True))
+        # Admitted runs may still wait for an agent if the pool is smaller than the scheduler limit
+        pool = get_agent_pool()
+        start = time.monotonic()
+        while True:
+            try:
+                agent = pool.acquire(spec, timeout=QUEUE_POLL_INTERVAL)
+                break
+            except TimeoutError:
+                if time.monotonic() - start >= AGENT_LEASE_TIMEOUT:
+                    metrics.inc("agent_pool_timeouts_total", engine=spec.engine_type)
+                    raise gr.Error("No agent became available in time, please retry in a few minutes.")
+                waiting = f"{FINAL_MESSAGE_HEADER}\n\n⏳ Waiting for a free {spec.engine_type} agent..."
+                yield (messages, df_routes, gr.Markdown(value=waiting, container=True))
+        metrics.observe("agent_pool_wait_seconds", time.monotonic() - start, engine=spec.engine_type)
+        # Offline runs of the scripted engine each replay the script from its first step
+        reset_script(agent.model)
+        try:
+            yield from interact_with_agent(
+                agent, prompt, messages, df_routes, additional_args,
+                dependencies=dependencies, on_final_answer=store_answer,
+            )
+        finally:
+            pool.release(spec, agent)
+    finally:
+        ticket.release()
     
 # Sample data for demonstration
 sample_data = {
@@ -122,11 +275,48 @@ sample_data = {
 }
 df_sample_routes = pd.DataFrame(sample_data)
 
-# Default engine
-if os.environ.get("OPENAI_API_KEY"):
-    default_engine = create_llm_engine("openai/o1", os.environ.get("OPENAI_API_KEY"))
-else:
-    default_engine = create_llm_engine("Qwen/Qwen2.5-Coder-32B-Instruct")
+def get_default_engine_spec() -> EngineSpec:
+    """
+    Return the default engine of the sessions.
+
+    Returns:
+        EngineSpec: Default engine type and API key.
+    """
+    if os.environ.get("ALPINE_AGENT_FAKE_LLM"):
+        return EngineSpec("scripted")
+    elif os.environ.get("OPENAI_API_KEY"):
+        return EngineSpec("openai/o1", os.environ.get("OPENAI_API_KEY"))
+    return EngineSpec("Qwen/Qwen2.5-Coder-32B-Instruct")
+
+def warm_up():
+    """
+    Load the agent dependencies, the data files, the answer cache, an agent of the default engine and the feedback writer
+    in a background thread, while the UI starts and before the first request needs them.
+
+    Returns:
+        threading.Thread: Warm-up thread.
+    """
+    def run():
+        try:
+            with startup.phase("agent_imports"):
+                import smolagents
+                import src.tools
+            with startup.phase("data"):
+                get_summit_clusters()
+                get_skitour2mf_lookup()
+            with startup.phase("answer_cache"):
+                get_answer_cache()
+            with startup.phase("default_agent"):
+                get_agent_pool().prewarm(get_default_engine_spec())
+            with startup.phase("feedback_writer"):
+                get_feedback_writer()
+        except Exception as e:
+            print(f"Warm-up failed, loading on first use instead: {e!r}")
+        print(startup.report())
+
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
 
 
 # Gradio UI
@@ -143,7 +333,8 @@ def build_ui():
     }
 """  
 
-    with gr.Blocks(
+    warm_up()
+    with startup.phase("build_ui"), gr.Blocks(
         theme=gr.themes.Soft(
             primary_hue=gr.themes.colors.blue,
             secondary_hue=gr.themes.colors.blue), css=custom_css
@@ -186,7 +377,8 @@ Profitez de vos aventures en ski de randonnée en France, mais vérifiez toujour
         
 
         
-        skier_agent = gr.State(lambda: init_default_agent(default_engine))
+        # Sessions only hold their engine, agents are leased from the shared pool for each run
+        skier_agent = gr.State(get_default_engine_spec())
         with gr.Tab("🤖"):
             with gr.Row():
                 with gr.Column():
@@ -247,7 +439,9 @@ Profitez de vos aventures en ski de randonnée en France, mais vérifiez toujour
                     )
 
                 text_input.submit(lambda s: (s, ""), [text_input], [stored_message, text_input]) \
-                    .then(interact_with_agent, [skier_agent, stored_message, chatbot, df_routes, skier_agent_prompt], [chatbot, df_routes, text_output])
+                    .then(run_agent, [skier_agent, stored_message, chatbot, df_routes, skier_agent_prompt], [chatbot, df_routes, text_output],
+                          # Runs are admitted by the run scheduler rather than by the Gradio queue
+                          concurrency_limit=None)
 
                 df_routes.change(create_map_from_markers, [df_routes], [f_map]).then(lambda s: gr.DataFrame(s[["Name", "Route Link"]], datatype="markdown", interactive=False), [df_routes], [data])
                 data.select(
@@ -255,7 +449,9 @@ Profitez de vos aventures en ski de randonnée en France, mais vérifiez toujour
                 )
         get_feedback_interface()
 
-    demo.launch()
+    print(startup.report())
+    # Waiting runs hold a worker thread, leave room for them and for the other events
+    demo.queue(default_concurrency_limit=None).launch(max_threads=SCHEDULER_MAX_RUNS + SCHEDULER_MAX_QUEUED + 8)
 
 # Launch the app
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+"""
+Benchmark cases of the hot functions of the agent, run offline on fixture data.
+
+Each case is a setup function registered with `@benchmark`: it loads its inputs and returns
+the callable to measure, so loading fixtures is not part of the measure.
+"""
+import os
+import json
+import random
+from typing import Any, Callable, Dict
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+# Number of routes of the map and routes table cases, a large answer of the agent
+N_ROUTES = 300
+# Bounding box of the French Alps, where the random locations are drawn
+ALPS_BOUNDS = ((44.0, 46.4), (5.6, 7.7))
+SEED = 42
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark case.
+
+    Args:
+        name (str): Name of the case, as `<area>.<function>`.
+
+    Returns:
+        Callable: Decorator of the setup function of the case.
+    """
+    def register(setup: Callable[[], Callable[[], Any]]):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def load_clusters() -> Dict:
+    with open(os.path.join(DATA_DIR, "summit_clusters.json"), "r") as f:
+        return json.load(f)
+
+def load_bulletin(name: str = "bra_mont-blanc.xml") -> str:
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+def random_locations(n: int, seed: int = SEED):
+    rng = random.Random(seed)
+    (lat_min, lat_max), (lon_min, lon_max) = ALPS_BOUNDS
+    return [(rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max)) for _ in range(n)]
+
+def random_itineraries(n: int = N_ROUTES, seed: int = SEED):
+    return [
+        {
+            "id": i,
+            "Name": f"Sommet {i}, par le couloir {i % 7}",
+            "Latitude": latitude,
+            "Longitude": longitude,
+            "Route Link": f"https://skitour.fr/topos/{1000 + i}",
+        }
+        for i, (latitude, longitude) in enumerate(random_locations(n, seed))
+    ]
+
+def agent_output(n_lines: int = 400, with_blob: bool = True) -> str:
+    """Build a long agent output, with a topo dict in the middle if `with_blob`."""
+    rng = random.Random(SEED)
+    lines = [
+        f"Thought: step {i}, checking the route {rng.randint(1, 5000)} in massif {rng.randint(1, 40)} "
+        f"with {{'denivele': {rng.randint(300, 2000)}}} and 'orientation': 'N'."
+        for i in range(n_lines)
+    ]
+    if with_blob:
+        blob = json.dumps({
+            "topo_id": "770",
+            "name": "Mont Blanc, Par les Grands Mulets",
+            "latitude": 45.90181,
+            "longitude": 6.86153,
+            "difficulty": "5.2",
+            "denivele": 3800,
+            "description": "Long itinéraire glaciaire. " * 40,
+        }, ensure_ascii=False)
+        lines.insert(n_lines // 2, blob)
+    return "\n".join(lines)
+
+
+@benchmark("clusters.assign_location")
+def bench_assign_location():
+    from src.utils import assign_location_to_clusters
+    clusters = load_clusters()
+    location = random_locations(1)[0]
+    return lambda: assign_location_to_clusters(location, clusters)
+
+@benchmark("clusters.assign_locations_100")
+def bench_assign_locations():
+    from src.utils import assign_locations_to_clusters
+    clusters = load_clusters()
+    locations = random_locations(100)
+    return lambda: assign_locations_to_clusters(locations, clusters)
+
+@benchmark("clusters.build_index")
+def bench_build_index():
+    from src.utils import SummitIndex
+    clusters = load_clusters()
+    return lambda: SummitIndex(clusters)
+
+@benchmark("bra.extraire_texte")
+def bench_extraire_texte():
+    import xml.etree.ElementTree as ET
+    from src.meteo_france_api import extraire_texte
+    root = ET.fromstring(load_bulletin())
+    return lambda: extraire_texte(root)
+
+@benchmark("bra.parse_massif_conditions")
+def bench_parse_massif_conditions():
+    from src.meteo_france_api import parse_massif_conditions
+    xml_text = load_bulletin()
+    return lambda: parse_massif_conditions(xml_text)
+
+@benchmark("bra.parse_bulletin")
+def bench_parse_bulletin():
+    from src.bra import parse_bulletin
+    xml_text = load_bulletin()
+    return lambda: parse_bulletin(xml_text)
+
+@benchmark("bra.render_massif_conditions")
+def bench_render_massif_conditions():
+    from src.meteo_france_api import render_massif_conditions
+    xml_text = load_bulletin()
+    return lambda: render_massif_conditions(xml_text)
+
+@benchmark("topo_blob.parse_topo_blob")
+def bench_parse_topo_blob():
+    from src.utils import parse_topo_blob
+    output = agent_output()
+    return lambda: parse_topo_blob(output)
+
+@benchmark("topo_blob.parse_topo_blob_no_match")
+def bench_parse_topo_blob_no_match():
+    from src.utils import parse_topo_blob
+    output = agent_output(with_blob=False)
+    return lambda: parse_topo_blob(output)
+
+@benchmark("map.create_map_from_markers")
+def bench_create_map():
+    from src.gradio_utils import create_map_from_markers, map_cache, routes_frame
+    df_routes = routes_frame(random_itineraries())
+
+    def create_map():
+        # Every call builds and renders the map, rather than hitting the map cache
+        map_cache.clear()
+        return create_map_from_markers(df_routes.copy())
+    return create_map
+
+@benchmark("map.render_html")
+def bench_render_map():
+    from src.gradio_utils import build_routes_map, routes_frame
+    df_routes = routes_frame(random_itineraries())
+    return lambda: build_routes_map(df_routes).get_root().render()
+
+@benchmark("map.select_route")
+def bench_select_route():
+    from src.gradio_utils import update_map_on_selection, routes_frame
+    df_routes = routes_frame(random_itineraries())
+    return lambda: update_map_on_selection(df_routes[["Name", "Route Link"]], df_routes)
+
+@benchmark("stream.routes_frame")
+def bench_routes_frame():
+    from src.gradio_utils import routes_frame
+    itineraries = random_itineraries()
+    return lambda: routes_frame(itineraries)
@@ -0,0 +1,126 @@
+"""
+Offline microbenchmarks of the hot functions of the agent, compared with committed baselines.
+
+Run from the root of the repository:
+    python -m benchmarks.run                  # run and compare with benchmarks/baselines.json
+    python -m benchmarks.run -k bra           # only the cases whose name contains "bra"
+    python -m benchmarks.run --save           # record the results as the new baselines
+    python -m benchmarks.run --fail-over 1.25 # exit with an error if a case is 25% slower
+
+Baselines depend on the machine: record them and compare on the same host.
+"""
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import statistics
+from typing import Dict, Optional
+from benchmarks.cases import BENCHMARKS
+
+BASELINES_PATH = "benchmarks/baselines.json"
+REPEAT = 7
+# Ratios to the baseline within this tolerance are reported as unchanged
+NOISE_TOLERANCE = 0.1
+
+
+def run_case(name: str, repeat: int = REPEAT) -> Dict:
+    """
+    Measure one case: calls are grouped so that each measure lasts at least 0.2s.
+
+    Args:
+        name (str): Name of the case.
+        repeat (int): Number of measures.
+
+    Returns:
+        Dict: Median and minimum time per call in seconds, or the reason the case was skipped.
+    """
+    try:
+        fn = BENCHMARKS[name]()
+    except ImportError as e:
+        return {"skipped": f"missing dependency: {e.name}"}
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    times = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {"median": statistics.median(times), "min": min(times), "number": number}
+
+def load_baselines(path: str = BASELINES_PATH) -> Dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"results": {}}
+
+def save_baselines(results: Dict, path: str = BASELINES_PATH):
+    baselines = load_baselines(path)
+    baselines["machine"] = {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor()}
+    baselines["recorded_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    baselines["results"].update({name: result for name, result in results.items() if "skipped" not in result})
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+def report(results: Dict, baselines: Dict) -> Dict[str, Optional[float]]:
+    """
+    Print the comparison of the results with the baselines.
+
+    Args:
+        results (Dict): Results of `run_case` by name.
+        baselines (Dict): Baseline results by name.
+
+    Returns:
+        Dict[str, Optional[float]]: Ratio of the median time to the baseline by name, None without baseline.
+    """
+    ratios = {}
+    print(f"{'case':<40} {'median':>10} {'min':>10} {'baseline':>10} {'ratio':>7}")
+    for name, result in results.items():
+        if "skipped" in result:
+            print(f"{name:<40} skipped ({result['skipped']})")
+            continue
+        baseline = baselines.get(name)
+        ratio = result["median"] / baseline["median"] if baseline else None
+        ratios[name] = ratio
+        if ratio is None:
+            verdict, baseline_text, ratio_text = "new", "-", "-"
+        else:
+            verdict = "unchanged" if abs(ratio - 1) <= NOISE_TOLERANCE else ("slower" if ratio > 1 else "faster")
+            baseline_text, ratio_text = format_time(baseline["median"]), f"{ratio:.2f}x"
+        print(f"{name:<40} {format_time(result['median']):>10} {format_time(result['min']):>10} "
+              f"{baseline_text:>10} {ratio_text:>7}  {verdict}")
+    return ratios
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline microbenchmarks.")
+    parser.add_argument("-k", dest="pattern", default="", help="Only run the cases whose name contains PATTERN")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Number of measures per case")
+    parser.add_argument("--baselines", default=BASELINES_PATH, help="Path of the baselines file")
+    parser.add_argument("--save", action="store_true", help="Record the results as the new baselines")
+    parser.add_argument("--fail-over", type=float, help="Exit with an error if a case is more than RATIO times slower")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.pattern in name]
+    results = {name: run_case(name, repeat=args.repeat) for name in names}
+    ratios = report(results, load_baselines(args.baselines)["results"])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save:
+        save_baselines(results, args.baselines)
+        print(f"Baselines saved to {args.baselines}")
+    if args.fail_over:
+        regressions = [name for name, ratio in ratios.items() if ratio and ratio > args.fail_over]
+        if regressions:
+            print(f"Regressions over {args.fail_over}x: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from src.metrics import metrics
+from src.scheduler import SCHEDULER_MAX_RUNS
+
+# Maximum number of agents per engine, i.e. of concurrent runs of the same engine. It defaults to
+# the number of runs admitted by the scheduler, so that admitted runs do not wait for an agent.
+AGENT_POOL_SIZE = int(os.getenv("ALPINE_AGENT_POOL_SIZE", SCHEDULER_MAX_RUNS))
+# Idle agents and unused engines are kept for at most this many engines, least recently used first evicted
+AGENT_POOL_MAX_ENGINES = 16
+
+
+@dataclass(frozen=True)
+class EngineSpec:
+    """
+    Engine selected by a session: its type and, for engines billed to the user, their API key.
+
+    The key is kept out of the representation, and sessions share the engine and the agents
+    of a spec only if they use the same key.
+    """
+    engine_type: str
+    api_key: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def key(self) -> str:
+        if not self.api_key:
+            return self.engine_type
+        return f"{self.engine_type}#{hashlib.sha256(self.api_key.encode('utf-8')).hexdigest()[:16]}"
+
+
+def reset_agent(agent: Any):
+    """Drop the memory of the last run of an agent, so an idle agent holds no session data."""
+    if hasattr(agent, "memory"):
+        agent.memory.reset()
+    elif hasattr(agent, "logs"):
+        agent.logs = []
+
+
+class AgentPool:
+    """
+    Bounded pool of agents per engine, shared by all the sessions.
+
+    An agent runs one task at a time: runs lease an idle agent of their engine, or create one
+    while the engine has less than `max_size` agents, or wait for one to be released.
+    Agents are reset when released.
+
+    The pool also holds the engine of each spec, shared by its agents: an engine is kept as long
+    as agents of the spec exist, so that they all share the same engine and its concurrency limit.
+
+    Args:
+        engine_factory (Callable[[EngineSpec], Any]): Creates the engine of a spec.
+        factory (Callable[[Any], Any]): Creates an agent using an engine.
+        max_size (int): Maximum number of agents per engine.
+        max_engines (int): Maximum number of engines whose idle agents are kept.
+        reset (Callable[[Any], None]): Resets an agent between runs.
+    """
+
+    def __init__(
+        self,
+        engine_factory: Callable[[EngineSpec], Any],
+        factory: Callable[[Any], Any],
+        max_size: int = AGENT_POOL_SIZE,
+        max_engines: int = AGENT_POOL_MAX_ENGINES,
+        reset: Callable[[Any], None] = reset_agent,
+    ):
+        self.engine_factory = engine_factory
+        self.factory = factory
+        self.max_size = max_size
+        self.max_engines = max_engines
+        self.reset = reset
+        self._idle: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._engines: "OrderedDict[str, Any]" = OrderedDict()
+        self._condition = threading.Condition()
+        metrics.register_collector(self._collect)
+
+    def _collect(self):
+        with self._condition:
+            sizes = dict(self._sizes)
+            idle = {key: len(agents) for key, agents in self._idle.items()}
+        for key, size in sizes.items():
+            engine = key.split("#")[0]
+            yield "agent_pool_agents", {"engine": engine, "state": "idle"}, idle.get(key, 0)
+            yield "agent_pool_agents", {"engine": engine, "state": "busy"}, size - idle.get(key, 0)
+
+    def engine(self, spec: EngineSpec) -> Any:
+        """
+        Return the engine of a spec, created on first use.
+
+        Args:
+            spec (EngineSpec): Engine type and API key.
+
+        Returns:
+            Any: Engine shared by the agents of the spec.
+        """
+        key = spec.key
+        with self._condition:
+            engine = self._engines.get(key)
+            if engine is None:
+                engine = self._engines[key] = self.engine_factory(spec)
+                self._evict()
+            self._engines.move_to_end(key)
+            return engine
+
+    def acquire(self, spec: EngineSpec, timeout: Optional[float] = None) -> Any:
+        """
+        Lease an agent of an engine, waiting for one if the engine has `max_size` busy agents.
+
+        Args:
+            spec (EngineSpec): Engine of the agent.
+            timeout (float): Maximum waiting time in seconds, None to wait indefinitely.
+
+        Returns:
+            Any: Leased agent, to give back with `release`.
+
+        Raises:
+            TimeoutError: If no agent was available in time.
+        """
+        key = spec.key
+        with self._condition:
+            available = self._condition.wait_for(
+                lambda: self._idle.get(key) or self._sizes.get(key, 0) < self.max_size, timeout=timeout
+            )
+            if not available:
+                raise TimeoutError(f"No agent available for {spec.engine_type}.")
+            idle = self._idle.get(key)
+            if idle:
+                self._idle.move_to_end(key)
+                return idle.pop()
+            self._sizes[key] = self._sizes.get(key, 0) + 1
+        try:
+            return self.factory(self.engine(spec))
+        except BaseException:
+            with self._condition:
+                self._sizes[key] -= 1
+                self._condition.notify_all()
+            raise
+
+    def release(self, spec: EngineSpec, agent: Any):
+        """
+        Reset an agent and give it back to the pool.
+
+        Args:
+            spec (EngineSpec): Engine of the agent.
+            agent (Any): Agent leased with `acquire`.
+        """
+        key = spec.key
+        try:
+            self.reset(agent)
+        except Exception:
+            # An agent that cannot be reset is dropped, a new one is created when needed
+            with self._condition:
+                self._sizes[key] -= 1
+                self._condition.notify_all()
+            return
+        with self._condition:
+            self._idle.setdefault(key, []).append(agent)
+            self._idle.move_to_end(key)
+            self._evict()
+            self._condition.notify_all()
+
+    def _evict(self):
+        # Drop the idle agents of the least recently used engines
+        for key in list(self._idle):
+            if len(self._idle) <= self.max_engines:
+                break
+            self._sizes[key] -= len(self._idle.pop(key))
+            if not self._sizes[key]:
+                del self._sizes[key]
+        # Drop the least recently used engines without agents, the others are still used by them
+        for key in [key for key in self._engines if key not in self._sizes]:
+            if len(self._engines) <= self.max_engines:
+                break
+            del self._engines[key]
+
+    @contextmanager
+    def lease(self, spec: EngineSpec, timeout: Optional[float] = None):
+        """
+        Lease an agent for the duration of a run.
+
+        Args:
+            spec (EngineSpec): Engine of the agent.
+            timeout (float): Maximum waiting time in seconds, None to wait indefinitely.
+
+        Yields:
+            Any: Leased agent.
+        """
+        agent = self.acquire(spec, timeout=timeout)
+        try:
+            yield agent
+        finally:
+            self.release(spec, agent)
+
+    def prewarm(self, spec: EngineSpec):
+        """Create an idle agent for an engine, so that its first run does not wait for it."""
+        with self.lease(spec):
+            pass
@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import time
+import difflib
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from src.cache import TTLCache, CACHE_DIR, MISSING
+from src.metrics import metrics, register_cache
+from src.utils import normalize_query
+from src.meteo_france_api import bulletin_cache, forecast_cache
+
+# Answers are reused at most this long, and never after the data they were built from changed
+ANSWER_CACHE_TTL = float(os.getenv("ALPINE_AGENT_ANSWER_CACHE_TTL", 6 * 3600))
+ANSWER_CACHE_SIZE = 512
+# Set to 0 to disable the answer cache
+ANSWER_CACHE_ENABLED = os.getenv("ALPINE_AGENT_ANSWER_CACHE", "1") != "0"
+# Set to 1 to also reuse the answers of near-duplicate questions, with at least this similarity
+ANSWER_CACHE_FUZZY = os.getenv("ALPINE_AGENT_ANSWER_FUZZY", "0") == "1"
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ALPINE_AGENT_ANSWER_SIMILARITY", 0.9))
+# Massif names shorter than this are not matched in questions, to avoid false matches
+MIN_ALIAS_LENGTH = 4
+
+# Caches of the data an answer can depend on, by kind (see `src.cache.record_dependency`)
+DEPENDENCY_CACHES = {"bra": bulletin_cache, "forecast": forecast_cache}
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question so that trivial variants share a cache entry.
+
+    Args:
+        question (str): Question of the user.
+
+    Returns:
+        str: Lowercased question without accents, punctuation nor redundant whitespace.
+    """
+    return normalize_query(re.sub(r"[^\w\s]", " ", question))
+
+def massif_aliases(skitour2meteofrance: Dict) -> Dict[str, str]:
+    """
+    Build the lookup from the normalized names of the massifs to their Skitour id.
+
+    Args:
+        skitour2meteofrance (Dict): Lookup from Skitour massif id to Météo-France massif.
+
+    Returns:
+        Dict[str, str]: Skitour massif id by normalized name, sub-range name and Météo-France name.
+    """
+    aliases = {}
+    for massif_id, record in skitour2meteofrance.items():
+        names = [record.get("name", ""), *record.get("name", "").split(" - "), record.get("meteofrance_name", "")]
+        for name in names:
+            alias = normalize_question(name)
+            if len(alias) >= MIN_ALIAS_LENGTH:
+                aliases.setdefault(alias, str(massif_id))
+    return aliases
+
+def dependency_version(dependency: str) -> Optional[float]:
+    """
+    Get the version of a piece of data an answer depends on.
+
+    Args:
+        dependency (str): Dependency as "<kind>:<key>".
+
+    Returns:
+        float: Expiry of the cached data, which changes whenever it is downloaded again,
+            None if the data is not cached.
+    """
+    kind, _, key = dependency.partition(":")
+    cache = DEPENDENCY_CACHES.get(kind)
+    return cache.expiry(key) if cache is not None else None
+
+
+class AnswerCache:
+    """
+    Cache of the final answers of the agent, reused when the same question is asked again.
+
+    Answers are keyed by the normalized question, the prompt arguments (language), the engine and
+    the massifs named in the question. Each answer records the versions of the avalanche bulletins
+    and forecasts read while it was built, and is dropped as soon as one of them changed.
+
+    Args:
+        skitour2meteofrance (Dict): Lookup from Skitour massif id to Météo-France massif.
+        ttl (float): Maximum age of a reused answer in seconds.
+        path (str): Path of the SQLite file backing the cache, None for memory only.
+        fuzzy (bool): Also reuse the answers of near-duplicate questions.
+        similarity (float): Minimum similarity ratio of near-duplicate questions.
+    """
+
+    def __init__(
+        self,
+        skitour2meteofrance: Dict,
+        ttl: float = ANSWER_CACHE_TTL,
+        path: Optional[str] = os.path.join(CACHE_DIR, "answers.sqlite"),
+        fuzzy: bool = ANSWER_CACHE_FUZZY,
+        similarity: float = ANSWER_CACHE_SIMILARITY,
+    ):
+        self.aliases = massif_aliases(skitour2meteofrance)
+        self.ttl = ttl
+        self.fuzzy = fuzzy
+        self.similarity = similarity
+        self._cache = TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ttl, path=path)
+        # Questions answered per bucket (arguments, engine and massifs), for near-duplicate matching
+        self._questions: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        register_cache("answers", self._cache)
+
+    def massifs(self, question: str) -> List[str]:
+        """
+        Resolve the massifs named in a question.
+
+        Args:
+            question (str): Normalized question.
+
+        Returns:
+            List[str]: Sorted Skitour ids of the massifs.
+        """
+        padded = f" {question} "
+        return sorted({massif_id for alias, massif_id in self.aliases.items() if f" {alias} " in padded})
+
+    def _bucket(self, question: str, additional_args: Optional[Dict], engine: str) -> str:
+        payload = json.dumps(
+            [additional_args or {}, engine, self.massifs(question)], sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _key(self, bucket: str, question: str) -> str:
+        return hashlib.sha256(f"{bucket}\n{question}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Any:
+        entry = self._cache.get(key)
+        if entry is MISSING:
+            return MISSING
+        for dependency, version in entry["dependencies"].items():
+            if dependency_version(dependency) != version:
+                self._cache.invalidate(key)
+                metrics.inc("answer_cache_invalidations_total")
+                return MISSING
+        return entry
+
+    def _near_duplicate(self, bucket: str, question: str) -> Optional[str]:
+        with self._lock:
+            candidates = list(self._questions.get(bucket, []))
+        best, best_ratio = None, self.similarity
+        for candidate in candidates:
+            ratio = difflib.SequenceMatcher(None, question, candidate).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = candidate, ratio
+        return best
+
+    def get(self, question: str, additional_args: Optional[Dict], engine: str) -> Optional[Tuple[str, List[Dict]]]:
+        """
+        Get the answer to a question, if it was answered from data that is still current.
+
+        Args:
+            question (str): Question of the user.
+            additional_args (Dict): Prompt arguments of the run.
+            engine (str): Engine type of the run.
+
+        Returns:
+            Tuple[str, List[Dict]]: Final message and itineraries of the answer, None on a miss.
+        """
+        question = normalize_question(question)
+        bucket = self._bucket(question, additional_args, engine)
+        entry = self._lookup(self._key(bucket, question))
+        if entry is MISSING and self.fuzzy:
+            duplicate = self._near_duplicate(bucket, question)
+            if duplicate is not None:
+                entry = self._lookup(self._key(bucket, duplicate))
+        if entry is MISSING:
+            metrics.inc("answer_cache_requests_total", result="miss")
+            return None
+        metrics.inc("answer_cache_requests_total", result="hit")
+        return entry["final_message"], entry["itineraries"]
+
+    def set(
+        self,
+        question: str,
+        additional_args: Optional[Dict],
+        engine: str,
+        final_message: str,
+        itineraries: Optional[List[Dict]],
+        dependencies: Optional[set] = None,
+    ):
+        """
+        Store the answer to a question.
+
+        Answers that read no avalanche bulletin nor forecast, or depending on data that is not
+        cached anymore, are not stored since their freshness could not be checked; neither are
+        answers built from partial tool results (see `src.cache.record_unavailable`).
+
+        Args:
+            question (str): Question of the user.
+            additional_args (Dict): Prompt arguments of the run.
+            engine (str): Engine type of the run.
+            final_message (str): Final message of the answer.
+            itineraries (List[Dict]): Itineraries shown on the map with the answer.
+            dependencies (set): Data read during the run, as "<kind>:<key>".
+        """
+        if not dependencies or any(dependency.startswith("unavailable:") for dependency in dependencies):
+            return
+        versions = {dependency: dependency_version(dependency) for dependency in dependencies}
+        if any(version is None for version in versions.values()):
+            return
+        expires_at = min([time.time() + self.ttl, *versions.values()])
+        if expires_at <= time.time():
+            return
+        question = normalize_question(question)
+        bucket = self._bucket(question, additional_args, engine)
+        self._cache.set(
+            self._key(bucket, question),
+            {
+                "question": question,
+                "final_message": str(final_message),
+                "itineraries": itineraries or [],
+                "dependencies": versions,
+            },
+            expires_at=expires_at,
+        )
+        if self.fuzzy:
+            with self._lock:
+                questions = self._questions.setdefault(bucket, [])
+                if question not in questions:
+                    questions.append(question)
+                    # Keep the most recent questions of the bucket only
+                    del questions[:-ANSWER_CACHE_SIZE]
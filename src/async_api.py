@@ -0,0 +1,320 @@
+import os
+import copy
+import json
+import asyncio
+import datetime
+import contextvars
+import threading
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+import httpx
+from meteofrance_api.const import METEOFRANCE_API_URL as METEOFRANCE_WEBSERVICE_URL, METEOFRANCE_API_TOKEN
+from meteofrance_api.model import Forecast
+from src.skitour_api import (SKITOUR_API_URL,
+                             SKITOUR_TIMEOUT,
+                             SKITOUR_MAX_RETRIES,
+                             SKITOUR_BACKOFF_FACTOR,
+                             SKITOUR_POOL_SIZE,
+                             SKITOUR_MAX_WORKERS,
+                             check_topos)
+from src.cache import AsyncSingleFlight, MISSING, record_dependency
+from src.metrics import timed
+from src.replay import get_async_transport
+from src.meteo_france_api import (METEOFRANCE_API_URL,
+                                  bulletin_cache,
+                                  bulletin_expiry,
+                                  forecast_cache,
+                                  forecast_cell,
+                                  forecast_expiry,
+                                  forecast_key,
+                                  render_massif_conditions)
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class AsyncHTTPClient:
+    """
+    Base asyncio HTTP client with a pooled keep-alive connection pool and retries.
+
+    The underlying `httpx.AsyncClient` is created lazily, inside the event loop it is used from.
+
+    Args:
+        base_url (str): Base URL of the API.
+        service (str): Name of the API in the metrics.
+        headers (Dict[str, str]): Headers sent with every request.
+        timeout (Tuple[float, float]): Connect and read timeouts in seconds.
+        max_retries (int): Maximum number of retries per request.
+        backoff_factor (float): Backoff factor between retries in seconds.
+        pool_size (int): Maximum number of concurrent connections.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        service: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Tuple[float, float] = SKITOUR_TIMEOUT,
+        max_retries: int = SKITOUR_MAX_RETRIES,
+        backoff_factor: float = SKITOUR_BACKOFF_FACTOR,
+        pool_size: int = SKITOUR_POOL_SIZE,
+    ):
+        self.base_url = base_url
+        self.service = service
+        self.headers = headers or {}
+        self.timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.limits,
+                transport=get_async_transport(self.limits),
+            )
+        return self._client
+
+    async def get(self, endpoint: str, params: Optional[Dict] = None) -> httpx.Response:
+        """
+        Send a GET request, retrying with exponential backoff on 5xx responses and transport errors.
+
+        Args:
+            endpoint (str): Endpoint path relative to the API base URL.
+            params (Dict): Query parameters.
+
+        Returns:
+            httpx.Response: Response of the API.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                with timed("http_request", service=self.service, endpoint=endpoint.split('/')[0]):
+                    response = await self.client.get(endpoint, params=params)
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+            await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+
+    async def aclose(self):
+        """Close the pooled connections of the client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class AsyncSkitourClient(AsyncHTTPClient):
+    """
+    Asyncio client for the Skitour API, with the same endpoints as `src.skitour_api`.
+
+    Args:
+        token (str): Skitour API key, defaults to the `SKITOUR_API_TOKEN` environment variable.
+        **kwargs: Arguments forwarded to `AsyncHTTPClient`.
+    """
+
+    def __init__(self, token: Optional[str] = None, **kwargs):
+        super().__init__(SKITOUR_API_URL, "skitour", headers={'cle': token or os.getenv('SKITOUR_API_TOKEN') or ''}, **kwargs)
+
+    async def get_massifs(self) -> List[Dict]:
+        response = await self.get('massifs')
+        return response.json()
+
+    async def get_topos(self, ids_massif: str) -> List[Dict]:
+        response = await self.get('topos', params={'m': ids_massif})
+        response.raise_for_status()
+        return check_topos(json.loads(response.text.replace('\\\\', '\\')), ids_massif)
+
+    async def get_details_topo(self, id_topo: str) -> Dict:
+        response = await self.get(f'topo/{id_topo}')
+        return response.json()
+
+    async def get_sommets(self, massif_id: str) -> List[Dict]:
+        response = await self.get('sommets', params={'m': massif_id})
+        return [
+            {
+                "name": _sommets['sommet'],
+                "lat": float(_sommets['latlon'][0]),
+                "lon": float(_sommets['latlon'][1]),
+                "range": _sommets['massif']['nom'],
+            }
+            for _sommets in response.json()
+        ]
+
+    async def get_refuges(self, massif_ids: str) -> List[Dict]:
+        response = await self.get('refuges', params={'m': massif_ids})
+        return response.json()
+
+    async def get_outing(self, id_outing: str) -> Dict:
+        response = await self.get(f'sortie/{id_outing}')
+        return response.json()
+
+    async def get_recent_outings(self, massif_id: str, max_workers: int = SKITOUR_MAX_WORKERS) -> List[Dict]:
+        response = await self.get('sorties', params={'m': massif_id, 'j': 30})
+        outings = response.json()
+        if not outings:
+            return []
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def describe(outing: Dict):
+            outing['date'] = datetime.datetime.fromtimestamp(float(outing['date'])).strftime('%Y-%m-%d')
+            async with semaphore:
+                try:
+                    outing['description'] = await self.get_outing(outing['id'])
+                except (httpx.HTTPError, ValueError) as e:
+                    outing['description'] = {'error': f"Could not fetch outing {outing['id']}: {e}"}
+
+        await asyncio.gather(*(describe(outing) for outing in outings))
+        return outings
+
+
+class AsyncMeteoFranceClient:
+    """
+    Asyncio client for the Météo-France avalanche bulletin (BRA) and forecast APIs.
+
+    Args:
+        api_key (str): Météo-France public API key, defaults to the `METEO_FRANCE_API_TOKEN` environment variable.
+        access_token (str): Météo-France webservice token used for forecasts, defaults to the
+            `METEO_FRANCE_API_KEY` environment variable or the `meteofrance_api` public token.
+        **kwargs: Arguments forwarded to `AsyncHTTPClient`.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, access_token: Optional[str] = None, **kwargs):
+        self.bra = AsyncHTTPClient(
+            METEOFRANCE_API_URL,
+            "meteofrance_bra",
+            headers={'apikey': api_key or os.getenv('METEO_FRANCE_API_TOKEN') or '', 'accept': '*/*'},
+            **kwargs,
+        )
+        self.webservice = AsyncHTTPClient(METEOFRANCE_WEBSERVICE_URL, "meteofrance_forecast", **kwargs)
+        self.access_token = access_token or os.getenv('METEO_FRANCE_API_KEY') or METEOFRANCE_API_TOKEN
+        self._bulletin_flights = AsyncSingleFlight()
+        self._forecast_flights = AsyncSingleFlight()
+
+    async def get_massifs_meteo_france(self) -> List[Dict]:
+        response = await self.bra.get('liste-massifs')
+        return [
+            {
+                "id": massif['properties']['code'],
+                "nom": massif['properties']['title'],
+                "groupe": massif['properties']['Departemen'],
+            }
+            for massif in response.json()['features']
+        ]
+
+    async def fetch_bulletin(self, massif_id: str) -> str:
+        response = await self.bra.get('massif/BRA', params={'id-massif': massif_id, "format": "xml"})
+        response.raise_for_status()
+        bulletin_cache.set(str(massif_id), response.text, expires_at=bulletin_expiry(response.text))
+        return response.text
+
+    async def get_bulletin(self, massif_id: str, force_refresh: bool = False) -> str:
+        record_dependency("bra", str(massif_id))
+        if not force_refresh:
+            cached = bulletin_cache.get(str(massif_id))
+            if cached is not MISSING:
+                return cached
+        return await self._bulletin_flights.do(str(massif_id), lambda: self.fetch_bulletin(massif_id))
+
+    async def get_massif_conditions(self, massif_id: str, force_refresh: bool = False) -> str:
+        return render_massif_conditions(await self.get_bulletin(massif_id, force_refresh=force_refresh))
+
+    async def fetch_forecast(self, latitude: float, longitude: float, language: str = "fr") -> Dict:
+        key = forecast_key(latitude, longitude, language)
+        latitude, longitude = forecast_cell(latitude, longitude)
+        response = await self.webservice.get(
+            'forecast', params={'lat': latitude, 'lon': longitude, 'lang': language, 'token': self.access_token}
+        )
+        response.raise_for_status()
+        raw_forecast = response.json()
+        forecast_cache.set(key, raw_forecast, expires_at=forecast_expiry())
+        return raw_forecast
+
+    async def get_forecast(self, latitude: float, longitude: float, language: str = "fr") -> Forecast:
+        key = forecast_key(latitude, longitude, language)
+        record_dependency("forecast", key)
+        raw_forecast = forecast_cache.get(key)
+        if raw_forecast is MISSING:
+            raw_forecast = await self._forecast_flights.do(
+                key, lambda: self.fetch_forecast(latitude, longitude, language)
+            )
+        return Forecast(copy.deepcopy(raw_forecast))
+
+    async def aclose(self):
+        """Close the pooled connections of the client."""
+        await self.bra.aclose()
+        await self.webservice.aclose()
+
+
+_loop = None
+_loop_lock = threading.Lock()
+_skitour_client = None
+_meteo_france_client = None
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the event loop running the async clients, started in a daemon thread on first use.
+
+    Returns:
+        asyncio.AbstractEventLoop: Background event loop.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-api", daemon=True).start()
+                _loop = loop
+    return _loop
+
+def run_sync(coroutine: Awaitable, timeout: Optional[float] = None) -> Any:
+    """
+    Run a coroutine on the background event loop and wait for its result.
+
+    This is the bridge used by the synchronous `Tool.forward` methods. It is safe to call
+    from any thread, including threads already running their own event loop.
+
+    Args:
+        coroutine (Awaitable): Coroutine to run.
+        timeout (float): Maximum time to wait for the result in seconds.
+
+    Returns:
+        Any: Result of the coroutine.
+    """
+    context = contextvars.copy_context()
+
+    async def run_in_context():
+        # Propagate the caller's context variables (e.g. the trace of the current run)
+        for variable, value in context.items():
+            variable.set(value)
+        return await coroutine
+
+    return asyncio.run_coroutine_threadsafe(run_in_context(), get_event_loop()).result(timeout)
+
+def get_async_skitour_client() -> AsyncSkitourClient:
+    """
+    Return the asyncio Skitour client shared by the process.
+
+    Returns:
+        AsyncSkitourClient: Shared Skitour client.
+    """
+    global _skitour_client
+    if _skitour_client is None:
+        _skitour_client = AsyncSkitourClient()
+    return _skitour_client
+
+def get_async_meteo_france_client() -> AsyncMeteoFranceClient:
+    """
+    Return the asyncio Météo-France client shared by the process.
+
+    Returns:
+        AsyncMeteoFranceClient: Shared Météo-France client.
+    """
+    global _meteo_france_client
+    if _meteo_france_client is None:
+        _meteo_france_client = AsyncMeteoFranceClient()
+    return _meteo_france_client
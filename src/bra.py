@@ -0,0 +1,197 @@
+import io
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+ASPECTS = ["N", "NE", "E", "SE", "S", "SW", "W", "NW"]
+# Météo-France uses French cardinal points for the western aspects
+ASPECT_ALIASES = {"SO": "SW", "O": "W", "NO": "NW"}
+XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+
+@dataclass
+class RiskLevel:
+    """Avalanche risk level for an altitude band and a period of the bulletin."""
+    period: str
+    level: int
+    altitude_band: str = ""
+    trend: str = ""
+
+
+@dataclass
+class NewSnow:
+    """Fresh snow depth in centimeters over 24 hours, measured at `altitude`."""
+    date: str
+    altitude: str
+    min_cm: Optional[int] = None
+    max_cm: Optional[int] = None
+
+
+@dataclass
+class Bulletin:
+    """Typed record of an avalanche risk bulletin (BRA)."""
+    massif: str = ""
+    published_at: str = ""
+    valid_from: str = ""
+    valid_until: str = ""
+    max_risk: Optional[int] = None
+    risks: List[RiskLevel] = field(default_factory=list)
+    risk_comment: str = ""
+    aspects: List[str] = field(default_factory=list)
+    natural_risk: str = ""
+    accidental_risk: str = ""
+    summary: str = ""
+    stability: str = ""
+    snowpack: str = ""
+    weather: str = ""
+    snow_limit_north: str = ""
+    snow_limit_south: str = ""
+    new_snow: List[NewSnow] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        """Return True if nothing was recognized in the bulletin."""
+        return self.max_risk is None and not (self.risks or self.stability or self.snowpack or self.summary)
+
+    def to_text(self) -> str:
+        """
+        Render the bulletin in a compact text form, suited to LLM prompts.
+
+        Returns:
+            str: Compact text of the bulletin.
+        """
+        lines = [f"BRA {self.massif} published {self.published_at} valid until {self.valid_until}".strip()]
+        if self.max_risk is not None:
+            lines.append(f"Max risk: {self.max_risk}/5")
+        for risk in self.risks:
+            band = f" {risk.altitude_band}" if risk.altitude_band else ""
+            trend = f" -> {risk.trend}" if risk.trend else ""
+            lines.append(f"Risk {risk.period}{band}: {risk.level}/5{trend}")
+        if self.aspects:
+            lines.append(f"Aspects at risk: {', '.join(self.aspects)}")
+        for label, value in (
+            ("Comment", self.risk_comment),
+            ("Summary", self.summary),
+            ("Natural", self.natural_risk),
+            ("Accidental", self.accidental_risk),
+            ("Stability", self.stability),
+            ("Snowpack", self.snowpack),
+            ("Weather", self.weather),
+        ):
+            if value:
+                lines.append(f"{label}: {value}")
+        if self.snow_limit_north or self.snow_limit_south:
+            lines.append(f"Snow limit: N {self.snow_limit_north}m, S {self.snow_limit_south}m")
+        for snow in self.new_snow:
+            lines.append(f"New snow {snow.date} at {snow.altitude}m: {snow.min_cm}-{snow.max_cm}cm")
+        return "\n".join(lines)
+
+
+def _as_source(xml_text: str) -> io.BytesIO:
+    if isinstance(xml_text, bytes):
+        return io.BytesIO(xml_text)
+    # The text is already decoded, drop the declaration so its encoding is not applied twice
+    return io.BytesIO(XML_DECLARATION.sub("", xml_text, count=1).encode("utf-8"))
+
+def _clean(text: Optional[str]) -> str:
+    return " ".join((text or "").split())
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_risks(attributes: Dict[str, str], bulletin: Bulletin):
+    bulletin.max_risk = _to_int(attributes.get("RISQUEMAXI"))
+    bulletin.risk_comment = _clean(attributes.get("COMMENTAIRE"))
+    for period, suffix in (("J", ""), ("J+1", "J2")):
+        for band in ("1", "2"):
+            level = _to_int(attributes.get(f"RISQUE{band}{suffix}"))
+            if level is None or level < 0:
+                continue
+            bulletin.risks.append(RiskLevel(
+                period=period,
+                level=level,
+                altitude_band=_clean(attributes.get(f"LOC{band}{suffix}")),
+                trend=_clean(attributes.get(f"EVOLURISQUE{band}{suffix}")),
+            ))
+
+def _parse_aspects(attributes: Dict[str, str]) -> List[str]:
+    aspects = {ASPECT_ALIASES.get(name, name) for name, value in attributes.items() if value.lower() == "true"}
+    return [aspect for aspect in ASPECTS if aspect in aspects]
+
+def parse_bulletin(xml_text: str) -> Bulletin:
+    """
+    Parse an avalanche risk bulletin (BRA) in XML format into a typed record.
+
+    The document is streamed with `iterparse` and elements are released as soon as they are read.
+
+    Args:
+        xml_text (str): BRA in XML format.
+
+    Returns:
+        Bulletin: Parsed bulletin.
+    """
+    bulletin = Bulletin()
+    path: List[str] = []
+    new_snow_altitude = ""
+    for event, element in ET.iterparse(_as_source(xml_text), events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            path.append(tag)
+            if len(path) == 1:
+                bulletin.massif = element.get("MASSIF", "")
+                bulletin.published_at = element.get("DATEBULLETIN", "")
+                bulletin.valid_from = element.get("DATEVALIDITE", "")
+                bulletin.valid_until = element.get("DATEECHEANCE", "")
+            elif tag == "NEIGEFRAICHE":
+                new_snow_altitude = element.get("ALTITUDESS", "")
+            continue
+
+        path.pop()
+        parent = path[-1] if path else ""
+        if tag == "RISQUE" and parent == "CARTOUCHERISQUE":
+            _parse_risks(element.attrib, bulletin)
+        elif tag == "PENTE":
+            bulletin.aspects = _parse_aspects(element.attrib)
+        elif tag == "NATUREL":
+            bulletin.natural_risk = _clean("".join(element.itertext()))
+        elif tag == "ACCIDENTEL":
+            bulletin.accidental_risk = _clean("".join(element.itertext()))
+        elif tag == "RESUME":
+            bulletin.summary = _clean("".join(element.itertext()))
+        elif tag == "TEXTE" and parent == "STABILITE":
+            bulletin.stability = _clean("".join(element.itertext()))
+        elif tag == "TEXTE" and parent == "QUALITE":
+            bulletin.snowpack = _clean("".join(element.itertext()))
+        elif tag == "COMMENTAIRE" and parent == "METEO":
+            bulletin.weather = _clean("".join(element.itertext()))
+        elif tag == "ENNEIGEMENT":
+            bulletin.snow_limit_north = element.get("LIMITENORD", "")
+            bulletin.snow_limit_south = element.get("LIMITESUD", "")
+        elif tag == "NEIGE24H":
+            bulletin.new_snow.append(NewSnow(
+                date=element.get("DATE", ""),
+                altitude=new_snow_altitude,
+                min_cm=_to_int(element.get("SS241")),
+                max_cm=_to_int(element.get("SS242")),
+            ))
+        # Release each top-level section once all its children have been read
+        if len(path) == 1:
+            element.clear()
+    return bulletin
+
+def read_bulletin_dates(xml_text: str) -> Dict[str, str]:
+    """
+    Read the publication and validity dates of a bulletin without parsing the whole document.
+
+    Args:
+        xml_text (str): BRA in XML format.
+
+    Returns:
+        Dict[str, str]: Attributes of the root element of the bulletin.
+    """
+    for _, element in ET.iterparse(_as_source(xml_text), events=("start",)):
+        return dict(element.attrib)
+    return {}
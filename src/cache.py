@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+CACHE_DIR = os.getenv("ALPINE_AGENT_CACHE_DIR", ".cache")
+
+# Sentinel returned by `TTLCache.get` on a miss, so that `None` can be cached (negative caching)
+MISSING = object()
+
+# Cached data read by the current agent run, as "<kind>:<key>" (e.g. "bra:3"), see `record_dependency`
+current_dependencies: ContextVar[Optional[Set[str]]] = ContextVar("current_dependencies", default=None)
+
+
+def record_dependency(kind: str, key: str):
+    """
+    Record that the current agent run read a cached piece of data, so that results derived
+    from it can be invalidated when it changes.
+
+    Args:
+        kind (str): Kind of data, e.g. "bra" or "forecast".
+        key (str): Key of the data in its cache.
+    """
+    dependencies = current_dependencies.get()
+    if dependencies is not None:
+        dependencies.add(f"{kind}:{key}")
+
+def record_unavailable(key: str):
+    """
+    Record that the current agent run got a partial result, so that results derived from it
+    are not reused once the data is available again.
+
+    Args:
+        key (str): What could not be retrieved, e.g. "describe_route:770".
+    """
+    record_dependency("unavailable", key)
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache with per-entry expiry and an optional SQLite tier on disk.
+
+    Values stored in the disk tier must be JSON serializable.
+
+    Args:
+        maxsize (int): Maximum number of entries kept in memory.
+        ttl (float): Default time to live of an entry in seconds, None for no expiry.
+        path (str): Path of the SQLite file backing the cache, None for memory only.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+            self._db.commit()
+
+    def _expires_at(self, ttl: Optional[float], expires_at: Optional[float]) -> Optional[float]:
+        if expires_at is not None:
+            return expires_at
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl is not None else None
+
+    def _remember(self, key: str, value: Any, expires_at: Optional[float]):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        """
+        Get a value from the cache.
+
+        Args:
+            key (str): Key of the entry.
+            default (Any): Value returned on a miss, `MISSING` by default.
+
+        Returns:
+            Any: Cached value, or `default` if the entry is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._load(key)
+                if entry is not None:
+                    self._remember(key, *entry)
+            if entry is not None and (entry[1] is None or entry[1] > time.time()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self.invalidate(key)
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None):
+        """
+        Store a value in the cache.
+
+        Args:
+            key (str): Key of the entry.
+            value (Any): Value to store.
+            ttl (float): Time to live in seconds, defaults to the cache TTL.
+            expires_at (float): Absolute expiry timestamp, takes precedence over `ttl`.
+        """
+        with self._lock:
+            expires_at = self._expires_at(ttl, expires_at)
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at),
+                )
+                self._db.commit()
+
+    def expiry(self, key: str) -> Optional[float]:
+        """
+        Get the expiry timestamp of an entry.
+
+        Args:
+            key (str): Key of the entry.
+
+        Returns:
+            float: Expiry timestamp, None if the entry is missing or never expires.
+        """
+        with self._lock:
+            entry = self._entries.get(key) or self._load(key)
+            return entry[1] if entry is not None else None
+
+    def invalidate(self, key: str):
+        """
+        Remove an entry from the cache.
+
+        Args:
+            key (str): Key of the entry.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._db.commit()
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key) or self._load(key)
+            return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get the hit/miss counters of the cache.
+
+        Returns:
+            Dict[str, float]: Hits, misses, hit rate and number of entries in memory.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing the same key into a single execution.
+
+    Threads calling `do` with a key already in flight wait for, and share, the result
+    (or the exception) of the first call.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run `fn` unless a call with the same key is already in flight.
+
+        Args:
+            key (str): Key identifying the call.
+            fn (Callable[[], Any]): Function to run.
+
+        Returns:
+            Any: Result of the call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return future.result()
+
+
+class AsyncSingleFlight:
+    """
+    Coalesce concurrent coroutines sharing the same key into a single execution.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await `fn()` unless a call with the same key is already in flight.
+
+        Args:
+            key (str): Key identifying the call.
+            fn (Callable[[], Awaitable[Any]]): Coroutine function to run.
+
+        Returns:
+            Any: Result of the call.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
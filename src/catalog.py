@@ -0,0 +1,137 @@
+import json
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+from src.skitour_api import get_massifs
+
+SKITOUR2MF_LOOKUP_PATH = "data/skitour2mf_lookup.json"
+MASSIF_CATALOG_TTL = 24 * 3600
+
+
+class MassifCatalog:
+    """
+    Catalog of the Skitour massifs, loaded once and refreshed on a long TTL.
+
+    Massifs are indexed by id and by name, and joined with the Skitour to Météo-France
+    lookup so that the Météo-France massif id of a range comes from the same record.
+
+    Args:
+        skitour2meteofrance (Dict): Lookup from Skitour massif id to Météo-France massif.
+        ttl (float): Time in seconds after which the massif list is fetched again.
+        loader (Callable[[], List[Dict]]): Function fetching the list of massifs.
+    """
+
+    def __init__(self, skitour2meteofrance: Dict, ttl: float = MASSIF_CATALOG_TTL, loader: Callable[[], List[Dict]] = get_massifs):
+        self.skitour2meteofrance = skitour2meteofrance
+        self.ttl = ttl
+        self.loader = loader
+        self._by_id: Dict[str, Dict] = {}
+        self._by_name: Dict[str, str] = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Fetch the list of massifs and rebuild the indexes."""
+        massifs = self.loader()
+        by_id, by_name = {}, {}
+        for massif in massifs:
+            massif_id = str(massif['id'])
+            record = dict(massif)
+            record.update(self.skitour2meteofrance.get(massif_id, {}))
+            by_id[massif_id] = record
+            by_name[massif['nom']] = massif_id
+        self._by_id, self._by_name = by_id, by_name
+        self._loaded_at = time.time()
+
+    def _ensure_fresh(self):
+        if self._loaded_at is not None and time.time() - self._loaded_at < self.ttl:
+            return
+        with self._lock:
+            if self._loaded_at is not None and time.time() - self._loaded_at < self.ttl:
+                return
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the previous catalog if the refresh fails
+                if self._loaded_at is None:
+                    raise
+                self._loaded_at = time.time()
+
+    def get(self, massif_id: str) -> Optional[Dict]:
+        """
+        Get the record of a massif.
+
+        Args:
+            massif_id (str): Skitour id of the massif.
+
+        Returns:
+            Dict: Skitour massif joined with its Météo-France massif, None if unknown.
+        """
+        self._ensure_fresh()
+        return self._by_id.get(str(massif_id))
+
+    def id_for_name(self, name: str) -> Optional[str]:
+        """
+        Get the Skitour id of a massif from its name.
+
+        Args:
+            name (str): Name of the massif.
+
+        Returns:
+            str: Skitour id of the massif, None if unknown.
+        """
+        self._ensure_fresh()
+        return self._by_name.get(name)
+
+    def ids_for_names(self, names: List[str]) -> List[str]:
+        """
+        Get the Skitour ids of several massifs from their names, skipping unknown names.
+
+        Args:
+            names (List[str]): Names of the massifs.
+
+        Returns:
+            List[str]: Skitour ids of the massifs, in the order of `names`.
+        """
+        self._ensure_fresh()
+        return [self._by_name[name] for name in names if name in self._by_name]
+
+    def meteofrance_id(self, massif_id: str) -> Optional[int]:
+        """
+        Get the Météo-France massif id of a Skitour massif.
+
+        Args:
+            massif_id (str): Skitour id of the massif.
+
+        Returns:
+            int: Météo-France massif id, None if the massif has no bulletin.
+        """
+        record = self.get(massif_id)
+        if record is None:
+            record = self.skitour2meteofrance.get(str(massif_id), {})
+        return record.get('meteofrance_id')
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_massif_catalog(skitour2meteofrance: Optional[Dict] = None) -> MassifCatalog:
+    """
+    Return the massif catalog shared by the process, creating it on first use.
+
+    Args:
+        skitour2meteofrance (Dict): Lookup from Skitour massif id to Météo-France massif,
+            read from `SKITOUR2MF_LOOKUP_PATH` if not provided.
+
+    Returns:
+        MassifCatalog: Shared massif catalog.
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                if skitour2meteofrance is None:
+                    with open(SKITOUR2MF_LOOKUP_PATH, "r") as f:
+                        skitour2meteofrance = json.load(f)
+                _catalog = MassifCatalog(skitour2meteofrance)
+    return _catalog
@@ -1,30 +1,204 @@
 import datetime
-import csv
+import io
 import os
-import huggingface_hub
-from huggingface_hub import Repository
+import json
+import time
+import atexit
+import threading
 import gradio as gr
-from datasets import load_dataset, DatasetDict, Dataset, concatenate_datasets
+from typing import Dict, List, Optional, Tuple
+from src.cache import CACHE_DIR
 
 
 
 
 # Define the dataset repository on Hugging Face Hub
 HF_DATASET_REPO = "florentgbelidji/alpine-agent-feedback"
+# Append-only local log of the feedback, uploaded to the Hub in batches
+FEEDBACK_LOG_PATH = os.getenv("ALPINE_AGENT_FEEDBACK_LOG", os.path.join(CACHE_DIR, "feedback.jsonl"))
+# A batch is uploaded once it has this many rows, or once its oldest row is this old
+FEEDBACK_FLUSH_ROWS = int(os.getenv("ALPINE_AGENT_FEEDBACK_FLUSH_ROWS", 20))
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("ALPINE_AGENT_FEEDBACK_FLUSH_INTERVAL", 300))
 
 
-# Load or initialize the dataset
-try:
-    dataset = load_dataset(HF_DATASET_REPO)
-except FileNotFoundError:
-    # Initialize an empty dataset if it doesn't exist
-    dataset = DatasetDict({
-        "train": Dataset.from_dict({
-            "timestamp": [datetime.datetime.now().isoformat()],
-            "user_feedback": ["Initial feedback"],
-        })
-    })
-    dataset.push_to_hub(HF_DATASET_REPO, token=os.getenv("HF_TOKEN"))
+class FeedbackWriter:
+    """
+    Buffered writer of the feedback: submissions are appended to a local log and returned
+    immediately, and a background flusher uploads the new rows to the Hub dataset in batches.
+
+    Each batch is uploaded as its own parquet shard of the train split, named after its byte
+    range in the log, and the log offset is checkpointed once the upload succeeded. Rows not
+    uploaded yet survive restarts and are uploaded by the next flush; a batch uploaded again
+    after a crash overwrites its own shard instead of duplicating the rows.
+
+    Args:
+        repo_id (str): Hub dataset repository of the feedback.
+        log_path (str): Path of the local feedback log.
+        flush_rows (int): Number of pending rows triggering an upload.
+        flush_interval (float): Maximum time in seconds a row waits before being uploaded.
+        token (str): Hub token, defaults to the `HF_TOKEN` environment variable.
+    """
+
+    def __init__(
+        self,
+        repo_id: str = HF_DATASET_REPO,
+        log_path: str = FEEDBACK_LOG_PATH,
+        flush_rows: int = FEEDBACK_FLUSH_ROWS,
+        flush_interval: float = FEEDBACK_FLUSH_INTERVAL,
+        token: Optional[str] = None,
+    ):
+        self.repo_id = repo_id
+        self.log_path = log_path
+        self.offset_path = log_path + ".offset"
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.token = token or os.getenv("HF_TOKEN")
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._repo_ready = False
+
+    def append(self, feedback: str) -> Dict[str, str]:
+        """
+        Append a feedback to the local log, durably.
+
+        Args:
+            feedback (str): Feedback of the user.
+
+        Returns:
+            Dict[str, str]: Appended row.
+        """
+        row = {"timestamp": datetime.datetime.now().isoformat(), "user_feedback": feedback}
+        line = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._write_lock:
+            with open(self.log_path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        self._wake.set()
+        return row
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, offset: int):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def pending(self) -> Tuple[List[Dict[str, str]], int, int]:
+        """
+        Read the rows of the log not uploaded yet.
+
+        Returns:
+            Tuple[List[Dict[str, str]], int, int]: Pending rows, and the byte range they span in the log.
+        """
+        start = self._read_offset()
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(start)
+                data = f.read()
+        except FileNotFoundError:
+            return [], start, start
+        # A line still being written is left for the next flush
+        complete = data[:data.rfind(b"\n") + 1]
+        rows = [json.loads(line) for line in complete.splitlines() if line.strip()]
+        return rows, start, start + len(complete)
+
+    def _upload(self, rows: List[Dict[str, str]], start: int, end: int):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from huggingface_hub import HfApi
+
+        api = HfApi(token=self.token)
+        if not self._repo_ready:
+            api.create_repo(self.repo_id, repo_type="dataset", exist_ok=True)
+            self._repo_ready = True
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist(rows), buffer)
+        api.upload_file(
+            path_or_fileobj=buffer.getvalue(),
+            path_in_repo=f"data/train-feedback-{start:012d}-{end:012d}.parquet",
+            repo_id=self.repo_id,
+            repo_type="dataset",
+            commit_message=f"Add {len(rows)} feedback rows",
+        )
+
+    def flush(self, force: bool = True) -> int:
+        """
+        Upload the pending rows as one batch.
+
+        Args:
+            force (bool): Upload even if the size and time thresholds are not reached.
+
+        Returns:
+            int: Number of uploaded rows.
+        """
+        with self._flush_lock:
+            rows, start, end = self.pending()
+            if not rows:
+                return 0
+            oldest = datetime.datetime.fromisoformat(rows[0]["timestamp"]).timestamp()
+            due = len(rows) >= self.flush_rows or time.time() - oldest >= self.flush_interval
+            if not (force or due):
+                return 0
+            self._upload(rows, start, end)
+            self._write_offset(end)
+            return len(rows)
+
+    def start(self) -> "FeedbackWriter":
+        """Start the background flusher, which also uploads the rows left by a previous run."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="feedback-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.flush(force=False)
+            except Exception as e:
+                # The rows stay in the log and are uploaded by a next flush
+                print(f"Feedback upload failed: {e!r}")
+            self._wake.wait(min(self.flush_interval, 60))
+            self._wake.clear()
+
+    def close(self):
+        """Stop the flusher and upload the pending rows."""
+        self._stop.set()
+        self._wake.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Feedback upload failed, rows kept in {self.log_path}: {e!r}")
+
+
+_feedback_writer = None
+_feedback_writer_lock = threading.Lock()
+
+def get_feedback_writer() -> FeedbackWriter:
+    """
+    Return the shared feedback writer, starting its flusher on first use.
+
+    Returns:
+        FeedbackWriter: Shared feedback writer.
+    """
+    global _feedback_writer
+    with _feedback_writer_lock:
+        if _feedback_writer is None:
+            _feedback_writer = FeedbackWriter().start()
+        return _feedback_writer
 
 
 def get_feedback_interface():
@@ -34,21 +208,9 @@ def get_feedback_interface():
         feedback_response = gr.Markdown(label="feedback_response")
 
         def add_feedback(feedback):
-            from datetime import datetime
-
-            # Append feedback to the dataset
-            new_data = {
-                "timestamp": [datetime.now().isoformat()],
-                "user_feedback": [feedback],
-            }
-            new_entry = Dataset.from_dict(new_data)
-            global dataset
-            dataset["train"] = concatenate_datasets([dataset["train"], new_entry])
-
-            # Push updated dataset to the Hub
-            dataset.push_to_hub(HF_DATASET_REPO)
+            # Append feedback to the local log, it is uploaded to the Hub in the background
+            get_feedback_writer().append(feedback)
 
             return "Thank you for your feedback!"
 
         submit_button.click(add_feedback, inputs=[feedback_input], outputs=[feedback_response])
-
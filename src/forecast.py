@@ -0,0 +1,101 @@
+import pandas as pd
+from typing import Any, Dict, List
+
+FORECAST_HOURS = 24
+# Periods of the day the hourly forecast is aggregated into, as [start hour, end hour)
+FORECAST_PERIODS = {"night": (0, 6), "morning": (6, 12), "afternoon": (12, 18), "evening": (18, 24)}
+
+# Columns of the hourly frame and the fields of the Météo-France forecast they come from
+FORECAST_COLUMNS = {
+    "temperature": "T.value",
+    "windchill": "T.windchill",
+    "wind_speed": "wind.speed",
+    "wind_gust": "wind.gust",
+    "rain": "rain.1h",
+    "snow": "snow.1h",
+    "freezing_level": "iso0",
+    "clouds": "clouds",
+    "weather": "weather.desc",
+}
+
+
+def forecast_frame(hourly: List[Dict[str, Any]], timezone: str = "Europe/Paris") -> pd.DataFrame:
+    """
+    Load hourly Météo-France forecast entries into a columnar frame.
+
+    Args:
+        hourly (List[Dict[str, Any]]): Hourly entries of `Forecast.forecast`.
+        timezone (str): Timezone of the forecast position.
+
+    Returns:
+        pd.DataFrame: One row per hour with a localized `time` column and numeric columns.
+    """
+    raw = pd.json_normalize(hourly)
+    frame = pd.DataFrame({"time": pd.to_datetime(raw["dt"], unit="s", utc=True).dt.tz_convert(timezone)})
+    for column, source in FORECAST_COLUMNS.items():
+        values = raw[source] if source in raw else pd.Series(index=raw.index, dtype="float64")
+        frame[column] = values if column == "weather" else pd.to_numeric(values, errors="coerce")
+    return frame
+
+def reduce_forecast(forecast: Any, hours: int = FORECAST_HOURS) -> pd.DataFrame:
+    """
+    Aggregate the next hours of a forecast per period of the day.
+
+    Args:
+        forecast (Forecast): Météo-France forecast.
+        hours (int): Number of hourly entries to aggregate.
+
+    Returns:
+        pd.DataFrame: One row per (date, period) with temperature range, wind, precipitation,
+            freezing level, cloud cover and dominant weather.
+    """
+    timezone = forecast.position.get("timezone", "Europe/Paris")
+    frame = forecast_frame(forecast.forecast[:hours], timezone)
+    hour = frame["time"].dt.hour
+    frame["date"] = frame["time"].dt.strftime("%Y-%m-%d")
+    frame["period"] = pd.cut(
+        hour,
+        bins=[start for start, _ in FORECAST_PERIODS.values()] + [24],
+        labels=list(FORECAST_PERIODS),
+        right=False,
+    )
+    grouped = frame.groupby(["date", "period"], observed=True, sort=False)
+    table = grouped.agg(
+        t_min=("temperature", "min"),
+        t_max=("temperature", "max"),
+        windchill_min=("windchill", "min"),
+        wind_max=("wind_speed", "max"),
+        gust_max=("wind_gust", "max"),
+        rain_mm=("rain", "sum"),
+        snow_mm=("snow", "sum"),
+        iso0_min=("freezing_level", "min"),
+        iso0_max=("freezing_level", "max"),
+        clouds=("clouds", "mean"),
+        weather=("weather", lambda values: values.mode().iat[0] if values.notna().any() else ""),
+    )
+    return table.round(1).reset_index()
+
+def render_forecast(table: pd.DataFrame) -> str:
+    """
+    Render an aggregated forecast as a compact text table.
+
+    Args:
+        table (pd.DataFrame): Output of `reduce_forecast`.
+
+    Returns:
+        str: Compact table, one line per period.
+    """
+    return table.to_string(index=False, na_rep="-")
+
+def compact_forecast(forecast: Any, hours: int = FORECAST_HOURS) -> str:
+    """
+    Reduce a forecast to a compact per-period table, in text form.
+
+    Args:
+        forecast (Forecast): Météo-France forecast.
+        hours (int): Number of hourly entries to aggregate.
+
+    Returns:
+        str: Compact forecast table.
+    """
+    return render_forecast(reduce_forecast(forecast, hours=hours))
@@ -1,34 +1,155 @@
-
+import os
+import json
+import hashlib
+from typing import TYPE_CHECKING, Callable, Optional
 import gradio as gr
 import numpy as np
 import pandas as pd
 from gradio_folium import Folium
 #from smolagents.gradio_ui import pull_messages_from_step
-from smolagents.types import handle_agent_output_types, AgentText
-from smolagents.agents import ActionStep
-from folium import Map, TileLayer, Marker, Icon, Popup
-from folium.plugins import Fullscreen   
+from folium import Map, TileLayer
+from folium.plugins import Fullscreen, FastMarkerCluster
+from src.cache import TTLCache, MISSING, current_dependencies
+from src.metrics import metrics, run_trace, current_trace, iterate_in_context, register_cache
+
+if TYPE_CHECKING:
+    from smolagents.agents import ActionStep
 
 FINAL_MESSAGE_HEADER = "**Final answer/ Réponse finale** \n 🤖⛷️💭"
 
 MAP_URL = "https://{s}.tile.openstreetmap.fr/osmfr/{z}/{x}/{y}.png"
 
+THOUGHTS_TITLE = "🤔💭🔄"
+OBSERVATIONS_TITLE = "📋"
+# Observations longer than this are truncated in the chat
+MAX_OBSERVATION_CHARS = int(os.getenv("ALPINE_AGENT_MAX_OBSERVATION_CHARS", 2000))
+
+ROUTE_COLUMNS = ["id", "Name", "Latitude", "Longitude", "Route Link"]
+# Columns of the routes shown on the map, which identify a rendered map
+MAP_COLUMNS = ["Name", "Latitude", "Longitude", "Route Link"]
+MAP_CACHE_SIZE = 64
+MAP_CACHE_TTL = 24 * 3600
+DEFAULT_MAP_LOCATION = [45.9237, 6.8694]
+
+# Creates the marker of a route from its [latitude, longitude, name, link] row
+ROUTE_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.AwesomeMarkers.icon({icon: 'fa-map-marker', prefix: 'fa', markerColor: 'blue'})
+    });
+    var link = document.createElement('a');
+    link.href = row[3];
+    link.target = '_blank';
+    link.textContent = row[2];
+    var popup = document.createElement('div');
+    popup.append('Infos: ', link);
+    marker.bindPopup(popup, {maxWidth: 300});
+    return marker;
+}
+"""
+
+# Centers the rendered map on the selected route and highlights it
+SELECTED_ROUTE_SCRIPT = """<script>
+(function () {{
+    var route = {route};
+    var map = {map_name};
+    var link = document.createElement('a');
+    link.href = route[3];
+    link.target = '_blank';
+    link.textContent = route[2];
+    var popup = document.createElement('div');
+    popup.append('Infos: ', link);
+    L.marker([route[0], route[1]], {{
+        icon: L.AwesomeMarkers.icon({{icon: 'fa-map-marker', prefix: 'fa', markerColor: 'red'}}),
+        zIndexOffset: 1000
+    }}).addTo(map).bindPopup(popup, {{maxWidth: 300}}).openPopup();
+    map.setView([route[0], route[1]], 14);
+}})();
+</script>
+"""
+
 def toggle_visibility(show):
     return gr.Textbox(visible=show)
 
-def create_map_from_markers(dataframe: pd.DataFrame) -> Map:
+def routes_frame(itineraries: list) -> pd.DataFrame:
     """
-    Create a  Folium map with markers for each location in the dataframe.
+    Build the routes dataframe shown on the map from the itineraries of the final answer.
+
+    Args:
+        itineraries (list): Itineraries of the final answer, as dicts or rows in `ROUTE_COLUMNS` order.
+
+    Returns:
+        pd.DataFrame: Routes with the `ROUTE_COLUMNS` columns.
+    """
+    df_routes = pd.DataFrame(itineraries)
+    df_routes.columns = ROUTE_COLUMNS
+    return df_routes
+
+class RenderedMap:
+    """
+    Pre-rendered HTML of a folium map, accepted by the Folium component like a `Map`.
+
+    Args:
+        html (str): Rendered HTML of the map.
+        map_name (str): Name of the Leaflet map variable in the HTML.
+    """
+
+    def __init__(self, html: str, map_name: str):
+        self.html = html
+        self.map_name = map_name
+
+    def get_root(self) -> "RenderedMap":
+        return self
+
+    def render(self, **kwargs) -> str:
+        return self.html
+
+    def _repr_html_(self) -> str:
+        return self.html
+
+    def save(self, outfile, **kwargs):
+        if hasattr(outfile, "write"):
+            outfile.write(self.html.encode("utf-8") if "b" in getattr(outfile, "mode", "") else self.html)
+            return
+        with open(outfile, "w", encoding="utf-8") as f:
+            f.write(self.html)
+
+
+# Rendered maps by route set, the same routes are rendered once
+map_cache = TTLCache(maxsize=MAP_CACHE_SIZE, ttl=MAP_CACHE_TTL)
+register_cache("map", map_cache)
+
+def routes_key(dataframe: pd.DataFrame) -> str:
+    """
+    Content address of a route set, computed from the columns shown on the map.
+
+    Args:
+        dataframe (pd.DataFrame): Routes.
+
+    Returns:
+        str: Key of the route set.
+    """
+    hashes = pd.util.hash_pandas_object(dataframe[MAP_COLUMNS].astype(str), index=False)
+    return hashlib.sha256(hashes.values.tobytes()).hexdigest()
+
+def build_routes_map(dataframe: pd.DataFrame) -> Map:
+    """
+    Build a Folium map with all the routes of the dataframe in a single clustered layer.
+
+    Markers are created client-side from one array of (latitude, longitude, name, link) rows,
+    instead of one Marker, Icon and Popup object per route.
+
     Args:
         dataframe (pd.DataFrame): Dataframe containing the locations.
-    
+
     Returns:
-        Map: Folium map with markers.
+        Map: Folium map with the routes.
     """
-    dataframe["Latitude"] = dataframe["Latitude"].astype(float, errors='raise')
-    dataframe["Longitude"] = dataframe["Longitude"].astype(float, errors='raise')
+    latitudes = dataframe["Latitude"].astype(float, errors='raise').to_numpy()
+    longitudes = dataframe["Longitude"].astype(float, errors='raise').to_numpy()
+    located = ~(np.isnan(latitudes) | np.isnan(longitudes))
     f_map = Map(
-        location=[dataframe["Latitude"].mean(), dataframe["Longitude"].mean()],
+        location=[np.nanmean(latitudes), np.nanmean(longitudes)] if located.any() else DEFAULT_MAP_LOCATION,
         zoom_start=10,
         tiles=
         TileLayer(
@@ -39,98 +160,180 @@ def create_map_from_markers(dataframe: pd.DataFrame) -> Map:
             control=True,
         ),
     )
-    for _, row in dataframe.iterrows():
-        if np.isnan(row["Latitude"]) or np.isnan(row["Longitude"]):
-            continue
-        #popup_message = f"<h4 style='color: #d53e2a;'>{row['name'].split(',')[0]}</h4><p style='font-weight:500'>{row['description']}</p>"
-        #popup_message += f"<a href='https://www.google.com/search?q={row['name']}' target='_blank'><b>Learn more about {row['name'].split(',')[0]}</b></a>"
+    rows = list(zip(
+        latitudes[located].tolist(),
+        longitudes[located].tolist(),
+        dataframe["Name"].astype(str).to_numpy()[located].tolist(),
+        dataframe["Route Link"].astype(str).to_numpy()[located].tolist(),
+    ))
+    FastMarkerCluster(rows, callback=ROUTE_MARKER_CALLBACK, name="Routes").add_to(f_map)
 
-        marker = Marker(
-            location=[float(row["Latitude"]), float(row["Longitude"])],
-            icon=Icon(color="blue", icon="fa-map-marker", prefix='fa'),
-            popup = Popup(f"Infos: <a href='{row['Route Link']}'>{row['Name']}</a>", max_width=300)
-        )
-        marker.add_to(f_map)
-    
     Fullscreen(position='topright', title='Expand me', title_cancel='Exit me', force_separate_button=True).add_to(f_map)
-
-    #bounds = [[float(row["Latitude"]), float(row["Longitude"])] for _, row in dataframe.iterrows()]
-    #f_map.fit_bounds(bounds, padding=(100, 100))
     return f_map
 
+def _rendered_routes_map(dataframe: pd.DataFrame) -> RenderedMap:
+    key = routes_key(dataframe)
+    rendered = map_cache.get(key)
+    if rendered is MISSING:
+        f_map = build_routes_map(dataframe)
+        rendered = RenderedMap(f_map.get_root().render(), f_map.get_name())
+        map_cache.set(key, rendered)
+    return rendered
 
-def update_map_on_selection(row: pd.Series, df_routes: gr.State) -> Map:
+def create_map_from_markers(dataframe: pd.DataFrame) -> RenderedMap:
     """
-    Update the map with a marker at the selected location.
+    Create a  Folium map with markers for each location in the dataframe.
+    The rendered map is cached by route set.
     Args:
-        row (pd.Series): Selected row from the dataframe.
+        dataframe (pd.DataFrame): Dataframe containing the locations.
+    
     Returns:
-        Map: Updated Folium map.
+        RenderedMap: Rendered Folium map with markers.
     """
-    row  = df_routes.loc[df_routes['Name'] == row['Name']]
+    return _rendered_routes_map(dataframe)
 
-    f_map = Map(
-        location=[row["Latitude"][0], row["Longitude"][0]],
-        tiles=TileLayer(
-            tiles=MAP_URL,
-            attr="Google",
-            name="Google Maps",
-            overlay=True,
-            control=True,
-        ),
+
+def update_map_on_selection(data: pd.DataFrame, df_routes: gr.State, evt: gr.SelectData = None) -> RenderedMap:
+    """
+    Highlight the selected route on the map of the routes.
+
+    The cached map of the route set is reused, with a script centering it on the selected
+    route and opening its popup, instead of building a new map.
+    Args:
+        data (pd.DataFrame): Routes table shown to the user.
+        df_routes (gr.State): Routes on the map.
+        evt (gr.SelectData): Selection event, giving the selected row.
+    Returns:
+        RenderedMap: Map with the selected route highlighted.
+    """
+    rendered = _rendered_routes_map(df_routes)
+    index = evt.index[0] if evt is not None and evt.index is not None else 0
+    selected = df_routes.loc[df_routes['Name'] == data['Name'].iloc[index]]
+    if selected.empty:
+        return rendered
+    route = selected.iloc[0]
+    if pd.isna(route["Latitude"]) or pd.isna(route["Longitude"]):
+        return rendered
+    highlight = SELECTED_ROUTE_SCRIPT.format(
+        map_name=rendered.map_name,
+        route=json.dumps([float(route["Latitude"]), float(route["Longitude"]), str(route["Name"]), str(route["Route Link"])]),
     )
-    popup = Popup(f"Infos: <a href='{row['Route Link'][0]}'>{row['Name'][0]}</a>", max_width=300)
-    Marker(
-        location=[row["Latitude"][0], row["Longitude"][0]],
-        icon=Icon(color="blue", icon="fa-map-marker", prefix='fa'),
-        popup=popup
-    ).add_to(f_map)
+    head, tail = rendered.html.rsplit("</html>", 1)
+    return RenderedMap(head + highlight + "</html>" + tail, rendered.map_name)
 
-    Fullscreen(position='topright', title='Expand', title_cancel='Exit', force_separate_button=True).add_to(f_map)
+def truncate_text(text: str, max_chars: int = MAX_OBSERVATION_CHARS) -> str:
+    """
+    Truncate a long text shown in the chat, e.g. a large tool observation.
 
-    return f_map
+    Args:
+        text (str): Text to show.
+        max_chars (int): Maximum number of characters kept.
+
+    Returns:
+        str: Text, truncated with a note of the number of characters left out.
+    """
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}\n… [{len(text) - max_chars} more characters]"
 
-def pull_messages_from_step(step_log, test_mode: bool = True):
-    """Extract ChatMessage objects from agent steps"""
+def pull_messages_from_step(step_log, test_mode: bool = True, max_observation_chars: int = MAX_OBSERVATION_CHARS):
+    """
+    Extract ChatMessage objects from agent steps: one message with the thoughts, code and
+    error of the step, and one collapsible message with its observations, truncated.
+    """
+    from smolagents.agents import ActionStep
     if isinstance(step_log, ActionStep):
-        yield step_log.llm_output
+        step = getattr(step_log, "step", None)
+        label = f" {step}" if step is not None else ""
+        parts = [step_log.llm_output]
         if step_log.tool_calls is not None:
             first_tool_call = step_log.tool_calls[0]
             used_code = first_tool_call.name == "code interpreter"
             content = first_tool_call.arguments
             if used_code:
                 content = f"```py\n{content}\n```"
-            yield str(content)
-        
-        if step_log.observations is not None:
-            yield step_log.observations
+            parts.append(str(content))
         if step_log.error is not None:
-            yield f"###Error 💥💥:\n ```{str(step_log.error)}```"
+            parts.append(f"###Error 💥💥:\n ```{str(step_log.error)}```")
+        yield gr.ChatMessage(
+            role="assistant",
+            content="\n\n".join(str(part) for part in parts if part),
+            metadata={"title": f"{THOUGHTS_TITLE}{label}"},
+        )
+        if step_log.observations:
+            yield gr.ChatMessage(
+                role="assistant",
+                content=truncate_text(str(step_log.observations), max_observation_chars),
+                metadata={"title": f"{OBSERVATIONS_TITLE}{label}"},
+            )
+
+
+def record_step(agent, step_log: "ActionStep", trace=None):
+    """
+    Record the latency and tool calls of an agent step in the metrics and the run trace.
+    Token usage is recorded per LLM call by the engine, see `src.scheduler.BoundedModel`.
+
+    Args:
+        agent: Agent running the step.
+        step_log (ActionStep): Completed step.
+        trace (RunTrace): Trace of the run, None if tracing is disabled.
+    """
+    model_id = getattr(agent.model, "model_id", None) or type(agent.model).__name__
+    if step_log.duration is not None:
+        metrics.observe("agent_step_seconds", step_log.duration, model=model_id)
+    if trace is not None:
+        trace.record(
+            "agent_step",
+            step=getattr(step_log, "step", None),
+            duration=step_log.duration,
+            tools=[tool_call.name for tool_call in step_log.tool_calls or []],
+            error=str(step_log.error) if step_log.error is not None else None,
+        )
 
 
 # Simplified interaction function
-def interact_with_agent(agent, prompt, messages, df_routes, additional_args):
+def interact_with_agent(
+    agent,
+    prompt,
+    messages,
+    df_routes,
+    additional_args,
+    dependencies: Optional[set] = None,
+    on_final_answer: Optional[Callable] = None,
+):
+    """
+    Run the agent and stream its messages to the chat.
+
+    Each step gets its own messages, so updates only add content at the end of the chat,
+    and the chat is refreshed once per step with all the messages of the step.
+    `dependencies` and `on_final_answer` are passed to `stream_to_gradio`.
+    """
     
     messages.append(gr.ChatMessage(role="user", content=prompt))
     yield (messages, df_routes, gr.Textbox(value=FINAL_MESSAGE_HEADER, container=True))
     
-    messages.append(gr.ChatMessage(role="assistant", content="",  metadata={"title":"🤔💭🔄"},))
+    messages.append(gr.ChatMessage(role="assistant", content="",  metadata={"title": THOUGHTS_TITLE},))
     yield (messages, df_routes, gr.Textbox(value=FINAL_MESSAGE_HEADER, container=True))
 
-    for msg, _df_routes, final_message in stream_to_gradio(
+    placeholder = True
+    for step_messages, _df_routes, final_message in stream_steps_to_gradio(
         agent,
         df_routes=df_routes,
         task=prompt,
         reset_agent_memory=True,
+        dependencies=dependencies,
+        on_final_answer=on_final_answer,
         additional_args=additional_args,
     ):
-        if msg.metadata["title"] == "🤔💭🔄" :
-            messages[-1] = msg
-        else:
-            messages.append(msg)
+        if not step_messages:
+            continue
+        # The first message of the run takes the place of the waiting placeholder
+        if placeholder:
+            messages[-1] = step_messages[0]
+            step_messages = step_messages[1:]
+            placeholder = False
+        messages.extend(step_messages)
         yield (messages, _df_routes, final_message)
-
-    yield (messages, _df_routes, final_message)
     
     
 def stream_to_gradio(
@@ -139,38 +342,85 @@ def stream_to_gradio(
     task: str,
     test_mode: bool = False,
     reset_agent_memory: bool = False,
+    dependencies: Optional[set] = None,
+    on_final_answer: Optional[Callable] = None,
     **kwargs,
 ):
-    """Runs an agent with the given task and streams the messages from the agent as gradio ChatMessages."""
-    accumulated_thoughts = ""
-    accumulated_errors = ""
-    for step_log in agent.run(task, stream=True, reset=reset_agent_memory, **kwargs):
-        for agent_thought in pull_messages_from_step(step_log, test_mode=test_mode):
-            
-        
-            accumulated_thoughts += f"{agent_thought}\n\n"
-            message = gr.ChatMessage(role="assistant", metadata={"title": "🤔💭🔄"}, content=str(accumulated_thoughts))
-            yield (message, df_routes,  gr.Markdown(value=FINAL_MESSAGE_HEADER , container=True))
+    """
+    Runs an agent with the given task and streams the messages of each step from the agent as gradio ChatMessages.
+
+    The cached data read by the run is added to `dependencies`, and `on_final_answer` is called
+    with the final message and the itineraries of the run once it is over, unless the run ended
+    on an error such as reaching its maximum number of steps.
+    """
+    for step_messages, df_routes, text_output in stream_steps_to_gradio(
+        agent,
+        df_routes,
+        task,
+        test_mode=test_mode,
+        reset_agent_memory=reset_agent_memory,
+        dependencies=dependencies,
+        on_final_answer=on_final_answer,
+        **kwargs,
+    ):
+        for message in step_messages:
+            yield (message, df_routes, text_output)
+
+
+def stream_steps_to_gradio(
+    agent,
+    df_routes,
+    task: str,
+    test_mode: bool = False,
+    reset_agent_memory: bool = False,
+    dependencies: Optional[set] = None,
+    on_final_answer: Optional[Callable] = None,
+    **kwargs,
+):
+    """
+    Runs an agent with the given task and streams the messages of each step at once, as a list of
+    gradio ChatMessages per step, the final answer being the last step.
+
+    Arguments are the same as `stream_to_gradio`.
+    """
+    # smolagents is imported on first run rather than at app startup
+    from smolagents.agents import ActionStep
+    from smolagents.types import handle_agent_output_types, AgentText
+    with run_trace(task) as trace:
+        steps = iterate_in_context(
+            agent.run(task, stream=True, reset=reset_agent_memory, **kwargs),
+            {current_trace: trace, current_dependencies: dependencies},
+        )
+        run_error = None
+        for step_log in steps:
+            if isinstance(step_log, ActionStep):
+                record_step(agent, step_log, trace)
+                # The error of the last step, e.g. reaching the maximum number of steps, ends the run
+                run_error = step_log.error
+            step_messages = list(pull_messages_from_step(step_log, test_mode=test_mode))
+            yield (step_messages, df_routes, gr.Markdown(value=FINAL_MESSAGE_HEADER , container=True))
 
     final_answer = step_log  # Last log is the run's final_answer
     final_answer = handle_agent_output_types(final_answer)
+    itineraries = None
     if isinstance(final_answer, dict):
         final_message = final_answer.get("message")
         itineraries = final_answer.get("itineraries")
         if itineraries:
-            df_routes = pd.DataFrame(itineraries)
-            df_routes.columns = ["id", "Name", "Latitude", "Longitude", "Route Link"]
+            df_routes = routes_frame(itineraries)
             
     else:
         final_message = final_answer
+    if on_final_answer is not None and run_error is None:
+        on_final_answer(final_message, itineraries)
         
     text_output = gr.Markdown(value=FINAL_MESSAGE_HEADER + f": {str(final_message)}", container=True)
     if isinstance(final_answer, AgentText):
-        yield (gr.ChatMessage(
+        yield ([gr.ChatMessage(
             role="assistant",
             content=f"**Final answer:**\n{str(final_message)}\n",
-        ), df_routes, text_output) 
+        )], df_routes, text_output) 
 
     else:
-        yield (gr.ChatMessage(role="assistant", content=str(final_message)), df_routes, text_output)
+        yield ([gr.ChatMessage(role="assistant", content=str(final_message))], df_routes, text_output)
 
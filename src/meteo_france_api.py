@@ -1,13 +1,45 @@
 import os
 import re
+import copy
+import time
+import datetime
 import requests
 import xml.etree.ElementTree as ET
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
 from meteofrance_api import MeteoFranceClient
+from meteofrance_api.model import Forecast
+from src.cache import TTLCache, SingleFlight, CACHE_DIR, MISSING, record_dependency
+from src.metrics import timed, register_cache
+from src.bra import Bulletin, parse_bulletin, read_bulletin_dates
 
 METEOFRANCE_API_URL = 'https://public-api.meteofrance.fr/public/DPBRA/v1/'
 METEO_FRANCE_TOKEN = os.getenv('METEO_FRANCE_API_TOKEN')
 
+BRA_TIMEOUT = (3.05, 15)
+BRA_TIMEZONE = ZoneInfo("Europe/Paris")
+# Bulletins are published once a day, amendments aside
+BRA_PUBLICATION_INTERVAL = 24 * 3600
+BRA_MIN_TTL = 15 * 60
+BRA_MAX_TTL = 24 * 3600
+
+# Raw BRA XML keyed by Météo-France massif id
+bulletin_cache = TTLCache(maxsize=64, path=os.path.join(CACHE_DIR, "bra.sqlite"))
+_bulletin_flights = SingleFlight()
+
+# AROME grid resolution in degrees, points in the same cell share a forecast
+FORECAST_GRID_RESOLUTION = 0.025
+# AROME runs every 3 hours, its output is published about 2 hours after the run time
+FORECAST_RUN_INTERVAL = 3 * 3600
+FORECAST_RUN_DELAY = 2 * 3600
+
+# Raw forecasts keyed by grid cell and language
+forecast_cache = TTLCache(maxsize=512)
+_forecast_flights = SingleFlight()
+register_cache("bra", bulletin_cache)
+register_cache("forecast", forecast_cache)
+_weather_client = None
+
 def get_massifs_meteo_france() -> List[Dict]:
     """
     Fetch the list of massifs from Meteo France API.
@@ -17,7 +49,8 @@ def get_massifs_meteo_france() -> List[Dict]:
     """
     url = METEOFRANCE_API_URL + 'liste-massifs'
     headers = {'apikey': METEO_FRANCE_TOKEN, 'accept': '*/*'}
-    response = requests.get(url, headers=headers)
+    with timed("http_request", service="meteofrance_bra", endpoint="liste-massifs"):
+        response = requests.get(url, headers=headers)
     response = response.json()
     liste_massifs = []
     for massif in response['features']:
@@ -44,29 +77,234 @@ def extraire_texte(element: ET.Element) -> str:
     texte += element.tail or ""
     return texte
 
-def get_massif_conditions(massif_id: str) -> str:
+def bulletin_expiry(xml_text: str, now: Optional[float] = None) -> float:
     """
-    Fetch the weather conditions for a given massif.
+    Compute when a cached avalanche risk bulletin (BRA) should be fetched again.
+
+    A bulletin is kept until its validity ends or until the next daily publication,
+    whichever comes first. Bulletins already past their validity (e.g. out of season)
+    are retried after `BRA_MIN_TTL`.
 
     Args:
-        massif_id (str): ID of the massif.
+        xml_text (str): BRA in XML format.
+        now (float): Current timestamp, defaults to `time.time()`.
 
     Returns:
-        str: Weather conditions in plain text.
+        float: Expiry timestamp of the bulletin.
+    """
+    now = time.time() if now is None else now
+    attributes = read_bulletin_dates(xml_text)
+    candidates = []
+    for name, offset in (("DATEECHEANCE", 0), ("DATEVALIDITE", 0), ("DATEBULLETIN", BRA_PUBLICATION_INTERVAL)):
+        timestamp = _parse_bulletin_date(attributes.get(name))
+        if timestamp is not None:
+            candidates.append(timestamp + offset)
+    expiry = min(candidates) if candidates else now + BRA_MIN_TTL
+    return min(max(expiry, now + BRA_MIN_TTL), now + BRA_MAX_TTL)
+
+def _parse_bulletin_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        date = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=BRA_TIMEZONE)
+    return date.timestamp()
+
+def fetch_bulletin(massif_id: str) -> str:
+    """
+    Download the avalanche risk bulletin (BRA) of a massif and store it in the bulletin cache.
+
+    Args:
+        massif_id (str): Météo-France ID of the massif.
+
+    Returns:
+        str: BRA in XML format.
     """
     url = METEOFRANCE_API_URL + 'massif/BRA'
     headers = {'apikey': METEO_FRANCE_TOKEN, 'accept': '*/*'}
     params = {'id-massif': massif_id, "format": "xml"}
-    response = requests.get(url, headers=headers, params=params)
-    xml_text = response.text
+    with timed("http_request", service="meteofrance_bra", endpoint="massif"):
+        response = requests.get(url, headers=headers, params=params, timeout=BRA_TIMEOUT)
+    response.raise_for_status()
+    bulletin_cache.set(str(massif_id), response.text, expires_at=bulletin_expiry(response.text))
+    return response.text
+
+def get_bulletin(massif_id: str, force_refresh: bool = False) -> str:
+    """
+    Get the avalanche risk bulletin (BRA) of a massif, from the cache when it is still current.
+
+    Concurrent requests for the same massif share a single download.
+
+    Args:
+        massif_id (str): Météo-France ID of the massif.
+        force_refresh (bool): Download the bulletin even if a cached copy is current.
+
+    Returns:
+        str: BRA in XML format.
+    """
+    record_dependency("bra", str(massif_id))
+    if not force_refresh:
+        cached = bulletin_cache.get(str(massif_id))
+        if cached is not MISSING:
+            return cached
+    return _bulletin_flights.do(str(massif_id), lambda: fetch_bulletin(massif_id))
+
+def refresh_bulletins(massif_ids: Optional[List[str]] = None):
+    """
+    Drop cached avalanche risk bulletins so that they are downloaded again on next use.
+
+    Args:
+        massif_ids (List[str]): Météo-France IDs of the massifs, all massifs if None.
+    """
+    if massif_ids is None:
+        bulletin_cache.clear()
+    else:
+        for massif_id in massif_ids:
+            bulletin_cache.invalidate(str(massif_id))
+
+def get_bulletin_record(massif_id: str, force_refresh: bool = False) -> Bulletin:
+    """
+    Fetch the avalanche risk bulletin (BRA) of a massif as a typed record.
+
+    Args:
+        massif_id (str): Météo-France ID of the massif.
+        force_refresh (bool): Download the bulletin even if a cached copy is current.
+
+    Returns:
+        Bulletin: Parsed bulletin.
+    """
+    return parse_bulletin(get_bulletin(massif_id, force_refresh=force_refresh))
+
+def get_massif_conditions(massif_id: str, force_refresh: bool = False) -> str:
+    """
+    Fetch the weather conditions for a given massif.
+
+    Args:
+        massif_id (str): ID of the massif.
+        force_refresh (bool): Download the bulletin even if a cached copy is current.
+
+    Returns:
+        str: Weather conditions in compact text.
+    """
+    return render_massif_conditions(get_bulletin(massif_id, force_refresh=force_refresh))
+
+def render_massif_conditions(xml_text: str) -> str:
+    """
+    Convert an avalanche risk bulletin (BRA) in XML format to compact text.
+
+    Falls back to the flattened text of the document if its structure is not recognized.
+
+    Args:
+        xml_text (str): BRA in XML format.
+
+    Returns:
+        str: Weather conditions in compact text.
+    """
+    bulletin = parse_bulletin(xml_text)
+    if bulletin.is_empty():
+        return parse_massif_conditions(xml_text)
+    return bulletin.to_text()
+
+def parse_massif_conditions(xml_text: str) -> str:
+    """
+    Convert an avalanche risk bulletin (BRA) in XML format to plain text.
+
+    Args:
+        xml_text (str): BRA in XML format.
+
+    Returns:
+        str: Weather conditions in plain text.
+    """
     root = ET.fromstring(xml_text)
     text = extraire_texte(root)
     #remove file names
     text = re.sub(r'\b[\w\-]+\.[a-zA-Z0-9]+\b', '', text).strip()
     return text
 
-def get_forecast(latitude, longitude): 
-    
-    client = MeteoFranceClient(METEO_FRANCE_TOKEN)
-    forecast = client.get_forecast(latitude, longitude)
-    
\ No newline at end of file
+def get_weather_client() -> MeteoFranceClient:
+    """
+    Return the Météo-France forecast client shared by the process, creating it on first use.
+
+    Returns:
+        MeteoFranceClient: Shared forecast client.
+    """
+    global _weather_client
+    if _weather_client is None:
+        _weather_client = MeteoFranceClient(access_token=os.getenv("METEO_FRANCE_API_KEY"))
+    return _weather_client
+
+def forecast_cell(latitude: float, longitude: float) -> Tuple[float, float]:
+    """
+    Snap coordinates to the forecast model grid, so that nearby points share a forecast.
+
+    Args:
+        latitude (float): Latitude of the point.
+        longitude (float): Longitude of the point.
+
+    Returns:
+        Tuple[float, float]: Coordinates of the grid cell containing the point.
+    """
+    return (
+        round(round(float(latitude) / FORECAST_GRID_RESOLUTION) * FORECAST_GRID_RESOLUTION, 4),
+        round(round(float(longitude) / FORECAST_GRID_RESOLUTION) * FORECAST_GRID_RESOLUTION, 4),
+    )
+
+def forecast_expiry(now: Optional[float] = None) -> float:
+    """
+    Compute when the output of the next forecast model run becomes available.
+
+    Args:
+        now (float): Current timestamp, defaults to `time.time()`.
+
+    Returns:
+        float: Expiry timestamp of a forecast fetched now.
+    """
+    now = time.time() if now is None else now
+    runs = (now - FORECAST_RUN_DELAY) // FORECAST_RUN_INTERVAL + 1
+    return runs * FORECAST_RUN_INTERVAL + FORECAST_RUN_DELAY
+
+def forecast_key(latitude: float, longitude: float, language: str = "fr") -> str:
+    """
+    Compute the forecast cache key of a point.
+
+    Args:
+        latitude (float): Latitude of the point.
+        longitude (float): Longitude of the point.
+        language (str): Language of the weather descriptions.
+
+    Returns:
+        str: Key of the grid cell containing the point.
+    """
+    latitude, longitude = forecast_cell(latitude, longitude)
+    return f"{latitude:.4f},{longitude:.4f},{language}"
+
+def get_forecast(latitude, longitude, language: str = "fr") -> Forecast:
+    """
+    Fetch the weather forecast of the model grid cell containing a point.
+
+    Forecasts are cached per grid cell until the next model run is available, and
+    concurrent requests for the same cell share a single download.
+
+    Args:
+        latitude (float): Latitude of the point.
+        longitude (float): Longitude of the point.
+        language (str): Language of the weather descriptions.
+
+    Returns:
+        Forecast: Weather forecast.
+    """
+    key = forecast_key(latitude, longitude, language)
+    record_dependency("forecast", key)
+    raw_forecast = forecast_cache.get(key)
+    if raw_forecast is MISSING:
+        def fetch():
+            with timed("http_request", service="meteofrance_forecast", endpoint="forecast"):
+                forecast = get_weather_client().get_forecast(*forecast_cell(latitude, longitude), language=language)
+            forecast_cache.set(key, forecast.raw_data, expires_at=forecast_expiry())
+            return forecast.raw_data
+        raw_forecast = _forecast_flights.do(key, fetch)
+    # A new object per call, so that callers cannot alter the cached data
+    return Forecast(copy.deepcopy(raw_forecast))
@@ -0,0 +1,392 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import functools
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Directory of the JSONL traces of the agent runs, traces are disabled if unset
+TRACE_DIR = os.getenv("METRICS_TRACE_DIR")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    labels = labels + ((extra,) if extra else ())
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " "))
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, latency histograms and gauge collectors,
+    rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Increment a counter.
+
+        Args:
+            name (str): Name of the counter.
+            value (float): Increment.
+            **labels: Labels of the counter.
+        """
+        with self._lock:
+            self._counters[(name, _labels(labels))] += value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Record a value in a histogram.
+
+        Args:
+            name (str): Name of the histogram.
+            value (float): Observed value, e.g. a latency in seconds.
+            **labels: Labels of the histogram.
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, Dict[str, object], float]]]):
+        """
+        Register a function returning gauges, as (name, labels, value) tuples, evaluated at render time.
+
+        Args:
+            collector (Callable): Gauge collector.
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Render all the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: Metrics in text format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, ([*value[0]], value[1], value[2])) for key, value in self._histograms.items())
+        for (name, labels), value in counters:
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), (counts, total, count) in histograms:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                lines.append(f"{name}{_format_labels(_labels(labels))} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class StartupTimer:
+    """
+    Durations of the startup phases of the app, exposed as the `startup_phase_seconds` gauge.
+
+    Phases may run in background threads; `report` lists them in the order they completed.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        metrics.register_collector(self._collect)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measure a startup phase.
+
+        Args:
+            name (str): Name of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.phases[name] = (end - start, end - self.origin)
+
+    def _collect(self):
+        with self._lock:
+            phases = list(self.phases.items())
+        for name, (duration, _) in phases:
+            yield "startup_phase_seconds", {"phase": name}, duration
+
+    def report(self) -> str:
+        """
+        Render the startup phases as text.
+
+        Returns:
+            str: One line per phase with its duration and its end since the start of the process.
+        """
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: item[1][1])
+        lines = [f"{name:<24} {duration:7.2f}s  (ready at {end:6.2f}s)" for name, (duration, end) in phases]
+        return "Startup phases:\n" + "\n".join(lines)
+
+
+startup = StartupTimer()
+
+
+class RunTrace:
+    """
+    JSONL trace of one agent run, one event per line.
+
+    Args:
+        path (str): Path of the trace file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, **fields):
+        event = {"ts": time.time(), "kind": kind, **fields}
+        with self._lock:
+            self._file.write(json.dumps(event, default=str) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+current_trace: ContextVar[Optional[RunTrace]] = ContextVar("current_trace", default=None)
+
+@contextmanager
+def run_trace(task: str, directory: Optional[str] = TRACE_DIR):
+    """
+    Open the JSONL trace of an agent run, if a trace directory is configured.
+    Events are recorded in the trace while it is current, see `iterate_in_trace`.
+
+    Args:
+        task (str): Task of the run.
+        directory (str): Directory of the traces.
+
+    Yields:
+        RunTrace: Trace of the run, None if tracing is disabled.
+    """
+    if not directory:
+        yield None
+        return
+    trace = RunTrace(os.path.join(directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl"))
+    trace.record("run_start", task=task)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.record("run_end", duration=time.perf_counter() - start)
+        trace.close()
+
+def iterate_in_context(iterator: Iterator, values: Dict[ContextVar, Any]) -> Iterator:
+    """
+    Iterate over the steps of an agent run with the given context variables set.
+
+    The variables are set around each step only, since a streaming generator may be resumed
+    from a different thread or context at each step.
+
+    Args:
+        iterator (Iterator): Steps of the run.
+        values (Dict[ContextVar, Any]): Values of the context variables during the steps.
+
+    Yields:
+        Steps of the run.
+    """
+    while True:
+        tokens = [(variable, variable.set(value)) for variable, value in values.items()]
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            for variable, token in reversed(tokens):
+                variable.reset(token)
+        yield item
+
+def iterate_in_trace(iterator: Iterator, trace: Optional[RunTrace]) -> Iterator:
+    """
+    Iterate over the steps of an agent run with `trace` as the current trace.
+
+    Args:
+        iterator (Iterator): Steps of the run.
+        trace (RunTrace): Trace of the run, None if tracing is disabled.
+
+    Yields:
+        Steps of the run.
+    """
+    return iterate_in_context(iterator, {current_trace: trace})
+
+def trace_event(kind: str, **fields):
+    """
+    Record an event in the trace of the current run, if any.
+
+    Args:
+        kind (str): Kind of event.
+        **fields: Fields of the event.
+    """
+    trace = current_trace.get()
+    if trace is not None:
+        trace.record(kind, **fields)
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    Measure the latency of a block in the `<name>_seconds` histogram, count its failures
+    in `<name>_errors_total` and record it in the trace of the current run.
+
+    Args:
+        name (str): Name of the measured operation, e.g. "tool" or "http_request".
+        **labels: Labels of the measure.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        metrics.inc(f"{name}_errors_total", **labels)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        metrics.observe(f"{name}_seconds", duration, **labels)
+        trace_event(name, duration=duration, status=status, **labels)
+
+def instrumented(tool_class):
+    """
+    Class decorator measuring every call to the `forward` method of a tool.
+
+    Args:
+        tool_class (type): Tool class.
+
+    Returns:
+        type: The same class, with an instrumented `forward`.
+    """
+    forward = tool_class.forward
+
+    @functools.wraps(forward)
+    def instrumented_forward(self, *args, **kwargs):
+        with timed("tool", tool=self.name):
+            return forward(self, *args, **kwargs)
+
+    tool_class.forward = instrumented_forward
+    return tool_class
+
+def register_cache(name: str, cache):
+    """
+    Expose the hit/miss counters of a cache as gauges.
+
+    Args:
+        name (str): Name of the cache.
+        cache (TTLCache): Cache with a `stats` method.
+    """
+    def collect():
+        stats = cache.stats()
+        yield "cache_hits", {"cache": name}, stats["hits"]
+        yield "cache_misses", {"cache": name}, stats["misses"]
+        yield "cache_hit_rate", {"cache": name}, stats["hit_rate"]
+        yield "cache_entries", {"cache": name}, stats["size"]
+    metrics.register_collector(collect)
+
+# What the LLM calls of the current context are for, e.g. "summary", see `llm_call_purpose`
+current_llm_purpose: ContextVar[str] = ContextVar("current_llm_purpose", default="agent_step")
+
+@contextmanager
+def llm_call_purpose(purpose: str):
+    """
+    Label the LLM calls made in a block with their purpose in the token metrics.
+
+    Args:
+        purpose (str): What the calls are for, e.g. "summary".
+    """
+    token = current_llm_purpose.set(purpose)
+    try:
+        yield
+    finally:
+        current_llm_purpose.reset(token)
+
+def record_llm_usage(model_id: str, input_tokens: Optional[int], output_tokens: Optional[int]):
+    """
+    Count the tokens of one LLM call, and record them in the trace of the current run.
+
+    The counts must come from the call itself: the `last_*_token_count` attributes of a model
+    shared by concurrent runs may already belong to another call.
+
+    Args:
+        model_id (str): Model of the call.
+        input_tokens (int): Number of input tokens of the call, None if unknown.
+        output_tokens (int): Number of output tokens of the call, None if unknown.
+    """
+    purpose = current_llm_purpose.get()
+    for direction, count in (("input", input_tokens), ("output", output_tokens)):
+        if count:
+            metrics.inc("llm_tokens_total", count, model=model_id, purpose=purpose, direction=direction)
+    trace_event("llm_usage", model=model_id, purpose=purpose, input_tokens=input_tokens, output_tokens=output_tokens)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve the metrics on `http://<host>:<port>/metrics` from a daemon thread.
+
+    Args:
+        port (int): Port of the server.
+        host (str): Interface to listen on.
+
+    Returns:
+        ThreadingHTTPServer: Running server.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,344 @@
+"""
+Record/replay of the HTTP calls of the agent and scripted LLM, for offline and repeatable runs.
+
+The mode is read from the environment by `configure_http_from_env`:
+    ALPINE_AGENT_HTTP_MODE=record   capture every response to the cassette
+    ALPINE_AGENT_HTTP_MODE=replay   serve the responses from the cassette, without network
+    ALPINE_AGENT_CASSETTE           path of the cassette, a gzipped JSONL file
+    ALPINE_AGENT_REPLAY_LATENCY     latency injected per replayed call in seconds, or "recorded"
+                                    to replay the latency measured when recording
+
+All the `requests` traffic (Skitour, BRA, `MeteoFranceClient`, Google Maps) goes through the
+patched `HTTPAdapter.send`, and the asyncio clients use `get_async_transport`. Point
+`ALPINE_AGENT_CACHE_DIR` to an empty directory for replayed runs, so the disk caches do not
+serve responses from previous runs.
+"""
+import os
+import gzip
+import json
+import time
+import base64
+import itertools
+import asyncio
+import threading
+import http.client
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+HTTP_MODES = ("live", "record", "replay")
+DEFAULT_CASSETTE = os.path.join("cassettes", "default.jsonl.gz")
+# Query parameters holding credentials, left out of the recorded keys
+SECRET_PARAMS = {"key", "token", "apikey", "api_key", "cle"}
+
+
+def request_key(method: str, url: str) -> str:
+    """
+    Key of a request in a cassette: method and URL with sorted query parameters, without credentials.
+
+    Args:
+        method (str): HTTP method.
+        url (str): Full URL of the request.
+
+    Returns:
+        str: Key of the request.
+    """
+    parts = urlsplit(url)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if name.lower() not in SECRET_PARAMS)
+    return f"{method.upper()} {urlunsplit(parts._replace(query=urlencode(query), fragment=''))}"
+
+
+class CassetteMiss(KeyError):
+    """No response was recorded for a request."""
+
+
+class Cassette:
+    """
+    Recorded HTTP responses, stored as gzipped JSON lines appended as they are recorded.
+
+    Responses recorded several times for the same request are replayed in order, the last one
+    being repeated once all have been served.
+
+    Args:
+        path (str): Path of the cassette.
+        latency (Optional[float]): Latency injected per replayed call in seconds,
+            None to replay the recorded latency.
+    """
+
+    def __init__(self, path: str, latency: Optional[float] = 0.0):
+        self.path = path
+        self.latency = latency
+        self._entries: Dict[str, List[Dict]] = {}
+        self._served: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def record(self, key: str, status: int, content_type: str, body: bytes, elapsed: float):
+        """
+        Append a response to the cassette.
+
+        Args:
+            key (str): Key of the request, see `request_key`.
+            status (int): Status code of the response.
+            content_type (str): Content type of the response.
+            body (bytes): Decoded body of the response.
+            elapsed (float): Latency of the call in seconds.
+        """
+        entry = {"key": key, "status": status, "content_type": content_type, "elapsed": round(elapsed, 4)}
+        try:
+            entry["body"] = body.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["body_b64"] = base64.b64encode(body).decode("ascii")
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def play(self, key: str) -> Dict:
+        """
+        Return the next recorded response of a request.
+
+        Args:
+            key (str): Key of the request, see `request_key`.
+
+        Returns:
+            Dict: Recorded entry, with the body decoded to bytes.
+
+        Raises:
+            CassetteMiss: If the request was never recorded.
+        """
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(key)
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+        entry = dict(entries[min(served, len(entries) - 1)])
+        entry["body"] = base64.b64decode(entry.pop("body_b64")) if "body_b64" in entry else entry["body"].encode("utf-8")
+        return entry
+
+    def delay(self, entry: Dict) -> float:
+        """Latency to inject before serving a replayed entry."""
+        return entry["elapsed"] if self.latency is None else self.latency
+
+
+_mode = "live"
+_cassette: Optional[Cassette] = None
+_adapter_send = HTTPAdapter.send
+
+def _replaying_send(adapter, request, **kwargs):
+    key = request_key(request.method, request.url)
+    if _mode == "replay":
+        try:
+            entry = _cassette.play(key)
+        except CassetteMiss:
+            raise requests.ConnectionError(f"No recorded response for {key}", request=request)
+        time.sleep(_cassette.delay(entry))
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = http.client.responses.get(entry["status"], "")
+        response.headers = CaseInsensitiveDict({"Content-Type": entry["content_type"]} if entry["content_type"] else {})
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = entry["body"]
+        response.url = request.url
+        response.request = request
+        response.connection = adapter
+        return response
+    start = time.perf_counter()
+    response = _adapter_send(adapter, request, **kwargs)
+    _cassette.record(key, response.status_code, response.headers.get("Content-Type", ""), response.content,
+                     time.perf_counter() - start)
+    return response
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport recording the responses of an inner transport, or replaying them.
+
+    Args:
+        cassette (Cassette): Cassette of the responses.
+        mode (str): "record" or "replay".
+        inner (httpx.AsyncBaseTransport): Transport of the live calls, used in record mode.
+    """
+
+    def __init__(self, cassette: Cassette, mode: str, inner: Optional[httpx.AsyncBaseTransport] = None):
+        self.cassette = cassette
+        self.mode = mode
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request.method, str(request.url))
+        if self.mode == "replay":
+            try:
+                entry = self.cassette.play(key)
+            except CassetteMiss:
+                raise httpx.ConnectError(f"No recorded response for {key}", request=request)
+            await asyncio.sleep(self.cassette.delay(entry))
+            headers = {"Content-Type": entry["content_type"]} if entry["content_type"] else {}
+            return httpx.Response(entry["status"], headers=headers, content=entry["body"], request=request)
+        start = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        body = await response.aread()
+        self.cassette.record(key, response.status_code, response.headers.get("Content-Type", ""), body,
+                             time.perf_counter() - start)
+        headers = {"Content-Type": response.headers["Content-Type"]} if "Content-Type" in response.headers else {}
+        return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+def enable_http_replay(mode: str, path: str = DEFAULT_CASSETTE, latency: Optional[float] = 0.0) -> Optional[Cassette]:
+    """
+    Switch the HTTP calls of the process to the given mode.
+
+    Args:
+        mode (str): "live", "record" or "replay".
+        path (str): Path of the cassette.
+        latency (Optional[float]): Latency injected per replayed call in seconds,
+            None to replay the recorded latency.
+
+    Returns:
+        Optional[Cassette]: Cassette in use, None in live mode.
+    """
+    global _mode, _cassette
+    if mode not in HTTP_MODES:
+        raise ValueError(f"Invalid HTTP mode {mode!r}, expected one of {', '.join(HTTP_MODES)}.")
+    if mode == "replay" and not os.path.exists(path):
+        raise FileNotFoundError(f"No cassette to replay at {path}, record one first.")
+    _mode = mode
+    if mode == "live":
+        _cassette = None
+        HTTPAdapter.send = _adapter_send
+        return None
+    _cassette = Cassette(path, latency=latency)
+    HTTPAdapter.send = _replaying_send
+    return _cassette
+
+def configure_http_from_env() -> Optional[Cassette]:
+    """
+    Apply the record/replay mode configured in the environment, see the module docstring.
+
+    Returns:
+        Optional[Cassette]: Cassette in use, None in live mode.
+    """
+    latency = os.getenv("ALPINE_AGENT_REPLAY_LATENCY", "0")
+    return enable_http_replay(
+        os.getenv("ALPINE_AGENT_HTTP_MODE", "live"),
+        os.getenv("ALPINE_AGENT_CASSETTE", DEFAULT_CASSETTE),
+        latency=None if latency == "recorded" else float(latency),
+    )
+
+def get_async_transport(limits: Optional[httpx.Limits] = None) -> Optional[httpx.AsyncBaseTransport]:
+    """
+    Return the transport of the asyncio clients in the current mode.
+
+    Args:
+        limits (httpx.Limits): Connection pool limits of the live transport.
+
+    Returns:
+        Optional[httpx.AsyncBaseTransport]: Record/replay transport, None in live mode.
+    """
+    if _mode == "live":
+        return None
+    return ReplayTransport(_cassette, _mode, httpx.AsyncHTTPTransport(limits=limits or httpx.Limits()))
+
+
+class ScriptedMessage(dict):
+    """Chat message readable as a dict or through attributes, like the messages of the smolagents models."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class ScriptedModel:
+    """
+    Fake LLM engine answering agent steps from a script, for offline and repeatable agent runs.
+
+    Agent steps get the scripted outputs in order, the last one being repeated; calls of
+    `llm_summarizer` get the scripted summary.
+
+    Args:
+        steps (List[str]): Outputs of the successive agent steps, e.g. code blobs ending with `<end_code>`.
+        summary (str): Output of the summarizer calls.
+        latency (float): Time spent per call in seconds, to simulate the LLM.
+        model_id (str): Model ID reported in metrics and cache keys.
+    """
+
+    def __init__(self, steps: List[str], summary: str = "Summary.", latency: float = 0.0, model_id: str = "scripted"):
+        if not steps:
+            raise ValueError("The script needs at least one step.")
+        self.steps = steps
+        self.summary = summary
+        self.latency = latency
+        self.model_id = model_id
+        self.last_input_token_count = 0
+        self.last_output_token_count = 0
+        # Shared by the copies of the engine made per call, see `src.scheduler.BoundedModel`
+        self._steps = itertools.count()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ScriptedModel":
+        """
+        Load a script from a JSON file with `steps`, and optionally `summary` and `latency`.
+
+        Args:
+            path (str): Path of the script.
+            **kwargs: Arguments overriding the script.
+
+        Returns:
+            ScriptedModel: Scripted engine.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            script = json.load(f)
+        return cls(**{**script, **kwargs})
+
+    def reset(self):
+        """Restart the script from its first step."""
+        self._steps = itertools.count()
+
+    def __call__(self, messages: List[Dict], stop_sequences: Optional[List[str]] = None, **kwargs) -> ScriptedMessage:
+        from src.utils import SUMMARIZER_SYSTEM_PROMPT
+        if messages and messages[0].get("content") == SUMMARIZER_SYSTEM_PROMPT:
+            content = self.summary
+        else:
+            content = self.steps[min(next(self._steps), len(self.steps) - 1)]
+        if self.latency:
+            time.sleep(self.latency)
+        self.last_input_token_count = sum(len(str(message.get("content", ""))) for message in messages) // 4
+        self.last_output_token_count = len(content) // 4
+        return ScriptedMessage(role="assistant", content=content, tool_calls=None)
+
+
+def reset_script(model: Any) -> bool:
+    """
+    Restart the script of a scripted engine, so that each agent run replays it from its first step.
+
+    Args:
+        model: Engine of the run, possibly wrapped in a proxy such as `src.scheduler.BoundedModel`.
+
+    Returns:
+        bool: True if the engine is scripted and was reset.
+    """
+    while not isinstance(model, ScriptedModel):
+        model = getattr(model, "_model", None)
+        if model is None:
+            return False
+    model.reset()
+    return True
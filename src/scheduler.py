@@ -0,0 +1,209 @@
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Optional
+from src.metrics import metrics, record_llm_usage
+
+# Maximum number of agent runs executing at once, the others wait in the queue
+SCHEDULER_MAX_RUNS = int(os.getenv("ALPINE_AGENT_MAX_RUNS", 8))
+# Maximum number of waiting runs, new runs are rejected beyond
+SCHEDULER_MAX_QUEUED = int(os.getenv("ALPINE_AGENT_MAX_QUEUED", 64))
+# Maximum number of concurrent calls to each LLM engine
+LLM_CONCURRENCY = int(os.getenv("ALPINE_AGENT_LLM_CONCURRENCY", 4))
+
+
+class QueueFull(RuntimeError):
+    """Too many runs are already waiting."""
+
+
+class RunTicket:
+    """
+    Place of a run in the scheduler queue, granted once the run may start.
+
+    Args:
+        scheduler (RunScheduler): Scheduler of the run.
+        session_id (str): Session the run belongs to.
+    """
+
+    def __init__(self, scheduler: "RunScheduler", session_id: str):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.created_at = time.monotonic()
+        self.granted = False
+        self.done = False
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the run to be allowed to start.
+
+        Args:
+            timeout (float): Maximum waiting time in seconds, None to wait until granted.
+
+        Returns:
+            bool: True if the run may start.
+        """
+        return self.scheduler._wait(self, timeout)
+
+    def position(self) -> int:
+        """Return the position of the run in the queue, 0 once it is granted."""
+        return self.scheduler._position(self)
+
+    def release(self):
+        """Free the slot of a finished run, or leave the queue if it was still waiting."""
+        self.scheduler._release(self)
+
+
+class RunScheduler:
+    """
+    Admission control of the agent runs, with a global concurrency limit and fair queuing.
+
+    Waiting runs are queued per session and slots are granted to the sessions in turn, so a
+    session submitting many runs does not delay the others.
+
+    Args:
+        max_runs (int): Maximum number of runs executing at once.
+        max_queued (int): Maximum number of waiting runs.
+    """
+
+    def __init__(self, max_runs: int = SCHEDULER_MAX_RUNS, max_queued: int = SCHEDULER_MAX_QUEUED):
+        self.max_runs = max_runs
+        self.max_queued = max_queued
+        self._queues: "OrderedDict[str, Deque[RunTicket]]" = OrderedDict()
+        self._running = 0
+        self._condition = threading.Condition()
+        metrics.register_collector(self._collect)
+
+    def _collect(self):
+        with self._condition:
+            yield "scheduler_queue_depth", {}, self._queued()
+            yield "scheduler_running_runs", {}, self._running
+
+    def _queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, session_id: str) -> RunTicket:
+        """
+        Queue a run.
+
+        Args:
+            session_id (str): Session the run belongs to.
+
+        Returns:
+            RunTicket: Ticket of the run, to wait on and to release once the run is over.
+
+        Raises:
+            QueueFull: If `max_queued` runs are already waiting.
+        """
+        with self._condition:
+            if self._running >= self.max_runs and self._queued() >= self.max_queued:
+                metrics.inc("scheduler_rejected_total")
+                raise QueueFull("Too many requests are waiting, please retry in a few minutes.")
+            ticket = RunTicket(self, session_id)
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._dispatch()
+            return ticket
+
+    def _dispatch(self):
+        # Grant the free slots to the sessions in turn, the served session going last
+        while self._running < self.max_runs and self._queues:
+            session_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            ticket.granted = True
+            self._running += 1
+            metrics.observe("scheduler_wait_seconds", time.monotonic() - ticket.created_at)
+        self._condition.notify_all()
+
+    def _wait(self, ticket: RunTicket, timeout: Optional[float]) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: ticket.granted, timeout=timeout)
+
+    def _position(self, ticket: RunTicket) -> int:
+        with self._condition:
+            if ticket.granted:
+                return 0
+            # Replay the turns of the sessions until the ticket is granted
+            queues = list(self._queues.values())
+            position = 0
+            for turn in range(max(len(queue) for queue in queues)):
+                for queue in queues:
+                    if turn < len(queue):
+                        position += 1
+                        if queue[turn] is ticket:
+                            return position
+            return position
+
+    def _release(self, ticket: RunTicket):
+        with self._condition:
+            if ticket.done:
+                return
+            ticket.done = True
+            if ticket.granted:
+                self._running -= 1
+            else:
+                queue = self._queues.get(ticket.session_id)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._queues[ticket.session_id]
+                metrics.inc("scheduler_abandoned_total")
+            self._dispatch()
+
+
+class BoundedModel:
+    """
+    Proxy of an LLM engine bounding the number of its concurrent calls, shared by all the
+    agents and tools of the engine. Calls beyond the limit wait instead of overloading the endpoint.
+
+    Each call runs on a shallow copy of the engine, sharing its client, so that the token counts
+    the engine writes on itself belong to that call only; they are recorded in the metrics.
+
+    Args:
+        model: LLM engine.
+        max_concurrent (int): Maximum number of concurrent calls.
+        name (str): Name of the engine in the metrics.
+    """
+
+    def __init__(self, model: Any, max_concurrent: int = LLM_CONCURRENCY, name: Optional[str] = None):
+        self._model = model
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._name = name or getattr(model, "model_id", None) or type(model).__name__
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        with self._semaphore:
+            metrics.observe("llm_wait_seconds", time.perf_counter() - start, engine=self._name)
+            model = copy.copy(self._model)
+            result = model(*args, **kwargs)
+        input_tokens = getattr(model, "last_input_token_count", None)
+        output_tokens = getattr(model, "last_output_token_count", None)
+        record_llm_usage(self._name, input_tokens, output_tokens)
+        # Kept on the shared engine for the console logs of smolagents only, they may mix calls
+        self._model.last_input_token_count = input_tokens
+        self._model.last_output_token_count = output_tokens
+        return result
+
+    def __getattr__(self, name: str):
+        return getattr(self._model, name)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> RunScheduler:
+    """
+    Return the process-wide run scheduler, created on first use.
+
+    Returns:
+        RunScheduler: Shared scheduler.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RunScheduler()
+        return _scheduler
@@ -2,9 +2,101 @@ import requests
 import json
 import os
 import datetime
-from typing import List, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Dict, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src.metrics import timed
 
 SKITOUR_API_URL = 'https://skitour.fr/api/'
+SKITOUR_TIMEOUT = (3.05, 10)
+SKITOUR_MAX_RETRIES = 3
+SKITOUR_BACKOFF_FACTOR = 0.5
+SKITOUR_POOL_SIZE = 16
+SKITOUR_MAX_WORKERS = int(os.getenv('SKITOUR_MAX_WORKERS', 8))
+
+
+class SkitourClient:
+    """
+    HTTP client for the Skitour API backed by a pooled, keep-alive session.
+
+    Requests share the session's connection pool and authentication header, use
+    consistent connect/read timeouts and are retried with exponential backoff on
+    5xx responses, connection errors and timeouts.
+
+    Args:
+        token (str): Skitour API key, defaults to the `SKITOUR_API_TOKEN` environment variable.
+        base_url (str): Base URL of the Skitour API.
+        timeout (Tuple[float, float]): Connect and read timeouts in seconds.
+        max_retries (int): Maximum number of retries per request.
+        backoff_factor (float): Backoff factor between retries in seconds.
+        pool_size (int): Maximum number of connections kept alive.
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        base_url: str = SKITOUR_API_URL,
+        timeout: Tuple[float, float] = SKITOUR_TIMEOUT,
+        max_retries: int = SKITOUR_MAX_RETRIES,
+        backoff_factor: float = SKITOUR_BACKOFF_FACTOR,
+        pool_size: int = SKITOUR_POOL_SIZE,
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'cle': token or os.getenv('SKITOUR_API_TOKEN')})
+        retries = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, endpoint: str, params: Optional[Dict] = None) -> requests.Response:
+        """
+        Send a GET request to a Skitour API endpoint.
+
+        Args:
+            endpoint (str): Endpoint path relative to the API base URL.
+            params (Dict): Query parameters.
+
+        Returns:
+            requests.Response: Response of the API.
+        """
+        with timed("http_request", service="skitour", endpoint=endpoint.split('/')[0]):
+            return self.session.get(self.base_url + endpoint, params=params, timeout=self.timeout)
+
+    def close(self):
+        """Close the pooled connections of the client."""
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> SkitourClient:
+    """
+    Return the Skitour client shared by the process, creating it on first use.
+
+    Returns:
+        SkitourClient: Shared Skitour client.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SkitourClient()
+    return _client
+
 
 def get_massifs() -> List[Dict]:
     """
@@ -13,9 +105,7 @@ def get_massifs() -> List[Dict]:
     Returns:
         List[Dict]: List of massifs with their details.
     """
-    url = SKITOUR_API_URL + 'massifs'
-    headers = {'cle': os.getenv('SKITOUR_API_TOKEN')}
-    response = requests.get(url, headers=headers, timeout=10)
+    response = get_client().get('massifs')
     return response.json()
 
 def get_topos(ids_massif: str) -> List[Dict]:
@@ -27,12 +117,33 @@ def get_topos(ids_massif: str) -> List[Dict]:
 
     Returns:
         List[Dict]: List of itineraries for the specified massif.
+
+    Raises:
+        requests.HTTPError: If the API answered with an error status.
+        ValueError: If the API did not answer with a list of itineraries.
     """
-    url = SKITOUR_API_URL + 'topos'
-    headers = {'cle': os.getenv('SKITOUR_API_TOKEN')}
     params = {'m': ids_massif}
-    response = requests.get(url, headers=headers, params=params, timeout=10) 
-    return json.loads(response.text.replace('\\\\', '\\'))
+    response = get_client().get('topos', params=params)
+    response.raise_for_status()
+    return check_topos(json.loads(response.text.replace('\\\\', '\\')), ids_massif)
+
+def check_topos(topos: Any, ids_massif: str) -> List[Dict]:
+    """
+    Check that a topos response is a list of itineraries, and not an error body of the API.
+
+    Args:
+        topos (Any): Decoded response of the `topos` endpoint.
+        ids_massif (str): ID of the massif.
+
+    Returns:
+        List[Dict]: List of itineraries.
+
+    Raises:
+        ValueError: If the response is not a list.
+    """
+    if not isinstance(topos, list):
+        raise ValueError(f"Unexpected topos response for massif {ids_massif}: {str(topos)[:200]}")
+    return topos
 
 def get_sommets(massif_id: str) -> List[Dict]:
     """
@@ -44,10 +155,8 @@ def get_sommets(massif_id: str) -> List[Dict]:
     Returns:
         List[Dict]: List of summits with their details.
     """
-    url = SKITOUR_API_URL + 'sommets'
-    headers = {'cle': os.getenv('SKITOUR_API_TOKEN')}
     params = {'m': massif_id}
-    response = requests.get(url, headers=headers, params=params)
+    response = get_client().get('sommets', params=params)
     response = response.json()
     sommets = []
     for _sommets in response:
@@ -69,16 +178,12 @@ def get_refuges(massif_ids: str) -> List[Dict]:
     Returns:
         List[Dict]: List of refuges.
     """
-    url = SKITOUR_API_URL + 'refuges'
-    headers = {'cle': os.getenv('SKITOUR_API_TOKEN')}
     params = {'m': massif_ids}
-    response = requests.get(url, headers=headers, params=params, timeout=10)
+    response = get_client().get('refuges', params=params)
     return response.json()
 
 def get_details_topo(id_topo):
-    url = SKITOUR_API_URL + f'topo/{id_topo}'
-    headers = {'cle': os.getenv('SKITOUR_API_TOKEN')}
-    response = requests.get(url, headers=headers)
+    response = get_client().get(f'topo/{id_topo}')
     return response.json()
 
 def get_conditions(massif_ids: str) -> List[Dict]:
@@ -91,10 +196,8 @@ def get_conditions(massif_ids: str) -> List[Dict]:
     Returns:
         List[Dict]: List of refuges.
     """
-    url = SKITOUR_API_URL + 'refuges'
-    headers = {'cle': os.getenv('SKITOUR_API_TOKEN')}
     params = {'m': massif_ids}
-    response = requests.get(url, headers=headers, params=params, timeout=10)
+    response = get_client().get('refuges', params=params)
     return response.json()
 
 def get_outing(id_outing: str) -> Dict:
@@ -107,34 +210,61 @@ def get_outing(id_outing: str) -> Dict:
     Returns:
         Dict: Details of the outing.
     """
-    url = SKITOUR_API_URL + f'sortie/{id_outing}'
-    headers = {'cle': os.getenv('SKITOUR_API_TOKEN')}
-    response = requests.get(url, headers=headers, timeout=10)
+    response = get_client().get(f'sortie/{id_outing}')
     return response.json()
 
-def get_recent_outings(massif_id: str) -> List[Dict]:
+def _get_outing_or_error(id_outing: str) -> Dict:
+    """
+    Fetch the details of an outing, reporting failures instead of raising them.
+
+    Args:
+        id_outing (str): ID of the outing.
+
+    Returns:
+        Dict: Details of the outing, or a dictionary with an `error` key.
+    """
+    try:
+        return get_outing(id_outing)
+    except (requests.RequestException, ValueError) as e:
+        return {'error': f"Could not fetch outing {id_outing}: {e}"}
+
+def get_outings(massif_id: str, days: int = 30) -> List[Dict]:
+    """
+    Fetch the outings of a given massif over the last days, without their details.
+
+    Args:
+        massif_id (str): ID of the massif.
+        days (int): Number of days to look back.
+
+    Returns:
+        List[Dict]: List of outings, with their date as a timestamp.
+    """
+    params = {'m': massif_id, 'j': days}
+    response = get_client().get('sorties', params=params)
+    return response.json() or []
+
+def get_recent_outings(massif_id: str, max_workers: int = SKITOUR_MAX_WORKERS, days: int = 30) -> List[Dict]:
     """
     Fetch the list of recent outings for a given massif.
 
+    The details of the outings are fetched concurrently, in the order of the list.
+
     Args:
         massif_id (str): ID of the massif.
+        max_workers (int): Maximum number of outing details fetched in parallel.
+        days (int): Number of days to look back.
 
     Returns:
         List[Dict]: List of recent outings.
     """
-    url = SKITOUR_API_URL + 'sorties'
-    headers = {'cle': os.getenv('SKITOUR_API_TOKEN')}
-    params = {'m': massif_id, 'j':30}
-    response = requests.get(url, headers=headers, params=params, timeout=10)
-    response = response.json()
+    response = get_outings(massif_id, days=days)
     if response:
-    
         for _response in response:
             _response['date'] = datetime.datetime.fromtimestamp(float(_response['date'])).strftime('%Y-%m-%d')
-            _response['description'] = get_outing(_response['id'])
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            descriptions = executor.map(_get_outing_or_error, [_response['id'] for _response in response])
+            for _response, description in zip(response, descriptions):
+                _response['description'] = description
         return response
     else: 
         return []
-    
-
-   
\ No newline at end of file
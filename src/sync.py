@@ -0,0 +1,249 @@
+"""
+Incremental synchronization of the Skitour data into the local store.
+
+Run once with `python -m src.sync`, or periodically with `python -m src.sync --interval 21600`.
+The job can also run in a background thread of the app with `start_background_sync`.
+"""
+import json
+import time
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+from dotenv import load_dotenv
+from src.skitour_api import (get_massifs,
+                             get_topos,
+                             get_sommets,
+                             get_refuges,
+                             get_outings,
+                             _get_outing_or_error)
+from src.replay import configure_http_from_env
+from src.topo_store import TopoStore, TOPO_STORE_TTL, get_topo_store
+
+SYNC_MAX_WORKERS = 4
+SYNC_INTERVAL = 6 * 3600
+# Skitour only serves the outings of the last 30 days
+OUTINGS_WINDOW_DAYS = 30
+# Outings synchronized less than this ago are served from the local store
+OUTINGS_TTL = 24 * 3600
+
+
+@dataclass
+class SyncStats:
+    """Counters of a synchronization run."""
+    massifs: int = 0
+    topos_written: int = 0
+    summits_synced: int = 0
+    refuges_synced: int = 0
+    outings_written: int = 0
+    outings_failed: int = 0
+    skipped: int = 0
+    errors: List[str] = field(default_factory=list)
+    duration: float = 0.0
+
+    def merge(self, other: "SyncStats"):
+        for name in ("massifs", "topos_written", "summits_synced", "refuges_synced", "outings_written", "outings_failed", "skipped"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.errors.extend(other.errors)
+
+    def __str__(self) -> str:
+        return (
+            f"Synced {self.massifs} massifs in {self.duration:.1f}s: {self.topos_written} topos, "
+            f"{self.summits_synced} summit lists, {self.refuges_synced} refuge lists, "
+            f"{self.outings_written} outings written, {self.outings_failed} outings failed, "
+            f"{self.skipped} steps up to date, {len(self.errors)} errors"
+        )
+
+
+def _outings_checkpoint(massif_id: str) -> str:
+    return f"outings:{massif_id}"
+
+def _failed_outings_checkpoint(massif_id: str) -> str:
+    return f"outings_failed:{massif_id}"
+
+def outings_are_fresh(store: TopoStore, massif_id: str, ttl: float = OUTINGS_TTL) -> bool:
+    """
+    Check whether the outings of a massif have been synchronized recently and completely.
+
+    Args:
+        store (TopoStore): Local store.
+        massif_id (str): ID of the massif.
+        ttl (float): Maximum age of the synchronization in seconds.
+
+    Returns:
+        bool: True if the stored outings can be served instead of live ones.
+    """
+    _, updated_at = store.get_checkpoint(_outings_checkpoint(massif_id))
+    if updated_at is None or time.time() - updated_at >= ttl:
+        return False
+    # Outings whose details could not be fetched are missing from the store
+    failed, _ = store.get_checkpoint(_failed_outings_checkpoint(massif_id))
+    return not failed or failed == "0"
+
+
+class SkitourSync:
+    """
+    Incremental synchronization job of the Skitour massifs, topos, summits, refuges and outings.
+
+    Each step of each massif is checkpointed in the store, so an interrupted run resumes
+    where it stopped: massifs synchronized less than `ttl` ago are skipped, and only
+    outings newer than the last synchronized date and not stored yet are fetched.
+
+    Args:
+        store (TopoStore): Local store, defaults to the shared store.
+        max_workers (int): Maximum number of massifs synchronized in parallel, which bounds
+            the number of concurrent requests to Skitour.
+        ttl (float): Time in seconds after which topos, summits and refuges are fetched again.
+    """
+
+    def __init__(self, store: Optional[TopoStore] = None, max_workers: int = SYNC_MAX_WORKERS, ttl: float = TOPO_STORE_TTL):
+        self.store = store or get_topo_store()
+        self.max_workers = max_workers
+        self.ttl = ttl
+
+    def run(self, massif_ids: Optional[List[str]] = None, full: bool = False) -> SyncStats:
+        """
+        Synchronize the given massifs, all of them by default.
+
+        Args:
+            massif_ids (List[str]): IDs of the massifs to synchronize.
+            full (bool): Ignore the checkpoints and fetch everything again.
+
+        Returns:
+            SyncStats: Counters of the run.
+        """
+        start = time.time()
+        stats = SyncStats()
+        if massif_ids is None:
+            massifs = get_massifs()
+            self.store.set_checkpoint("massifs", json.dumps(massifs))
+            massif_ids = [str(massif['id']) for massif in massifs]
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            for massif_stats in executor.map(lambda massif_id: self.sync_massif(massif_id, full), massif_ids):
+                stats.merge(massif_stats)
+        stats.duration = time.time() - start
+        return stats
+
+    def sync_massif(self, massif_id: str, full: bool = False) -> SyncStats:
+        """
+        Synchronize one massif. Failing steps are reported in the stats and retried on next run.
+
+        Args:
+            massif_id (str): ID of the massif.
+            full (bool): Ignore the checkpoints and fetch everything again.
+
+        Returns:
+            SyncStats: Counters of the massif.
+        """
+        stats = SyncStats(massifs=1)
+        steps = (
+            ("topos", self._sync_topos),
+            ("sommets", self._sync_collection("sommets", get_sommets, "summits_synced")),
+            ("refuges", self._sync_collection("refuges", get_refuges, "refuges_synced")),
+            ("outings", self._sync_outings),
+        )
+        for name, step in steps:
+            try:
+                step(str(massif_id), full, stats)
+            except Exception as e:
+                stats.errors.append(f"{name} of massif {massif_id}: {e!r}")
+        return stats
+
+    def _sync_topos(self, massif_id: str, full: bool, stats: SyncStats):
+        if not full and not self.store.stale_massifs([massif_id], ttl=self.ttl):
+            stats.skipped += 1
+            return
+        stats.topos_written += self.store.upsert_topos(get_topos(massif_id), massif_id, replace=True)
+        self.store.mark_synced(massif_id)
+
+    def _sync_collection(self, name: str, fetch, counter: str):
+        def sync(massif_id: str, full: bool, stats: SyncStats):
+            if not full and self.store.get_collection(name, massif_id, ttl=self.ttl) is not None:
+                stats.skipped += 1
+                return
+            self.store.set_collection(name, massif_id, fetch(massif_id))
+            setattr(stats, counter, getattr(stats, counter) + 1)
+        return sync
+
+    def _sync_outings(self, massif_id: str, full: bool, stats: SyncStats):
+        checkpoint = _outings_checkpoint(massif_id)
+        last_date, _ = self.store.get_checkpoint(checkpoint)
+        days = OUTINGS_WINDOW_DAYS
+        if last_date and not full:
+            # Outings of the last synchronized day may have been published after the previous run
+            elapsed = (datetime.date.today() - datetime.date.fromisoformat(last_date)).days
+            days = min(OUTINGS_WINDOW_DAYS, elapsed + 1)
+        known_ids = set() if full else self.store.known_outing_ids(massif_id)
+        outings = [outing for outing in get_outings(massif_id, days=days) if str(outing['id']) not in known_ids]
+        for outing in outings:
+            outing['date'] = datetime.datetime.fromtimestamp(float(outing['date'])).strftime('%Y-%m-%d')
+            outing['description'] = _get_outing_or_error(outing['id'])
+            if 'error' in outing['description']:
+                stats.errors.append(outing['description']['error'])
+        # Outings whose details could not be fetched are left out, to be fetched again on next run
+        failed = [outing for outing in outings if 'error' in outing['description']]
+        outings = [outing for outing in outings if 'error' not in outing['description']]
+        stats.outings_written += self.store.upsert_outings(outings, massif_id)
+        stats.outings_failed += len(failed)
+        self.store.set_checkpoint(_failed_outings_checkpoint(massif_id), str(len(failed)))
+        if failed:
+            # The next run looks back to the oldest failed outing, the stored ones being skipped
+            next_date = min(outing['date'] for outing in failed)
+        else:
+            dates = [outing['date'] for outing in outings] + ([last_date] if last_date else [])
+            next_date = max(dates) if dates else datetime.date.today().isoformat()
+        self.store.set_checkpoint(checkpoint, next_date)
+
+
+def start_background_sync(interval: float = SYNC_INTERVAL, **kwargs) -> threading.Event:
+    """
+    Run the synchronization job periodically in a daemon thread.
+
+    Args:
+        interval (float): Time between two runs in seconds.
+        **kwargs: Arguments forwarded to `SkitourSync`.
+
+    Returns:
+        threading.Event: Event to set to stop the job.
+    """
+    stop = threading.Event()
+
+    def loop():
+        job = SkitourSync(**kwargs)
+        while not stop.is_set():
+            try:
+                print(job.run())
+            except Exception as e:
+                print(f"Skitour sync failed: {e!r}")
+            stop.wait(interval)
+
+    threading.Thread(target=loop, name="skitour-sync", daemon=True).start()
+    return stop
+
+def main():
+    parser = argparse.ArgumentParser(description="Synchronize Skitour data into the local store.")
+    parser.add_argument("--massifs", help="Massif ids separated by commas, all massifs by default")
+    parser.add_argument("--full", action="store_true", help="Ignore checkpoints and fetch everything again")
+    parser.add_argument("--workers", type=int, default=SYNC_MAX_WORKERS, help="Massifs synchronized in parallel")
+    parser.add_argument("--interval", type=float, help="Run again every INTERVAL seconds instead of once")
+    parser.add_argument("--json", action="store_true", help="Print the stats as JSON")
+    args = parser.parse_args()
+    load_dotenv()
+    configure_http_from_env()
+
+    massif_ids = [massif_id.strip() for massif_id in args.massifs.split(",")] if args.massifs else None
+    job = SkitourSync(max_workers=args.workers)
+    while True:
+        stats = job.run(massif_ids, full=args.full)
+        print(json.dumps(asdict(stats)) if args.json else stats)
+        for error in stats.errors if not args.json else []:
+            print(f"  error: {error}")
+        if args.interval is None:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,31 @@
 import os
+import json
+import asyncio
+import datetime
 import pandas as pd
 from smolagents import Tool
 from typing import List, Dict, Any, Union, Tuple
-from meteofrance_api import MeteoFranceClient
-from src.skitour_api import get_topos, get_refuges, get_details_topo, get_massifs, get_recent_outings
-from src.meteo_france_api import get_massif_conditions
-from src.utils import geocode_location, assign_location_to_clusters, haversine, llm_summarizer
+from src.skitour_api import get_refuges, get_recent_outings
+from src.catalog import get_massif_catalog
+from src.topo_store import TopoStore, get_topo_store
+from src.sync import outings_are_fresh, OUTINGS_WINDOW_DAYS
+from src.meteo_france_api import bulletin_cache
+from src.cache import record_unavailable
+from src.forecast import compact_forecast
+from src.async_api import run_sync, get_async_skitour_client, get_async_meteo_france_client
+from src.metrics import instrumented
+from src.utils import geocode_location, get_summit_index, haversine, llm_summarizer
 
+DESCRIBE_ROUTE_BRANCH_TIMEOUT = float(os.getenv("DESCRIBE_ROUTE_BRANCH_TIMEOUT", 90))
+# Prefix of the values that could not be retrieved in a partial result
+BRANCH_FAILED_MARKER = "UNAVAILABLE:"
+# Set SUMMARIZE_FORECAST=0 to return the compact forecast table instead of an LLM summary
+SUMMARIZE_FORECAST = os.getenv("SUMMARIZE_FORECAST", "1") != "0"
+# Routes starting closer than this share a single forecast in `describe_routes`
+FORECAST_GROUP_RADIUS_KM = 2.0
 
 
+@instrumented
 class RefugeTool(Tool):
     name = "refuge_recherche"
     description = "Recherche d'un refuge dans un massif donné"
@@ -22,9 +39,11 @@ class RefugeTool(Tool):
     output_type = "string"
 
     def forward(self, massif_id) -> List[Dict]:
-        return get_refuges(massif_id)
+        refuges = get_topo_store().get_collection("refuges", massif_id) if massif_id else None
+        return refuges if refuges is not None else get_refuges(massif_id)
     
     
+@instrumented
 class GetRoutesTool(Tool):
     name = "list_routes"
     description = """
@@ -43,16 +62,147 @@ class GetRoutesTool(Tool):
 
     def forward(self, mountain_range_ids: str) -> List[Dict]:
 
-        topos = get_topos(mountain_range_ids)
+        # Served from the local store, massifs missing from it are fetched live
+        store = get_topo_store()
+        massif_ids = parse_range_ids(mountain_range_ids)
+        ensure_topos_stored(massif_ids, store)
+        topos = store.get_topos(massif_ids)
         
         return topos
+
+
+def parse_range_ids(mountain_range_ids: str) -> List[str]:
+    """
+    Split a comma separated list of mountain range ids.
+
+    Args:
+        mountain_range_ids (str): Mountain range ids separated by commas.
+
+    Returns:
+        List[str]: Mountain range ids.
+    """
+    return [range_id.strip() for range_id in str(mountain_range_ids).split(",") if range_id.strip()]
+
+async def _fetch_topos(massif_ids: List[str]) -> List[Union[List[Dict], BaseException]]:
+    skitour_client = get_async_skitour_client()
+    return await asyncio.gather(
+        *(skitour_client.get_topos(massif_id) for massif_id in massif_ids), return_exceptions=True
+    )
+
+def ensure_topos_stored(massif_ids: List[str], store: TopoStore):
+    """
+    Fetch the topos of the massifs missing from the local store, or outdated in it.
+
+    A massif is marked as synced only once its topos were fetched successfully, so a failed
+    fetch is retried on next use while the previously stored topos are still served.
+
+    Args:
+        massif_ids (List[str]): IDs of the massifs.
+        store (TopoStore): Local topo store.
+
+    Raises:
+        Exception: The first fetch error, if the topos of none of the stale massifs could be fetched.
+    """
+    stale_massifs = store.stale_massifs(massif_ids)
+    if not stale_massifs:
+        return
+    errors = []
+    for massif_id, topos in zip(stale_massifs, run_sync(_fetch_topos(stale_massifs))):
+        if isinstance(topos, BaseException):
+            errors.append(topos)
+            continue
+        store.upsert_topos(topos, massif_id, replace=True)
+        store.mark_synced(massif_id)
+    if len(errors) == len(stale_massifs):
+        raise errors[0]
+
+
+@instrumented
+class SearchRoutesTool(Tool):
+    name = "search_routes"
+    description = """
+    Searches ski touring routes in a given list of mountain ranges, filtered by difficulty, elevation gain, orientation or distance to a location.
+    Prefer this tool over `list_routes` when looking for routes matching criteria: filtering is done by the tool, not in your code.
+    Returns a list of routes with their id, name, grades, elevation gain, orientation, start coordinates and link.
+    Use `describe_route` afterwards to get the details and conditions of a route.
+    """
+
+    inputs = {
+        "mountain_range_ids": {
+            "description": "Mountain range ids separated by commas",
+            "type": "string",
+        },
+        "ski_difficulty_max": {
+            "description": "[Optional, default: None] Maximum ski difficulty, from 1.1 to 5.6",
+            "type": "number",
+            "nullable": True,
+        },
+        "ascent_grade_max": {
+            "description": "[Optional, default: None] Hardest accepted ascent grade among R, F, PD, AD, D",
+            "type": "string",
+            "nullable": True,
+        },
+        "exposure_max": {
+            "description": "[Optional, default: None] Maximum exposure grade, from 1 to 4",
+            "type": "integer",
+            "nullable": True,
+        },
+        "elevation_gain_min": {
+            "description": "[Optional, default: None] Minimum elevation gain in meters",
+            "type": "integer",
+            "nullable": True,
+        },
+        "elevation_gain_max": {
+            "description": "[Optional, default: None] Maximum elevation gain in meters",
+            "type": "integer",
+            "nullable": True,
+        },
+        "orientations": {
+            "description": "[Optional, default: None] Accepted orientations separated by commas, e.g. 'N, NE, E'",
+            "type": "string",
+            "nullable": True,
+        },
+        "limit": {
+            "description": "[Optional, default: 20] Maximum number of routes to return",
+            "type": "integer",
+            "nullable": True,
+        },
+    }
+    output_type = "any"
+
+    def forward(
+        self,
+        mountain_range_ids: str,
+        ski_difficulty_max: float = None,
+        ascent_grade_max: str = None,
+        exposure_max: int = None,
+        elevation_gain_min: int = None,
+        elevation_gain_max: int = None,
+        orientations: str = None,
+        limit: int = 20,
+    ) -> List[Dict]:
+        store = get_topo_store()
+        massif_ids = parse_range_ids(mountain_range_ids)
+        ensure_topos_stored(massif_ids, store)
+        return store.search(
+            massif_ids=massif_ids,
+            ski_grade_max=ski_difficulty_max,
+            ascent_grade_max=ascent_grade_max,
+            exposure_max=exposure_max,
+            elevation_gain_min=elevation_gain_min,
+            elevation_gain_max=elevation_gain_max,
+            orientations=parse_range_ids(orientations) if orientations else None,
+            limit=limit or 20,
+        )
         
+@instrumented
 class DescribeRouteTool(Tool):
     name = "describe_route"
     description = """ 
     Searches for key information about a specific ski touring route, including weather forecasts and associated avalanche risks. 
     Always use this tool after using the `list_routes` tool.
     This tool returns a dictionary containing the route's information, the avalanche risk estimation bulletin, and the weather forecast for the coming days of the route.
+    If some information could not be retrieved, its value starts with `UNAVAILABLE` and the reason is listed under `errors`.
     """
     inputs = {
         "id_route": {
@@ -65,33 +215,181 @@ class DescribeRouteTool(Tool):
     }
     output_type = "any"
     
-    def __init__(self, skitour2meteofrance: dict, llm_engine: Any):
+    def __init__(self, skitour2meteofrance: dict, llm_engine: Any, branch_timeout: float = DESCRIBE_ROUTE_BRANCH_TIMEOUT,
+                 summarize_forecast: bool = SUMMARIZE_FORECAST):
         super().__init__()
         self.massifs_infos = skitour2meteofrance
-        self.weather_client =  MeteoFranceClient(access_token=os.getenv("METEO_FRANCE_API_KEY"))   
         self.llm_engine = llm_engine
+        self.branch_timeout = branch_timeout
+        self.summarize_forecast = summarize_forecast
 
-    def forward(self, id_route: str, id_range: str) -> dict:
-
-        topo_info = get_details_topo(str(id_route))
-        avalanche_conditions = get_massif_conditions(
-            self.massifs_infos[str(id_range)]['meteofrance_id']
+    async def _summarize_avalanche(self, id_range: str) -> str:
+        # An unknown range only fails the avalanche branch of the description
+        if id_range not in self.massifs_infos:
+            raise KeyError(f"Unknown mountain range {id_range}")
+        meteofrance_id = self.massifs_infos[id_range]['meteofrance_id']
+        avalanche_conditions = await get_async_meteo_france_client().get_massif_conditions(meteofrance_id)
+        # The summary is outdated as soon as the bulletin is
+        return await asyncio.to_thread(
+            llm_summarizer,
+            str(avalanche_conditions),
+            self.llm_engine,
+            expires_at=bulletin_cache.expiry(str(meteofrance_id)),
             )
+
+    async def _summarize_forecast_at(self, lat: float, lon: float) -> str:
+        weather_forecast = await get_async_meteo_france_client().get_forecast(lat, lon)
+        forecast_table = compact_forecast(weather_forecast)
+        if not self.summarize_forecast:
+            return forecast_table
+        return await asyncio.to_thread(llm_summarizer, forecast_table, self.llm_engine)
+
+    async def _summarize_forecast(self, topo_task: asyncio.Task) -> str:
+        # The forecast is the only branch depending on the topo, for its coordinates
+        topo_info = await asyncio.shield(topo_task)
         lat, lon = topo_info["depart"]["latlon"]
-        weather_forecast = self.weather_client.get_forecast(float(lat), float(lon))
-        daily_forecast = weather_forecast.forecast[:24]
-
-        for day_forecast in daily_forecast:
-            day_forecast["dt"] = weather_forecast.timestamp_to_locale_time(day_forecast["dt"]).isoformat()
-        forecast_summary = llm_summarizer(str(daily_forecast), self.llm_engine)
-        avalanche_summary = llm_summarizer(str(avalanche_conditions), self.llm_engine)
-        return {
-            "route_info": topo_info, 
-            "avalanche_conditions": avalanche_summary,
-            "daily_weather_forecast": forecast_summary,
-            "route_link": f"https://skitour.fr/topos/{id_route}"
-            }   
+        return await self._summarize_forecast_at(float(lat), float(lon))
+
+    def _format_description(self, id_route: str, results: Dict[str, Any]) -> dict:
+        description, errors = {}, {}
+        for name, result in results.items():
+            if isinstance(result, BaseException):
+                if isinstance(result, asyncio.TimeoutError):
+                    reason = f"timed out after {self.branch_timeout}s"
+                else:
+                    reason = repr(result)
+                errors[name] = reason
+                result = f"{BRANCH_FAILED_MARKER} {reason}"
+                record_unavailable(f"{name}:{id_route}")
+            description[name] = result
+        description["route_link"] = f"https://skitour.fr/topos/{id_route}"
+        if errors:
+            description["errors"] = errors
+        return description
+
+    async def _describe(self, id_route: str, id_range: str) -> dict:
+        timeout = self.branch_timeout
+        topo_task = asyncio.ensure_future(
+            asyncio.wait_for(get_async_skitour_client().get_details_topo(id_route), timeout)
+            )
+        branches = {
+            "route_info": topo_task,
+            "avalanche_conditions": asyncio.ensure_future(asyncio.wait_for(
+                self._summarize_avalanche(id_range), timeout
+                )),
+            "daily_weather_forecast": asyncio.ensure_future(asyncio.wait_for(
+                self._summarize_forecast(topo_task), timeout
+                )),
+        }
+        results = await asyncio.gather(*branches.values(), return_exceptions=True)
+        return self._format_description(id_route, dict(zip(branches, results)))
+
+    def forward(self, id_route: str, id_range: str) -> dict:
+        return run_sync(self._describe(str(id_route), str(id_range)))
     
+@instrumented
+class DescribeRoutesTool(DescribeRouteTool):
+    name = "describe_routes"
+    description = """ 
+    Batch version of `describe_route`: searches for key information about several ski touring routes at once, including weather forecasts and associated avalanche risks.
+    Prefer this tool over calling `describe_route` several times when comparing candidate routes.
+    This tool returns a list with, for each route and in the same order, the same dictionary as `describe_route`.
+    """
+    inputs = {
+        "routes": {
+            "description": "List of [id_route, id_range] pairs, e.g. [['770', '25'], ['104', '14']]",
+            "type": "any",
+        }
+    }
+    output_type = "any"
+
+    def __init__(self, skitour2meteofrance: dict, llm_engine: Any, branch_timeout: float = DESCRIBE_ROUTE_BRANCH_TIMEOUT,
+                 summarize_forecast: bool = SUMMARIZE_FORECAST, forecast_group_radius: float = FORECAST_GROUP_RADIUS_KM):
+        super().__init__(skitour2meteofrance, llm_engine, branch_timeout=branch_timeout, summarize_forecast=summarize_forecast)
+        self.forecast_group_radius = forecast_group_radius
+
+    @staticmethod
+    def _parse_routes(routes: Any) -> List[Tuple[str, str]]:
+        if isinstance(routes, str):
+            routes = json.loads(routes)
+        pairs = []
+        for route in routes:
+            if isinstance(route, dict):
+                route = (route["id_route"], route["id_range"])
+            id_route, id_range = route
+            pairs.append((str(id_route), str(id_range)))
+        return pairs
+
+    def _group_start_points(
+        self, topos: List[Any]
+    ) -> Tuple[List[Tuple[float, float]], Dict[int, int], Dict[int, BaseException]]:
+        # Greedily group start points closer than `forecast_group_radius` so they share a forecast.
+        # Routes without a usable start point are left out, with the reason of their failure.
+        groups, route_groups, route_errors = [], {}, {}
+        for i, topo_info in enumerate(topos):
+            if isinstance(topo_info, BaseException):
+                route_errors[i] = topo_info
+                continue
+            try:
+                lat, lon = (float(coordinate) for coordinate in topo_info["depart"]["latlon"])
+            except (KeyError, TypeError, ValueError) as e:
+                route_errors[i] = ValueError(f"No start point in the topo: {e!r}")
+                continue
+            for group, (group_lat, group_lon) in enumerate(groups):
+                if haversine(lat, lon, group_lat, group_lon) <= self.forecast_group_radius:
+                    break
+            else:
+                groups.append((lat, lon))
+                group = len(groups) - 1
+            route_groups[i] = group
+        return groups, route_groups, route_errors
+
+    async def _describe_all(self, routes: List[Tuple[str, str]]) -> List[dict]:
+        timeout = self.branch_timeout
+        skitour_client = get_async_skitour_client()
+        topo_tasks = [
+            asyncio.ensure_future(asyncio.wait_for(skitour_client.get_details_topo(id_route), timeout))
+            for id_route, _ in routes
+        ]
+        # One bulletin summary per Météo-France massif, whatever the number of routes in it
+        meteofrance_ids = {
+            id_range: self.massifs_infos[id_range]['meteofrance_id']
+            for _, id_range in routes if id_range in self.massifs_infos
+        }
+        range_by_meteofrance_id = {meteofrance_id: id_range for id_range, meteofrance_id in meteofrance_ids.items()}
+        avalanche_tasks = {
+            meteofrance_id: asyncio.ensure_future(asyncio.wait_for(self._summarize_avalanche(id_range), timeout))
+            for meteofrance_id, id_range in range_by_meteofrance_id.items()
+        }
+
+        topos = await asyncio.gather(*topo_tasks, return_exceptions=True)
+        groups, route_groups, route_errors = self._group_start_points(topos)
+        forecast_results = await asyncio.gather(
+            *(asyncio.wait_for(self._summarize_forecast_at(lat, lon), timeout) for lat, lon in groups),
+            return_exceptions=True,
+        )
+        avalanche_results = dict(zip(
+            avalanche_tasks, await asyncio.gather(*avalanche_tasks.values(), return_exceptions=True)
+        ))
+
+        descriptions = []
+        for i, (id_route, id_range) in enumerate(routes):
+            if id_range in meteofrance_ids:
+                avalanche_conditions = avalanche_results[meteofrance_ids[id_range]]
+            else:
+                avalanche_conditions = KeyError(f"Unknown mountain range {id_range}")
+            daily_weather_forecast = forecast_results[route_groups[i]] if i in route_groups else route_errors[i]
+            descriptions.append(self._format_description(id_route, {
+                "route_info": topos[i],
+                "avalanche_conditions": avalanche_conditions,
+                "daily_weather_forecast": daily_weather_forecast,
+            }))
+        return descriptions
+
+    def forward(self, routes: Any) -> List[dict]:
+        return run_sync(self._describe_all(self._parse_routes(routes)))
+
+@instrumented
 class RecentOutingsTool(Tool):
     name = "recent_outings"
     description = """ 
@@ -107,8 +405,13 @@ class RecentOutingsTool(Tool):
     output_type = "any"
     
     def forward(self, id_range: str) -> List[Dict]:
+        store = get_topo_store()
+        if outings_are_fresh(store, id_range):
+            since = (datetime.date.today() - datetime.timedelta(days=OUTINGS_WINDOW_DAYS)).isoformat()
+            return store.get_recent_outings(id_range, since)
         return get_recent_outings(id_range)
     
+@instrumented
 class MountainRangesTool(Tool):
     name = "list_mountain_ranges"
     description = """ Searches for the ID(s) of the mountain ranges closest to a given location.
@@ -132,25 +435,26 @@ class MountainRangesTool(Tool):
     def __init__(self, clusters: Dict[str, List[Tuple[float, float]]]):
         super().__init__()
         self.clusters = clusters
+        self.summit_index = get_summit_index(clusters)
+        self.massif_catalog = get_massif_catalog()
 
     def forward(self, location: str, num_ranges: int) -> Union[str, None]:
 
         coord_location = geocode_location(location)
-        if not location:
+        if not coord_location:
             return None
         
-        matched_ranges = assign_location_to_clusters(coord_location, self.clusters, k=num_ranges)
+        matched_ranges = self.summit_index.nearest(coord_location, k=num_ranges)
 
         
         list_ranges = [range[0] for range in matched_ranges if range[1] < 100]
         if not list_ranges:
             return ''
-      
-        massifs= get_massifs()
-       
-        massif_ids = [_massif['id'] for _massif in massifs if _massif['nom'] in list_ranges]
+
+        massif_ids = self.massif_catalog.ids_for_names(list_ranges)
         return ", ".join(massif_ids)
     
+@instrumented
 class ForecastTool(Tool):
     name = "forecast"
     description = """Searches for the weather forecast for a given location as well as the current avalanche risk estimation bulletin.  
@@ -165,42 +469,48 @@ class ForecastTool(Tool):
     
     output_type = "any"
 
-    def __init__(self, llm_engine, clusters: Dict[str, List[Tuple[float, float]]], skitour2meteofrance: dict):
+    def __init__(self, llm_engine, clusters: Dict[str, List[Tuple[float, float]]], skitour2meteofrance: dict,
+                 summarize_forecast: bool = SUMMARIZE_FORECAST):
         super().__init__()
+        self.summarize_forecast = summarize_forecast
         self.clusters = clusters
+        self.summit_index = get_summit_index(clusters)
         self.massifs_infos = skitour2meteofrance
+        self.massif_catalog = get_massif_catalog(skitour2meteofrance)
         self.llm_engine = llm_engine
         
+    async def _fetch(self, meteofrance_id: int, coord_location: Tuple[float, float]):
+        meteo_client = get_async_meteo_france_client()
+        return await asyncio.gather(
+            meteo_client.get_massif_conditions(meteofrance_id),
+            meteo_client.get_forecast(*coord_location),
+        )
+
     def forward(self, location: str) -> Union[Dict[str, Any], None]:
 
         coord_location = geocode_location(location)
-        if not location:
+        if not coord_location:
             return None
         
         # Get the closest mountain range to the location to get the avalanche conditions
-        matched_ranges = assign_location_to_clusters(coord_location, self.clusters, k=1)
+        matched_ranges = self.summit_index.nearest(coord_location, k=1)
         
         list_ranges = [range[0] for range in matched_ranges if range[1] < 100]
         if not list_ranges:
             return None
-      
-        massifs= get_massifs()
-       
-        massif_id = [_massif['id'] for _massif in massifs if _massif['nom'] in list_ranges]
-        
-        avalanche_conditions = get_massif_conditions(
-            self.massifs_infos[str(massif_id[0])]['meteofrance_id']
+
+        massif_id = self.massif_catalog.id_for_name(list_ranges[0])
+        if massif_id is None:
+            return None
+
+        meteofrance_id = self.massif_catalog.meteofrance_id(massif_id)
+        avalanche_conditions, forecast = run_sync(self._fetch(meteofrance_id, coord_location))
+        forecast_summary = compact_forecast(forecast)
+        if self.summarize_forecast:
+            forecast_summary = llm_summarizer(forecast_summary, self.llm_engine)
+        avalanche_summary = llm_summarizer(
+            str(avalanche_conditions), self.llm_engine, expires_at=bulletin_cache.expiry(str(meteofrance_id))
             )
-        
-        weather_client =  MeteoFranceClient(access_token=os.getenv("METEO_FRANCE_API_KEY"))
-        forecast = weather_client.get_forecast(*coord_location)
-        daily_forecast = forecast.forecast[:24]
-        
-        for day_forecast in daily_forecast:
-            day_forecast["dt"] = forecast.timestamp_to_locale_time(day_forecast["dt"]).isoformat()
-        
-        forecast_summary = llm_summarizer(str(daily_forecast), self.llm_engine)
-        avalanche_summary = llm_summarizer(str(avalanche_conditions), self.llm_engine)
             
     
         return {"forecast": forecast_summary, "avalanche_conditions": avalanche_summary}
\ No newline at end of file
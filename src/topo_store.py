@@ -0,0 +1,496 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from math import cos, radians
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from src.cache import CACHE_DIR
+from src.metrics import metrics
+from src.utils import haversine
+
+TOPO_STORE_PATH = os.getenv("TOPO_STORE_PATH", os.path.join(CACHE_DIR, "topos.sqlite"))
+# Massifs whose topos are older than this are fetched again before being searched
+TOPO_STORE_TTL = 7 * 24 * 3600
+ASCENT_GRADES = ["R", "F", "PD", "AD", "D", "TD", "ED"]
+ORIENTATIONS = ["N", "NE", "E", "SE", "S", "SW", "W", "NW"]
+ORIENTATION_ALIASES = {"SO": "SW", "O": "W", "NO": "NW"}
+# Field of the Skitour topo object read into each indexed column, the start point
+# being read from `depart.latlon` like the describe tools do
+TOPO_FIELDS = {
+    "name": "nom",
+    "ski_grade": "dif_ski",
+    "ascent_grade": "dif_montee",
+    "exposure": "expo",
+    "elevation_gain": "denivele",
+    "orientation": "orientation",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS topos (
+    id TEXT PRIMARY KEY,
+    massif_id TEXT,
+    name TEXT,
+    ski_grade REAL,
+    ascent_grade TEXT,
+    ascent_rank INTEGER,
+    exposure INTEGER,
+    elevation_gain INTEGER,
+    orientation TEXT,
+    start_lat REAL,
+    start_lon REAL,
+    updated_at REAL,
+    data TEXT,
+    position INTEGER
+);
+CREATE INDEX IF NOT EXISTS topos_massif ON topos (massif_id);
+CREATE INDEX IF NOT EXISTS topos_ski_grade ON topos (ski_grade);
+CREATE INDEX IF NOT EXISTS topos_ascent_rank ON topos (ascent_rank);
+CREATE INDEX IF NOT EXISTS topos_exposure ON topos (exposure);
+CREATE INDEX IF NOT EXISTS topos_elevation_gain ON topos (elevation_gain);
+CREATE INDEX IF NOT EXISTS topos_orientation ON topos (orientation);
+CREATE INDEX IF NOT EXISTS topos_start ON topos (start_lat, start_lon);
+CREATE TABLE IF NOT EXISTS massifs (
+    massif_id TEXT PRIMARY KEY,
+    synced_at REAL
+);
+CREATE TABLE IF NOT EXISTS collections (
+    name TEXT,
+    massif_id TEXT,
+    data TEXT,
+    synced_at REAL,
+    PRIMARY KEY (name, massif_id)
+);
+CREATE TABLE IF NOT EXISTS outings (
+    id TEXT PRIMARY KEY,
+    massif_id TEXT,
+    date TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS outings_massif_date ON outings (massif_id, date);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    name TEXT PRIMARY KEY,
+    value TEXT,
+    updated_at REAL
+);
+"""
+
+
+# Columns of the `topos` table, in the order of the rows built by `topo_row`
+TOPO_COLUMNS = (
+    "id", "massif_id", "name", "ski_grade", "ascent_grade", "ascent_rank", "exposure", "elevation_gain",
+    "orientation", "start_lat", "start_lon", "updated_at", "data", "position",
+)
+
+
+def _field(topo: Dict, column: str) -> Any:
+    value = topo.get(TOPO_FIELDS[column])
+    return None if value in (None, "") else value
+
+def _start_point(topo: Dict) -> Tuple[Optional[float], Optional[float]]:
+    start = topo.get("depart")
+    latlon = start.get("latlon") if isinstance(start, dict) else None
+    if not latlon or len(latlon) != 2:
+        return None, None
+    return _to_float(latlon[0]), _to_float(latlon[1])
+
+def _to_float(value: Any) -> Optional[float]:
+    match = re.search(r"\d+(?:[.,]\d+)?", str(value)) if value is not None else None
+    return float(match.group().replace(",", ".")) if match else None
+
+def _ascent_grade(value: Any) -> Optional[str]:
+    match = re.match(r"\s*(ED|TD|AD|PD|R|F|D)", str(value or "").upper())
+    return match.group(1) if match else None
+
+def _orientation(value: Any) -> Optional[str]:
+    if not value:
+        return None
+    orientation = str(value).strip().upper()
+    return ORIENTATION_ALIASES.get(orientation, orientation)
+
+def topo_row(topo: Dict, massif_id: Optional[str] = None, position: Optional[int] = None) -> Tuple:
+    """
+    Extract the indexed fields of a Skitour topo.
+
+    Args:
+        topo (Dict): Topo as returned by `get_topos`.
+        massif_id (str): Massif of the topo, read from the topo if not provided.
+        position (int): Position of the topo in the payload of its massif.
+
+    Returns:
+        Tuple: Row of the `topos` table.
+    """
+    massif = topo.get("massif")
+    if massif_id is None and isinstance(massif, dict):
+        massif_id = massif.get("id")
+    start_lat, start_lon = _start_point(topo)
+    ascent_grade = _ascent_grade(_field(topo, "ascent_grade"))
+    exposure = _to_float(_field(topo, "exposure"))
+    elevation_gain = _to_float(_field(topo, "elevation_gain"))
+    return (
+        str(topo["id"]),
+        str(massif_id) if massif_id is not None else None,
+        _field(topo, "name"),
+        _to_float(_field(topo, "ski_grade")),
+        ascent_grade,
+        ASCENT_GRADES.index(ascent_grade) if ascent_grade else None,
+        int(exposure) if exposure is not None else None,
+        int(elevation_gain) if elevation_gain is not None else None,
+        _orientation(_field(topo, "orientation")),
+        start_lat,
+        start_lon,
+        time.time(),
+        json.dumps(topo),
+        position,
+    )
+
+
+def missing_fields(row: Tuple) -> List[str]:
+    """
+    List the indexed columns of a topo row left empty, which the search filters on them exclude.
+
+    Args:
+        row (Tuple): Row of the `topos` table, see `topo_row`.
+
+    Returns:
+        List[str]: Names of the empty columns.
+    """
+    columns = dict(zip(
+        ("name", "ski_grade", "ascent_grade", "exposure", "elevation_gain", "orientation", "start_lat"),
+        (row[2], row[3], row[4], row[6], row[7], row[8], row[9]),
+    ))
+    return [column for column, value in columns.items() if value is None]
+
+
+class TopoStore:
+    """
+    Local SQLite store of the Skitour topos, indexed for filtered searches.
+
+    Also keeps the summits, refuges and recent outings of the massifs, and the
+    checkpoints of the synchronization job (see `src.sync`).
+
+    Args:
+        path (str): Path of the SQLite database.
+    """
+
+    def __init__(self, path: str = TOPO_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(topos)")]
+        if "position" not in columns:
+            # Stores created before the topos kept their upstream order
+            self._db.execute("ALTER TABLE topos ADD COLUMN position INTEGER")
+            self._db.commit()
+        self._lock = threading.Lock()
+
+    def upsert_topos(self, topos: Iterable[Dict], massif_id: Optional[str] = None, replace: bool = False) -> int:
+        """
+        Insert or update topos in the store, keeping their order in the payload.
+
+        Args:
+            topos (Iterable[Dict]): Topos as returned by `get_topos`.
+            massif_id (str): Massif of the topos, read from each topo if not provided.
+            replace (bool): The topos are all the topos of `massif_id`, the stored topos of the
+                massif missing from them were removed upstream and are deleted.
+
+        Returns:
+            int: Number of topos added, changed or deleted.
+        """
+        topos = [topo for topo in topos if isinstance(topo, dict) and "id" in topo]
+        rows = [topo_row(topo, massif_id, position) for position, topo in enumerate(topos)]
+        # Topos without a field are left out of the searches filtering on it, count them to spot schema changes
+        for row in rows:
+            for column in missing_fields(row):
+                metrics.inc("topo_store_missing_fields_total", field=column)
+        with self._lock, self._db:
+            ids = [row[0] for row in rows]
+            stored = {
+                topo_id: (data, position) for topo_id, data, position in self._db.execute(
+                    f"SELECT id, data, position FROM topos WHERE id IN ({','.join('?' * len(ids))})", ids
+                ).fetchall()
+            } if ids else {}
+            # Only write the topos that are new, changed or moved upstream
+            rows = [row for row in rows if stored.get(row[0]) != row[-2:]]
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO topos ({', '.join(TOPO_COLUMNS)}) VALUES ({', '.join('?' * len(TOPO_COLUMNS))})",
+                rows,
+            )
+            deleted = 0
+            if replace and massif_id is not None:
+                deleted = self._db.execute(
+                    f"DELETE FROM topos WHERE massif_id = ? AND id NOT IN ({','.join('?' * len(ids))})",
+                    [str(massif_id), *ids],
+                ).rowcount
+        return len(rows) + deleted
+
+    def mark_synced(self, massif_id: str, synced_at: Optional[float] = None):
+        """
+        Record that all the topos of a massif have been stored.
+
+        Args:
+            massif_id (str): ID of the massif.
+            synced_at (float): Timestamp of the synchronization, defaults to now.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO massifs VALUES (?, ?)",
+                (str(massif_id), time.time() if synced_at is None else synced_at),
+            )
+
+    def stale_massifs(self, massif_ids: Iterable[str], ttl: float = TOPO_STORE_TTL) -> List[str]:
+        """
+        Get the massifs whose topos are missing from the store or older than `ttl`.
+
+        Args:
+            massif_ids (Iterable[str]): IDs of the massifs.
+            ttl (float): Maximum age of the topos in seconds.
+
+        Returns:
+            List[str]: IDs of the stale massifs.
+        """
+        massif_ids = [str(massif_id) for massif_id in massif_ids]
+        if not massif_ids:
+            return []
+        with self._lock:
+            synced = dict(self._db.execute(
+                f"SELECT massif_id, synced_at FROM massifs WHERE massif_id IN ({','.join('?' * len(massif_ids))})",
+                massif_ids,
+            ).fetchall())
+        return [massif_id for massif_id in massif_ids if time.time() - synced.get(massif_id, 0) > ttl]
+
+    def get_topos(self, massif_ids: Iterable[str]) -> List[Dict]:
+        """
+        Get the stored topos of some massifs.
+
+        Args:
+            massif_ids (Iterable[str]): IDs of the massifs.
+
+        Returns:
+            List[Dict]: Stored topos, as returned by `get_topos`.
+        """
+        massif_ids = [str(massif_id) for massif_id in massif_ids]
+        if not massif_ids:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT massif_id, data FROM topos WHERE massif_id IN ({','.join('?' * len(massif_ids))}) "
+                "ORDER BY position, id",
+                massif_ids,
+            ).fetchall()
+        # Massif by massif in the requested order, each in the order of its payload
+        rows.sort(key=lambda row: massif_ids.index(row[0]))
+        return [json.loads(row[1]) for row in rows]
+
+    def set_collection(self, name: str, massif_id: str, items: List[Dict]):
+        """
+        Store a per-massif collection fetched from Skitour, such as summits or refuges.
+
+        Args:
+            name (str): Name of the collection.
+            massif_id (str): ID of the massif.
+            items (List[Dict]): Items of the collection.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO collections VALUES (?, ?, ?, ?)",
+                (name, str(massif_id), json.dumps(items), time.time()),
+            )
+
+    def get_collection(self, name: str, massif_id: str, ttl: float = TOPO_STORE_TTL) -> Optional[List[Dict]]:
+        """
+        Get a per-massif collection if it has been stored less than `ttl` seconds ago.
+
+        Args:
+            name (str): Name of the collection.
+            massif_id (str): ID of the massif.
+            ttl (float): Maximum age of the collection in seconds.
+
+        Returns:
+            List[Dict]: Items of the collection, None if missing or outdated.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data, synced_at FROM collections WHERE name = ? AND massif_id = ?", (name, str(massif_id))
+            ).fetchone()
+        if row is None or time.time() - row[1] > ttl:
+            return None
+        return json.loads(row[0])
+
+    def known_outing_ids(self, massif_id: str) -> set:
+        """
+        Get the ids of the stored outings of a massif.
+
+        Args:
+            massif_id (str): ID of the massif.
+
+        Returns:
+            set: IDs of the stored outings.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM outings WHERE massif_id = ?", (str(massif_id),)).fetchall()
+        return {row[0] for row in rows}
+
+    def upsert_outings(self, outings: Iterable[Dict], massif_id: str) -> int:
+        """
+        Insert or update outings in the store.
+
+        Args:
+            outings (Iterable[Dict]): Outings as returned by `get_recent_outings`.
+            massif_id (str): ID of the massif.
+
+        Returns:
+            int: Number of outings written.
+        """
+        rows = [(str(outing["id"]), str(massif_id), outing["date"], json.dumps(outing)) for outing in outings]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO outings VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def get_recent_outings(self, massif_id: str, since: str) -> List[Dict]:
+        """
+        Get the stored outings of a massif, most recent first.
+
+        Args:
+            massif_id (str): ID of the massif.
+            since (str): Oldest date to return, as YYYY-MM-DD.
+
+        Returns:
+            List[Dict]: Outings, as returned by `get_recent_outings`.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT data FROM outings WHERE massif_id = ? AND date >= ? ORDER BY date DESC", (str(massif_id), since)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_checkpoint(self, name: str) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Get a synchronization checkpoint.
+
+        Args:
+            name (str): Name of the checkpoint.
+
+        Returns:
+            Tuple[str, float]: Value of the checkpoint and when it was written, (None, None) if missing.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value, updated_at FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def set_checkpoint(self, name: str, value: str):
+        """
+        Write a synchronization checkpoint.
+
+        Args:
+            name (str): Name of the checkpoint.
+            value (str): Value of the checkpoint.
+        """
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)", (name, value, time.time()))
+
+    def search(
+        self,
+        massif_ids: Optional[Iterable[str]] = None,
+        ski_grade_min: Optional[float] = None,
+        ski_grade_max: Optional[float] = None,
+        ascent_grade_max: Optional[str] = None,
+        exposure_max: Optional[int] = None,
+        elevation_gain_min: Optional[int] = None,
+        elevation_gain_max: Optional[int] = None,
+        orientations: Optional[Iterable[str]] = None,
+        near: Optional[Tuple[float, float]] = None,
+        radius_km: float = 20,
+        limit: int = 20,
+    ) -> List[Dict]:
+        """
+        Search the stored topos with indexed filters.
+
+        Args:
+            massif_ids (Iterable[str]): Restrict the search to these massifs.
+            ski_grade_min (float): Minimum ski difficulty, e.g. 2.1.
+            ski_grade_max (float): Maximum ski difficulty, e.g. 3.3.
+            ascent_grade_max (str): Hardest ascent grade among R, F, PD, AD, D, TD, ED.
+            exposure_max (int): Maximum exposure, from 1 to 4.
+            elevation_gain_min (int): Minimum elevation gain in meters.
+            elevation_gain_max (int): Maximum elevation gain in meters.
+            orientations (Iterable[str]): Accepted orientations, e.g. ["N", "NE"].
+            near (Tuple[float, float]): Latitude and longitude the start point must be close to.
+            radius_km (float): Maximum distance to `near` in kilometers.
+            limit (int): Maximum number of topos returned.
+
+        Returns:
+            List[Dict]: Indexed fields of the matching topos.
+        """
+        clauses, params = [], []
+        if massif_ids:
+            massif_ids = [str(massif_id) for massif_id in massif_ids]
+            clauses.append(f"massif_id IN ({','.join('?' * len(massif_ids))})")
+            params.extend(massif_ids)
+        for column, operator, value in (
+            ("ski_grade", ">=", ski_grade_min),
+            ("ski_grade", "<=", ski_grade_max),
+            ("exposure", "<=", exposure_max),
+            ("elevation_gain", ">=", elevation_gain_min),
+            ("elevation_gain", "<=", elevation_gain_max),
+        ):
+            if value is not None:
+                clauses.append(f"{column} {operator} ?")
+                params.append(value)
+        if ascent_grade_max and _ascent_grade(ascent_grade_max):
+            clauses.append("ascent_rank <= ?")
+            params.append(ASCENT_GRADES.index(_ascent_grade(ascent_grade_max)))
+        if orientations:
+            orientations = [_orientation(orientation) for orientation in orientations]
+            clauses.append(f"orientation IN ({','.join('?' * len(orientations))})")
+            params.extend(orientations)
+        if near is not None:
+            # Bounding box on the indexed start coordinates, refined with the exact distance below
+            lat_delta = radius_km / 111.0
+            lon_delta = radius_km / (111.0 * max(cos(radians(near[0])), 0.01))
+            clauses.append("start_lat BETWEEN ? AND ? AND start_lon BETWEEN ? AND ?")
+            params.extend([near[0] - lat_delta, near[0] + lat_delta, near[1] - lon_delta, near[1] + lon_delta])
+
+        query = (
+            "SELECT id, massif_id, name, ski_grade, ascent_grade, exposure, elevation_gain, orientation, start_lat, start_lon "
+            "FROM topos"
+        )
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        if near is None:
+            query += " ORDER BY ski_grade, elevation_gain LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            cursor = self._db.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        for result in results:
+            result["link"] = f"https://skitour.fr/topos/{result['id']}"
+        if near is not None:
+            for result in results:
+                result["distance_km"] = round(haversine(near[0], near[1], result["start_lat"], result["start_lon"]), 1)
+            results = sorted(
+                (result for result in results if result["distance_km"] <= radius_km), key=lambda result: result["distance_km"]
+            )[:int(limit)]
+        return results
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_topo_store() -> TopoStore:
+    """
+    Return the topo store shared by the process, opening it on first use.
+
+    Returns:
+        TopoStore: Shared topo store.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TopoStore()
+    return _store
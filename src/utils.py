@@ -1,30 +1,91 @@
-
 import re
 import json
 import googlemaps
 import os
+import hashlib
+import unicodedata
 from math import radians, sin, cos, sqrt, atan2
 import numpy as np
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 from openai import OpenAI
+from src.cache import TTLCache, SingleFlight, CACHE_DIR, MISSING
+from src.metrics import timed, register_cache, llm_call_purpose
+
+EARTH_RADIUS_KM = 6371
+
+GEOCODE_TTL = 30 * 24 * 3600
+GEOCODE_NEGATIVE_TTL = 24 * 3600
+
+SUMMARIZER_SYSTEM_PROMPT = "You're an expert at summarizing data on weather forecast and avalanche conditions. Summarize the data that's been provided to you below"
+SUMMARY_CACHE_TTL = 6 * 3600
+SUMMARY_CACHE_SIZE = 512
+# Set ALPINE_AGENT_SUMMARY_DISK_CACHE=0 to keep summaries in memory only
+SUMMARY_DISK_CACHE = os.getenv("ALPINE_AGENT_SUMMARY_DISK_CACHE", "1") != "0"
+
+summary_cache = TTLCache(
+    maxsize=SUMMARY_CACHE_SIZE,
+    ttl=SUMMARY_CACHE_TTL,
+    path=os.path.join(CACHE_DIR, "summaries.sqlite") if SUMMARY_DISK_CACHE else None,
+)
+_summary_flights = SingleFlight()
+
+geocode_cache = TTLCache(maxsize=2048, ttl=GEOCODE_TTL, path=os.path.join(CACHE_DIR, "geocode.sqlite"))
+_gmaps_client = None
+register_cache("summary", summary_cache)
+register_cache("geocode", geocode_cache)
+
+def get_gmaps_client() -> googlemaps.Client:
+    """
+    Return the Google Maps client shared by the process, creating it on first use.
+
+    Returns:
+        googlemaps.Client: Google Maps client.
+    """
+    global _gmaps_client
+    if _gmaps_client is None:
+        _gmaps_client = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
+    return _gmaps_client
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a location query so that spelling variants share a cache entry.
+
+    Args:
+        query (str): Location query string.
+
+    Returns:
+        str: Lowercased query without accents nor redundant whitespace.
+    """
+    decomposed = unicodedata.normalize("NFKD", query)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
 
 def geocode_location(query: str) -> Tuple[float, float]:
     """
     Geocode a location query into latitude and longitude.
 
+    Results are cached by normalized query, misses included.
+
     Args:
         query (str): Location query string.
 
     Returns:
         Tuple[float, float]: Latitude and longitude of the location.
     """
-    gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
-    geocode_result = gmaps.places(query)
+    key = normalize_query(query)
+    cached = geocode_cache.get(key)
+    if cached is not MISSING:
+        return tuple(cached) if cached else None
+
+    with timed("http_request", service="google_maps", endpoint="places"):
+        geocode_result = get_gmaps_client().places(query)
     try:
         location = geocode_result['results'][0]['geometry']['location']
-        return location['lat'], location['lng']
-    except:
+    except (KeyError, IndexError, TypeError):
+        geocode_cache.set(key, None, ttl=GEOCODE_NEGATIVE_TTL)
         return None
+    geocode_cache.set(key, [location['lat'], location['lng']])
+    return location['lat'], location['lng']
 
 def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
@@ -39,7 +100,7 @@ def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     Returns:
         float: Distance in kilometers.
     """
-    R = 6371
+    R = EARTH_RADIUS_KM
     lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
     dlat = lat2 - lat1
     dlon = lon2 - lon1
@@ -47,6 +108,141 @@ def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
     return R * c
 
+class SummitIndex:
+    """
+    Vectorized spatial index over the summit clusters of the mountain ranges.
+
+    All summits are stored once as a radians array, grouped by range, so that
+    nearest-range and radius queries are answered in a single NumPy pass
+    instead of a Python loop over every summit.
+
+    Args:
+        clusters (Dict[str, List[Tuple[float, float]]]): Clusters of mountain ranges.
+    """
+
+    def __init__(self, clusters: Dict[str, List[Tuple[float, float]]]):
+        self.labels = [label for label, points in clusters.items() if len(points)]
+        sizes = np.array([len(clusters[label]) for label in self.labels], dtype=np.intp)
+        coords = np.radians(np.array(
+            [point for label in self.labels for point in clusters[label]], dtype=np.float64
+        ).reshape(-1, 2))
+        self._lat = coords[:, 0]
+        self._lon = coords[:, 1]
+        self._cos_lat = np.cos(self._lat)
+        # Start offset of each range in the flat arrays, used by `np.minimum.reduceat`
+        self._offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.intp)
+        # Per-range bounding boxes in degrees: (lat_min, lon_min, lat_max, lon_max)
+        degrees = np.degrees(coords)
+        self.bounding_boxes = {
+            label: (
+                float(degrees[start:start + size, 0].min()),
+                float(degrees[start:start + size, 1].min()),
+                float(degrees[start:start + size, 0].max()),
+                float(degrees[start:start + size, 1].max()),
+            )
+            for label, start, size in zip(self.labels, self._offsets, sizes)
+        }
+
+    def range_distances(self, locations: List[Tuple[float, float]]) -> np.ndarray:
+        """
+        Compute the distance from each location to the closest summit of every range.
+
+        Args:
+            locations (List[Tuple[float, float]]): Latitudes and longitudes of the locations.
+
+        Returns:
+            np.ndarray: Array of shape (len(locations), len(self.labels)) with distances in kilometers.
+        """
+        points = np.radians(np.asarray(locations, dtype=np.float64).reshape(-1, 2))
+        lat = points[:, 0:1]
+        lon = points[:, 1:2]
+        a = np.sin((self._lat - lat) / 2) ** 2 + np.cos(lat) * self._cos_lat * np.sin((self._lon - lon) / 2) ** 2
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+        return np.minimum.reduceat(distances, self._offsets, axis=1)
+
+    def nearest_batch(self, locations: List[Tuple[float, float]], k: int = 3) -> List[List[Tuple[str, float]]]:
+        """
+        Find the k closest mountain ranges for many locations at once.
+
+        Args:
+            locations (List[Tuple[float, float]]): Latitudes and longitudes of the locations.
+            k (int): Number of closest ranges to return per location.
+
+        Returns:
+            List[List[Tuple[str, float]]]: Closest ranges and their distances, for each location.
+        """
+        distances = self.range_distances(locations)
+        k = max(0, min(int(k), len(self.labels)))
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return [
+            [(self.labels[j], float(row[j])) for j in ranked]
+            for row, ranked in zip(distances, order)
+        ]
+
+    def nearest(self, location: Tuple[float, float], k: int = 3) -> List[Tuple[str, float]]:
+        """
+        Find the k closest mountain ranges to a location.
+
+        Args:
+            location (Tuple[float, float]): Latitude and longitude of the location.
+            k (int): Number of closest ranges to return.
+
+        Returns:
+            List[Tuple[str, float]]: Closest ranges and their distances.
+        """
+        return self.nearest_batch([location], k=k)[0]
+
+    def within_batch(self, locations: List[Tuple[float, float]], radius_km: float = 100) -> List[List[Tuple[str, float]]]:
+        """
+        Find all mountain ranges within a given radius of many locations at once.
+
+        Args:
+            locations (List[Tuple[float, float]]): Latitudes and longitudes of the locations.
+            radius_km (float): Search radius in kilometers.
+
+        Returns:
+            List[List[Tuple[str, float]]]: Ranges within the radius sorted by distance, for each location.
+        """
+        distances = self.range_distances(locations)
+        results = []
+        for row in distances:
+            (matches,) = np.nonzero(row < radius_km)
+            matches = matches[np.argsort(row[matches], kind="stable")]
+            results.append([(self.labels[j], float(row[j])) for j in matches])
+        return results
+
+    def within(self, location: Tuple[float, float], radius_km: float = 100) -> List[Tuple[str, float]]:
+        """
+        Find all mountain ranges within a given radius of a location.
+
+        Args:
+            location (Tuple[float, float]): Latitude and longitude of the location.
+            radius_km (float): Search radius in kilometers.
+
+        Returns:
+            List[Tuple[str, float]]: Ranges within the radius sorted by distance.
+        """
+        return self.within_batch([location], radius_km=radius_km)[0]
+
+
+_summit_indexes: Dict[int, Tuple[Dict, SummitIndex]] = {}
+
+def get_summit_index(clusters: Dict[str, List[Tuple[float, float]]]) -> SummitIndex:
+    """
+    Return the spatial index for the given clusters, building it on first use.
+
+    Args:
+        clusters (Dict[str, List[Tuple[float, float]]]): Clusters of mountain ranges.
+
+    Returns:
+        SummitIndex: Spatial index over the clusters.
+    """
+    entry = _summit_indexes.get(id(clusters))
+    if entry is None or entry[0] is not clusters:
+        entry = (clusters, SummitIndex(clusters))
+        _summit_indexes[id(clusters)] = entry
+    return entry[1]
+
 def assign_location_to_clusters(location: Tuple[float, float], clusters: Dict[str, List[Tuple[float, float]]], k: int = 3) -> List[Tuple[str, float]]:
     """
     Assign a location to the closest clusters of mountain ranges based on proximity.
@@ -59,16 +255,21 @@ def assign_location_to_clusters(location: Tuple[float, float], clusters: Dict[st
     Returns:
         List[Tuple[str, float]]: Closest clusters and their distances.
     """
-    closest_summits = []
-    for range_label, points in clusters.items():
-        min_distance = float('inf')
-        for lat, lon in points:
-            dist = haversine(location[0], location[1], lat, lon)
-            if dist < min_distance:
-                min_distance = dist
-        closest_summits.append((range_label, min_distance))
-    closest_summits.sort(key=lambda x: x[1])
-    return closest_summits[:k]
+    return get_summit_index(clusters).nearest(location, k=k)
+
+def assign_locations_to_clusters(locations: List[Tuple[float, float]], clusters: Dict[str, List[Tuple[float, float]]], k: int = 3) -> List[List[Tuple[str, float]]]:
+    """
+    Assign many locations to their closest clusters of mountain ranges in one pass.
+
+    Args:
+        locations (List[Tuple[float, float]]): Latitudes and longitudes of the locations.
+        clusters (Dict[str, List[Tuple[float, float]]]): Clusters of mountain ranges.
+        k (int): Number of closest clusters to return per location.
+
+    Returns:
+        List[List[Tuple[str, float]]]: Closest clusters and their distances, for each location.
+    """
+    return get_summit_index(clusters).nearest_batch(locations, k=k)
 
 def build_clustered_mountain_ranges(peaks):
     """
@@ -112,24 +313,60 @@ def parse_topo_blob(output: str):
 
     return None
 
-def llm_summarizer(text, llm_engine):
-    
-   
-    messages=[
-           {
-            "role": "system",
-            "content": "You're an expert at summarizing data on weather forecast and avalanche conditions. Summarize the data that's been provided to you below"
-        }, 
-        {
-            "role": "user",
-            "content": text,
-        }
-    ]
-    
-    summary = llm_engine(messages)
-    return summary["content"]
-    
-    
-    
-    
-    
\ No newline at end of file
+def summary_key(text: str, model_id: str, system_prompt: str) -> str:
+    """
+    Compute the content address of a summary.
+
+    Args:
+        text (str): Text to summarize.
+        model_id (str): Id of the model producing the summary.
+        system_prompt (str): System prompt of the summarizer.
+
+    Returns:
+        str: SHA-256 hex digest of the inputs.
+    """
+    digest = hashlib.sha256()
+    for part in (model_id, system_prompt, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def llm_summarizer(text, llm_engine, expires_at: Optional[float] = None):
+    """
+    Summarize weather forecast or avalanche conditions data with the LLM engine.
+
+    Summaries are memoized by (text, model id, system prompt): identical inputs are
+    summarized once, and concurrent identical calls share the same LLM call.
+
+    Args:
+        text (str): Data to summarize.
+        llm_engine: Model used to summarize the data.
+        expires_at (float): Timestamp after which the source data is outdated,
+            defaults to `SUMMARY_CACHE_TTL` from now.
+
+    Returns:
+        str: Summary of the data.
+    """
+    model_id = getattr(llm_engine, "model_id", None) or type(llm_engine).__name__
+    key = summary_key(text, model_id, SUMMARIZER_SYSTEM_PROMPT)
+    cached = summary_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    def summarize():
+        messages=[
+               {
+                "role": "system",
+                "content": SUMMARIZER_SYSTEM_PROMPT
+            }, 
+            {
+                "role": "user",
+                "content": text,
+            }
+        ]
+        with timed("llm_call", purpose="summary", model=model_id), llm_call_purpose("summary"):
+            summary = llm_engine(messages)["content"]
+        summary_cache.set(key, summary, expires_at=expires_at)
+        return summary
+
+    return _summary_flights.do(key, summarize)
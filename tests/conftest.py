@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Caches backed by SQLite are created at import time, keep them out of the working tree
+os.environ.setdefault("ALPINE_AGENT_CACHE_DIR", tempfile.mkdtemp(prefix="alpine-agent-tests-"))
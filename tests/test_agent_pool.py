@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+from src.agent_pool import AgentPool, EngineSpec
+
+
+def make_pool(max_engines):
+    return AgentPool(
+        lambda spec: SimpleNamespace(spec=spec), lambda engine: SimpleNamespace(model=engine), max_engines=max_engines
+    )
+
+
+def test_agents_of_a_spec_share_its_engine():
+    pool = make_pool(max_engines=4)
+    spec = EngineSpec("scripted")
+
+    first, second = pool.acquire(spec), pool.acquire(spec)
+
+    assert first.model is second.model is pool.engine(spec)
+
+
+def test_engines_are_kept_while_their_agents_are_leased():
+    pool = make_pool(max_engines=1)
+    busy = EngineSpec("scripted", "busy")
+    agent = pool.acquire(busy)
+
+    # Other specs evict the idle engines, never the engine of a leased agent
+    for api_key in ("a", "b", "c"):
+        pool.prewarm(EngineSpec("scripted", api_key))
+
+    assert pool.engine(busy) is agent.model
+    pool.release(busy, agent)
+    assert pool.acquire(busy).model is agent.model
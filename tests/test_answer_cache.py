@@ -0,0 +1,37 @@
+import time
+
+from src.answer_cache import AnswerCache
+from src.meteo_france_api import bulletin_cache
+
+LOOKUP = {"22": {"name": "Bornes - Aravis", "meteofrance_id": 2, "meteofrance_name": "Aravis"}}
+QUESTION = "Quelles sorties dans les Aravis demain ?"
+
+
+def make_cache():
+    return AnswerCache(LOOKUP, path=None)
+
+
+def test_answer_is_reused_until_its_bulletin_changes():
+    cache = make_cache()
+    bulletin_cache.set("2", "<BRA/>", expires_at=time.time() + 3600)
+    cache.set(QUESTION, {}, "engine", "Answer", [{"id": 1}], {"bra:2"})
+
+    assert cache.get(QUESTION, {}, "engine") == ("Answer", [{"id": 1}])
+
+    bulletin_cache.set("2", "<BRA/>", expires_at=time.time() + 7200)
+    assert cache.get(QUESTION, {}, "engine") is None
+
+
+def test_answer_without_dependencies_is_not_stored():
+    cache = make_cache()
+    cache.set(QUESTION, {}, "engine", "Answer", [], set())
+
+    assert cache.get(QUESTION, {}, "engine") is None
+
+
+def test_answer_from_partial_results_is_not_stored():
+    cache = make_cache()
+    bulletin_cache.set("2", "<BRA/>", expires_at=time.time() + 3600)
+    cache.set(QUESTION, {}, "engine", "Answer", [], {"bra:2", "unavailable:daily_weather_forecast:770"})
+
+    assert cache.get(QUESTION, {}, "engine") is None
@@ -0,0 +1,28 @@
+from src.replay import ScriptedModel, reset_script
+from src.scheduler import BoundedModel
+
+
+def run_steps(model, n_steps):
+    return [model([{"role": "user", "content": "Find a route"}])["content"] for _ in range(n_steps)]
+
+
+def test_consecutive_runs_replay_the_same_steps():
+    engine = BoundedModel(ScriptedModel(["step 1", "step 2", "final"]), max_concurrent=2, name="scripted")
+
+    assert reset_script(engine)
+    first_run = run_steps(engine, 3)
+    assert reset_script(engine)
+    second_run = run_steps(engine, 3)
+
+    assert first_run == ["step 1", "step 2", "final"]
+    assert second_run == first_run
+
+
+def test_last_step_is_repeated():
+    engine = ScriptedModel(["step 1", "final"])
+
+    assert run_steps(engine, 3) == ["step 1", "final", "final"]
+
+
+def test_reset_ignores_other_engines():
+    assert not reset_script(BoundedModel(object(), max_concurrent=1, name="other"))
@@ -0,0 +1,66 @@
+"""
+Indexing of Skitour topos in the local store.
+
+The fixture follows the topo object of the Skitour API (fields listed in `TOPO_FIELDS`), with its
+values as strings; replace it with a payload recorded with `ALPINE_AGENT_HTTP_MODE=record` to
+check the mapping against the live API.
+"""
+import json
+import os
+
+import pytest
+
+from src.topo_store import TopoStore, missing_fields, topo_row
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "skitour_topos.json")
+
+
+@pytest.fixture
+def topos():
+    with open(FIXTURE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TopoStore(str(tmp_path / "topos.sqlite"))
+
+
+def test_topo_row_reads_the_skitour_fields(topos):
+    row = topo_row(topos[0], "25")
+
+    assert row[:11] == (
+        "770", "25", "Mont Blanc, Par les Grands Mulets", 4.2, "PD", 2, 3, 2500, "N", 45.90181, 6.86153,
+    )
+    assert missing_fields(row) == []
+
+
+def test_missing_fields_are_reported(topos):
+    assert missing_fields(topo_row(topos[2], "25")) == ["exposure"]
+
+
+def test_search_filters_on_the_indexed_fields(store, topos):
+    store.upsert_topos(topos, "25")
+
+    found = store.search(massif_ids=["25"], ski_grade_max=3.3, ascent_grade_max="F", orientations=["NW", "E"])
+
+    assert [topo["id"] for topo in found] == ["2051", "104"]
+
+
+def test_topos_keep_the_upstream_order(store, topos):
+    store.upsert_topos(topos, "25")
+    assert [topo["id"] for topo in store.get_topos(["25"])] == ["770", "104", "2051"]
+
+    # A reordered payload is written again even though no topo changed
+    assert store.upsert_topos(topos[::-1], "25") == 2
+    assert [topo["id"] for topo in store.get_topos(["25"])] == ["2051", "104", "770"]
+
+
+def test_full_refresh_deletes_the_topos_removed_upstream(store, topos):
+    store.upsert_topos(topos, "25")
+
+    store.upsert_topos(topos[1:], "25")
+    assert len(store.get_topos(["25"])) == 3
+
+    assert store.upsert_topos(topos[1:], "25", replace=True) == 1
+    assert [topo["id"] for topo in store.get_topos(["25"])] == ["104", "2051"]